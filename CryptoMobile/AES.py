@@ -26,7 +26,7 @@
 # *--------------------------------------------------------
 #*/
 
-__all__ = ['AES_CTR', 'AES_ECB']
+__all__ = ['AES_CTR', 'AES_ECB', 'AES_ECB_rows']
 
 from struct import pack, unpack
 
@@ -40,6 +40,7 @@ from CryptoMobile.utils import *
 
 # try to load pycrypto
 try:
+    import Crypto
     from Crypto.Cipher import AES as AES_pycrypto
 except ImportError:
     _with_pycrypto = False
@@ -55,6 +56,22 @@ except ImportError:
 else:
     _with_pycryptodome = True
 
+# pycryptodome can also be installed as a drop-in replacement of pycrypto, whose
+# CTR mode does not accept a counter function
+if _with_pycrypto and Crypto.version_info[0] >= 3:
+    AES_pycryptodome = AES_pycrypto
+    _with_pycrypto = False
+    _with_pycryptodome = True
+
+
+# try to load numpy, for AES_ECB_rows
+try:
+    import numpy as np
+except ImportError:
+    _with_numpy = False
+else:
+    _with_numpy = True
+
 
 # try to load cryptography
 try:
@@ -211,6 +228,90 @@ class AES_CTR_cryptography(object):
     decrypt = encrypt
 
 
+#------------------------------------------------------------------------------#
+# AES ECB mode with a key per row (for batched Milenage)
+#------------------------------------------------------------------------------#
+
+def _make_sbox():
+    # multiplicative inverse in GF(2^8), followed by the affine transformation
+    exp, log = [0]*255, [0]*256
+    x = 1
+    for i in range(255):
+        exp[i], log[x] = x, i
+        x ^= (x << 1) ^ (0x11b if x & 0x80 else 0)
+    sbox = []
+    for a in range(256):
+        b = exp[(255 - log[a]) % 255] if a else 0
+        s = b
+        for _ in range(4):
+            b = ((b << 1) | (b >> 7)) & 0xff
+            s ^= b
+        sbox.append(s ^ 0x63)
+    return sbox
+
+
+class AES_ECB_rows(object):
+    """AES-128 in ECB mode, implemented with numpy over many keys at once
+    
+    each row of blocks is encrypted with its own key, which is faster than
+    calling a backend once per key when there are few blocks per key
+    """
+    
+    block_size = 16
+    
+    if _with_numpy:
+        SBOX = np.array(_make_sbox(), dtype=np.uint8)
+        RCON = [0x01, 0x02, 0x04, 0x08, 0x10, 0x20, 0x40, 0x80, 0x1b, 0x36]
+        # byte i of the state is row i%4 of column i//4
+        SHIFT = np.array([(i % 4) + 4*((i//4 + i%4) % 4) for i in range(16)])
+        # SubBytes and MixColumns tables, T[j][a] is the column produced by
+        # byte a in row j, as a little endian word
+        _s = SBOX.astype(np.uint32)
+        _x = np.array([((a << 1) ^ (0x1b if a & 0x80 else 0)) & 0xff
+                       for a in _make_sbox()], dtype=np.uint32)
+        T = [(c0 | c1<<8 | c2<<16 | c3<<24).astype('<u4')
+             for (c0, c1, c2, c3) in ((_x, _s, _s, _x^_s),
+                                      (_x^_s, _x, _s, _s),
+                                      (_s, _x^_s, _x, _s),
+                                      (_s, _s, _x^_s, _x))]
+        del _s, _x
+    
+    def __init__(self, keys):
+        """initialize AES in ECB mode with a (n, 16) uint8 array of keys"""
+        if not _with_numpy:
+            raise(CMException('AES_ECB_rows: numpy is not available'))
+        n = len(keys)
+        w = np.empty((44, n), dtype='<u4')
+        w[:4] = np.ascontiguousarray(keys, dtype=np.uint8).view('<u4').T
+        for i in range(4, 44):
+            temp = w[i-1]
+            if i % 4 == 0:
+                # RotWord, SubWord and Rcon
+                temp = (temp >> 8) | (temp << 24)
+                temp = np.take(self.SBOX, temp.view(np.uint8)).view('<u4')
+                temp ^= self.RCON[i//4 - 1]
+            w[i] = w[i-4] ^ temp
+        self.round_keys = np.ascontiguousarray(w.T).view(np.uint8).reshape(n, 11, 16)
+    
+    def encrypt(self, blocks):
+        """encrypt (n, 16) or (n, m, 16) uint8 blocks, row i with key i"""
+        rk = self.round_keys
+        if blocks.ndim == 3:
+            rk = rk[:, :, None]
+        s = blocks ^ rk[:, 0]
+        for r in range(1, 10):
+            # SubBytes, ShiftRows and MixColumns
+            x = np.take(s, self.SHIFT, axis=-1).reshape(s.shape[:-1] + (4, 4))
+            col = np.take(self.T[0], x[..., 0])
+            for j in range(1, 4):
+                col ^= np.take(self.T[j], x[..., j])
+            s = col.view(np.uint8).reshape(s.shape)
+            s ^= rk[:, r]
+        s = np.take(self.SBOX, np.take(s, self.SHIFT, axis=-1))
+        s ^= rk[:, 10]
+        return s
+
+
 #------------------------------------------------------------------------------#
 # AES backend selection
 #------------------------------------------------------------------------------#
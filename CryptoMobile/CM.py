@@ -27,30 +27,58 @@
 # */
 
 from struct import pack, unpack
+from threading import RLock
 #
-from pykasumi import *
-from pysnow import *
-from pyzuc import *
 from .utils import *
 from .CMAC import CMAC
 
+# the KASUMI, SNOW 3G and ZUC extensions are optional: the algorithms of a
+# missing extension are not defined, the others can still be used
 try:
-    from .AES import AES_CTR, AES_ECB
+    from pykasumi import *
+    _with_kasumi = True
+except ImportError:
+    _with_kasumi = False
+
+try:
+    from pysnow import *
+    _with_snow = True
+except ImportError:
+    _with_snow = False
 
-    # filter * export
-    __all__ = ['KASUMI', 'SNOW3G', 'ZUC', 'AES_3GPP',
-               'UEA1', 'UIA1', 'UEA2', 'UIA2',
-               'EEA1', 'EIA1', 'EEA2', 'EIA2', 'EEA3', 'EIA3']
+try:
+    from pyzuc import *
+    _with_zuc = True
+except ImportError:
+    _with_zuc = False
+
+try:
+    from .AES import AES_CTR, AES_ECB
     _with_aes = True
 except ImportError as err:
     print(err)
     print('EEA2 / EIA2 not available')
-    # filter * export
-    __all__ = ['KASUMI', 'SNOW3G', 'ZUC',
-               'UEA1', 'UIA1', 'UEA2', 'UIA2',
-               'EEA1', 'EIA1', 'EEA3', 'EIA3']
     _with_aes = False
 
+# filter * export
+__all__ = []
+if _with_kasumi:
+    __all__ += ['KASUMI', 'UEA1', 'UIA1']
+if _with_snow:
+    __all__ += ['SNOW3G', 'UEA2', 'UIA2', 'EEA1', 'EIA1', 'EEA1_keystreams']
+if _with_aes:
+    __all__ += ['AES_3GPP', 'EEA2', 'EIA2']
+if _with_zuc:
+    __all__ += ['ZUC', 'EEA3', 'EIA3', 'EEA3_keystreams']
+
+# the KASUMI, SNOW 3G and ZUC extensions keep the state of their cipher in
+# global variables: every call into an extension holds its lock, and a
+# sequence of calls using the same state (e.g. _initialize, then
+# _generate_keystream) holds it for the whole sequence
+_kasumi_lock = RLock()
+_snow_lock = RLock()
+_zuc_lock = RLock()
+
 
 class KASUMI(object):
     """UMTS primary encryption / integrity protection algorithm
@@ -89,7 +117,8 @@ class KASUMI(object):
 
     def _keyschedule(self, key):
         try:
-            return kasumi_keyschedule(key)
+            with _kasumi_lock:
+                return kasumi_keyschedule(key)
         except ValueError as err:
             raise (CMException(err))
 
@@ -97,7 +126,8 @@ class KASUMI(object):
 
     def _kasumi(self, data_in):
         try:
-            return kasumi_kasumi(data_in)
+            with _kasumi_lock:
+                return kasumi_kasumi(data_in)
         except ValueError as err:
             raise (CMException(err))
 
@@ -113,7 +143,8 @@ class KASUMI(object):
             bitlen = 8 * len(data_in)
         #
         try:
-            return kasumi_f8(key, count, bearer, dir, data_in, bitlen)
+            with _kasumi_lock:
+                return kasumi_f8(key, count, bearer, dir, data_in, bitlen)
         except ValueError as err:
             raise (CMException(err))
 
@@ -127,7 +158,8 @@ class KASUMI(object):
             bitlen = 8 * len(data_in)
         #
         try:
-            return kasumi_f9(key, count, fresh, dir, data_in, bitlen)
+            with _kasumi_lock:
+                return kasumi_f9(key, count, fresh, dir, data_in, bitlen)
         except ValueError as err:
             raise (CMException(err))
 
@@ -146,6 +178,9 @@ class SNOW3G(object):
 
     _generate_keystream(length [uint32]) -> keystream
 
+    _keystream(key [16 bytes], iv [16 bytes], length [uint32]) -> keystream
+        both of the above, without another thread in between
+
 
     For securing radio frames at UMTS RLC or MAC layer, UMTS modes of operation
     are defined in F8 and F9 methods:
@@ -170,13 +205,19 @@ class SNOW3G(object):
 
     EIA1(key [16 bytes], count [uint32], bearer [uint5], dir [0 or 1], data_in [bytes], bitlen [uint32])
         -> mac [4 bytes]
+
+    keystreams(key [16 bytes], params [list of (count, bearer, dir, length)])
+        -> keystreams [list of bytes]
+
+        the EEA1 keystreams of a key, i.e. the encryption of length zero bytes
     """
     iv_size = 16
     key_size = 16
 
     def _initialize(self, key, iv):
         try:
-            return snow_initialize(key, iv)
+            with _snow_lock:
+                return snow_initialize(key, iv)
         except ValueError as err:
             raise (CMException(err))
 
@@ -193,12 +234,20 @@ class SNOW3G(object):
         #
         try:
             if lastbytes:
-                return snow_generatekeystream(lw)[:length]
+                with _snow_lock:
+                    return snow_generatekeystream(lw)[:length]
             else:
-                return snow_generatekeystream(lw)
+                with _snow_lock:
+                    return snow_generatekeystream(lw)
         except ValueError as err:
             raise (CMException(err))
 
+    def _keystream(self, key, iv, length):
+        # initialize and generate without another thread in between
+        with _snow_lock:
+            self._initialize(key, iv)
+            return self._generate_keystream(length)
+
     def F8(self, key, count, bearer, dir, data_in, bitlen=None):
         # avoid uint32 under/overflow
         if not 0 <= count < MAX_UINT32 or \
@@ -209,7 +258,8 @@ class SNOW3G(object):
             bitlen = 8 * len(data_in)
         #
         try:
-            return snow_f8(key, count, bearer, dir, data_in, bitlen)
+            with _snow_lock:
+                return snow_f8(key, count, bearer, dir, data_in, bitlen)
         except ValueError as err:
             raise (CMException(err))
 
@@ -223,12 +273,20 @@ class SNOW3G(object):
             bitlen = 8 * len(data_in)
         #
         try:
-            return snow_f9(key, count, fresh, dir, data_in, bitlen)
+            with _snow_lock:
+                return snow_f9(key, count, fresh, dir, data_in, bitlen)
         except ValueError as err:
             raise (CMException(err))
 
     EEA1 = F8
 
+    def keystreams(self, key, params):
+        # the extension state is global, so calls of all threads are serialised
+        # anyway: the lock is taken once for all the keystreams of a key
+        with _snow_lock:
+            return [self.F8(key, count, bearer, dir, length * b'\0')
+                    for (count, bearer, dir, length) in params]
+
     def EIA1(self, key, count, bearer, dir, data_in, bitlen=None):
         if not 0 <= bearer < 32:
             raise (CMException('invalid args'))
@@ -253,6 +311,9 @@ class ZUC(object):
 
     _generate_keystream(length [uint32]) -> keystream [bytes]
 
+    _keystream(key [16 bytes], iv [16 bytes], length [uint32]) -> keystream [bytes]
+        both of the above, without another thread in between
+
 
     For securing packets at the LTE PDCP and NAS layers, LTE modes of operation
     are defined in EEA3 and EIA3 methods:
@@ -267,13 +328,19 @@ class ZUC(object):
         -> mac [4 bytes]
 
         optional bitlen argument represents the length of data_in in bits
+
+    keystreams(key [16 bytes], params [list of (count, bearer, dir, length)])
+        -> keystreams [list of bytes]
+
+        the EEA3 keystreams of a key, i.e. the encryption of length zero bytes
     """
     iv_size = 16
     key_size = 16
 
     def _initialize(self, key, iv):
         try:
-            zuc_initialization(key, iv)
+            with _zuc_lock:
+                zuc_initialization(key, iv)
         except ValueError as err:
             raise (CMException(err))
 
@@ -290,12 +357,20 @@ class ZUC(object):
         #
         try:
             if lastbytes:
-                return zuc_generatekeystream(lw)[:length]
+                with _zuc_lock:
+                    return zuc_generatekeystream(lw)[:length]
             else:
-                return zuc_generatekeystream(lw)
+                with _zuc_lock:
+                    return zuc_generatekeystream(lw)
         except ValueError as err:
             raise (CMException(err))
 
+    def _keystream(self, key, iv, length):
+        # initialize and generate without another thread in between
+        with _zuc_lock:
+            self._initialize(key, iv)
+            return self._generate_keystream(length)
+
     def EEA3(self, key, count, bearer, dir, data_in, bitlen=None):
         # avoid uint32 under/overflow
         if not 0 <= count < MAX_UINT32 or \
@@ -306,10 +381,18 @@ class ZUC(object):
             bitlen = 8 * len(data_in)
         #
         try:
-            return zuc_eea3(key, count, bearer, dir, bitlen, data_in)
+            with _zuc_lock:
+                return zuc_eea3(key, count, bearer, dir, bitlen, data_in)
         except ValueError as err:
             raise (CMException(err))
 
+    def keystreams(self, key, params):
+        # the extension state is global, so calls of all threads are serialised
+        # anyway: the lock is taken once for all the keystreams of a key
+        with _zuc_lock:
+            return [self.EEA3(key, count, bearer, dir, length * b'\0')
+                    for (count, bearer, dir, length) in params]
+
     def EIA3(self, key, count, bearer, dir, data_in, bitlen=None):
         # avoid uint32 under/overflow
         if not 0 <= count < MAX_UINT32 or \
@@ -320,7 +403,8 @@ class ZUC(object):
             bitlen = 8 * len(data_in)
         #
         try:
-            return zuc_eia3(key, count, bearer, dir, bitlen, data_in)
+            with _zuc_lock:
+                return zuc_eia3(key, count, bearer, dir, bitlen, data_in)
         except ValueError as err:
             raise (CMException(err))
 
@@ -401,21 +485,26 @@ class AES_3GPP(object):
 # python export   #
 ###################
 #
-_K = KASUMI()
-_S = SNOW3G()
-_Z = ZUC()
+if _with_kasumi:
+    _K = KASUMI()
+    # For 3G
+    UEA1 = _K.F8
+    UIA1 = _K.F9
+if _with_snow:
+    _S = SNOW3G()
+    # For 3G
+    UEA2 = _S.F8
+    UIA2 = _S.F9
+    # For LTE
+    EEA1 = _S.F8
+    EIA1 = _S.EIA1
+    EEA1_keystreams = _S.keystreams
 if _with_aes:
     _A = AES_3GPP()
-# For 3G
-UEA1 = _K.F8
-UIA1 = _K.F9
-UEA2 = _S.F8
-UIA2 = _S.F9
-# For LTE
-EEA1 = _S.F8
-EIA1 = _S.EIA1
-EEA3 = _Z.EEA3
-EIA3 = _Z.EIA3
-if _with_aes:
     EEA2 = _A.EEA2
     EIA2 = _A.EIA2
+if _with_zuc:
+    _Z = ZUC()
+    EEA3 = _Z.EEA3
+    EIA3 = _Z.EIA3
+    EEA3_keystreams = _Z.keystreams
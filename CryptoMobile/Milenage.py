@@ -40,10 +40,16 @@ from struct     import pack, unpack
 from hashlib    import sha256
 #
 from CryptoMobile.utils import *
-from .AES       import AES_ECB
+from .AES       import AES_ECB, AES_ECB_rows
+#
+try:
+    import numpy as np
+except ImportError:
+    # MilenageBatch is then not available
+    np = None
 
 
-__all__ = ['Milenage', 'make_OPc']
+__all__ = ['Milenage', 'MilenageContext', 'MilenageBatch', 'make_OPc']
 
 
 if sys.version_info[0] > 2:
@@ -261,3 +267,175 @@ class Milenage:
         #
         return out5[:6]
 
+
+
+class MilenageContext(Milenage):
+    """Milenage cryptographic functions for a single subscriber
+    
+    OPc and the AES key schedule of K are derived once, when the context is
+    created, and reused by every vector produced for the subscriber.
+    f1, f1star, f2345 and f5star are computed together by f12345, which
+    encrypts RAND xor OPc only once
+    """
+    
+    def __init__(self, K, OP=None, OPc=None):
+        if len(K) != 16 or (OP is None and OPc is None):
+            raise(CMException('MilenageContext: invalid args'))
+        self.K      = K
+        self.OP     = OP
+        self.cipher = AES_ECB(K)
+        if OPc is None:
+            OPc = xor_buf(self.cipher.encrypt(OP), OP)
+        self.OPc    = OPc
+    
+    def f12345(self, RAND, SQN, AMF, concealed=False):
+        """return RES [8], CK [16], IK [16], AK [6], MAC_A [8] and MAC_S [8]
+        bytes buffers or None on error
+        
+        if concealed, SQN is SQN xor AK, as found in an AUTN
+        """
+        if len(RAND) != 16 or len(SQN) != 6 or len(AMF) != 2:
+            log('ERR', 'MilenageContext.f12345: invalid args')
+            return None
+        #
+        OPc, cipher = self.OPc, self.cipher
+        K_OPc_RAND = cipher.encrypt(xor_buf(RAND, OPc))
+        K_OPc_RAND_OPc = xor_buf(K_OPc_RAND, OPc)
+        #
+        out2, out3, out4 = [xor_buf(OPc,
+                                    cipher.encrypt(
+                                    xor_buf(rot_buf16(K_OPc_RAND_OPc, r), c)))
+                            for (r, c) in ((self.r2, self.c2),
+                                           (self.r3, self.c3),
+                                           (self.r4, self.c4))]
+        AK = out2[:6]
+        if concealed:
+            SQN = xor_buf(SQN, AK)
+        #
+        inp  = SQN + AMF + SQN + AMF
+        out1 = xor_buf(cipher.encrypt(
+                       xor_buf(xor_buf(rot_buf16(xor_buf(inp, OPc),
+                                                 self.r1),
+                                       self.c1),
+                               K_OPc_RAND)),
+                       OPc)
+        #
+        return out2[8:16], out3, out4, AK, out1[0:8], out1[8:16]
+
+
+class MilenageBatch(object):
+    """Milenage cryptographic functions for many (K, RAND) pairs at once, with NumPy
+    
+    K, OP / OPc, RAND, SQN and AMF are given as (n, len) uint8 arrays, lists of
+    bytes buffers or a single bytes buffer shared by every row. XOR, rotations
+    and constants are applied to all the rows together. When keys are shared by
+    many rows, AES is called once per distinct K and step with all the blocks of
+    that K, otherwise AES is computed for all the rows at once by AES_ECB_rows
+    """
+    
+    # minimum number of rows per distinct K to call AES once per K
+    ROWS_PER_KEY = 16
+    
+    def __init__(self, K, OP=None, OPc=None):
+        if np is None:
+            raise(CMException('MilenageBatch: numpy is not available'))
+        if OP is None and OPc is None:
+            raise(CMException('MilenageBatch: invalid args'))
+        K = _rows(K, 16)
+        self.rows = None
+        if len(K) == 1:
+            # a single K is shared by every row
+            self.n = None
+            self.groups = [(AES_ECB(K[0].tobytes()), slice(None))]
+        else:
+            self.n = len(K)
+            keys, inverse = np.unique(K, axis=0, return_inverse=True)
+            if self.n < self.ROWS_PER_KEY * len(keys):
+                self.rows = AES_ECB_rows(K)
+            else:
+                # rows sharing a K are encrypted together
+                inverse = inverse.reshape(-1)
+                order = np.argsort(inverse, kind='stable')
+                bounds = np.flatnonzero(np.diff(inverse[order])) + 1
+                self.groups = [(AES_ECB(keys[i].tobytes()), rows)
+                               for (i, rows) in enumerate(np.split(order, bounds))]
+        if OPc is None:
+            OP = self._broadcast(_rows(OP, 16))
+            OPc = self.encrypt(OP) ^ OP
+        self.OPc = _rows(OPc, 16)
+    
+    def _broadcast(self, *args):
+        n = self.n or max(len(a) for a in args)
+        for a in args:
+            if len(a) not in (1, n):
+                raise(CMException('MilenageBatch: invalid args'))
+        args = [np.broadcast_to(a, (n,) + a.shape[1:]) for a in args]
+        return args[0] if len(args) == 1 else args
+    
+    def encrypt(self, blocks):
+        """encrypt (n, 16) or (n, m, 16) uint8 blocks, each row with its own K
+        """
+        if self.rows is not None:
+            return self.rows.encrypt(blocks)
+        out = np.empty_like(blocks)
+        for cipher, rows in self.groups:
+            out[rows] = np.frombuffer(cipher.encrypt(blocks[rows].tobytes()),
+                                      np.uint8).reshape(out[rows].shape)
+        return out
+    
+    @staticmethod
+    def rot(b, r):
+        """rotate (..., 16) uint8 blocks by r bits
+        """
+        ro, rb = r>>3, r%8
+        br = np.roll(b, -ro, axis=-1)
+        if rb:
+            br = (br << rb) | (np.roll(br, -1, axis=-1) >> (8-rb))
+        return br
+    
+    def f12345(self, RAND, SQN, AMF, concealed=False):
+        """return RES (n, 8), CK (n, 16), IK (n, 16), AK (n, 6), MAC_A (n, 8)
+        and MAC_S (n, 8) uint8 arrays
+        
+        if concealed, SQN is SQN xor AK, as found in an AUTN
+        """
+        OPc, RAND, SQN, AMF = self._broadcast(self.OPc, _rows(RAND, 16),
+                                              _rows(SQN, 6), _rows(AMF, 2))
+        K_OPc_RAND = self.encrypt(RAND ^ OPc)
+        K_OPc_RAND_OPc = K_OPc_RAND ^ OPc
+        #
+        inp = [self.rot(K_OPc_RAND_OPc, r) ^ np.frombuffer(c, np.uint8)
+               for (r, c) in ((Milenage.r2, Milenage.c2),
+                              (Milenage.r3, Milenage.c3),
+                              (Milenage.r4, Milenage.c4))]
+        if not concealed:
+            # the input of f1 does not depend on AK, it is encrypted along
+            inp.append(self._f1_input(OPc, K_OPc_RAND, SQN, AMF))
+        out = self.encrypt(np.stack(inp, axis=1)) ^ OPc[:, None]
+        AK = out[:, 0, :6]
+        if concealed:
+            out1 = self.encrypt(self._f1_input(OPc, K_OPc_RAND, SQN ^ AK, AMF)) ^ OPc
+        else:
+            out1 = out[:, 3]
+        #
+        return out[:, 0, 8:16], out[:, 1], out[:, 2], AK, out1[:, 0:8], out1[:, 8:16]
+    
+    def _f1_input(self, OPc, K_OPc_RAND, SQN, AMF):
+        inp = np.concatenate((SQN, AMF, SQN, AMF), axis=1)
+        return self.rot(inp ^ OPc, Milenage.r1) ^ \
+               np.frombuffer(Milenage.c1, np.uint8) ^ K_OPc_RAND
+
+
+def _rows(values, length):
+    """return values as a (n, length) uint8 array, a single bytes buffer giving
+    a single row
+    """
+    if isinstance(values, (bytes, bytearray)):
+        values = [values]
+    if not isinstance(values, np.ndarray):
+        if any(len(v) != length for v in values):
+            raise(CMException('MilenageBatch: invalid args'))
+        values = np.frombuffer(b''.join(values), np.uint8).reshape(-1, length)
+    if values.ndim != 2 or values.shape[1] != length:
+        raise(CMException('MilenageBatch: invalid args'))
+    return values.astype(np.uint8, copy=False)
@@ -1,9 +1,23 @@
 import sys
 import os
+import glob
+import json
 import shutil
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from ltevisualiser import visualiser
-import pyshark
 from analyser import analysis
+from analyser import cache as analysis_cache
+from analyser import subscribers
+from ingest import cache, parallel, tshark
+from analyser.categoriser import ANALYSED
+from analyser.findings import FindingStore
+from analyser.index import CaptureIndex
+from ingest.pcap import with_frames
+from ingest.pool import shared_pool
+from profiler import Profiler
 
 from packet import *
 
@@ -11,20 +25,51 @@ from packet import *
 def control():
     options, parse_options = parse_arguments()
     path = sys.argv[len(sys.argv) - 1]
-    cap = parse_pcap(path, parse_options)
+    profiler = Profiler(options['timings'])
+    if profiler.enabled:
+        analysis.instrument(profiler)
+        profiler.instrument(sys.modules['packet'], ['categorise'])  # packets are categorised while they are read
+        profiler.instrument(visualiser.Visualiser, ['create_image'])
+    if options['batch']:
+        user_db = load_user_db(options['sim']) if options['sim'] else None
+        with profiler.stage('batch'):
+            analyse_batch(find_captures(path), parse_options, options, user_db)
+        return
+    if options['stream']:
+        ue_info = {}
+        if options['sim']:
+            ue_info['user_db'] = load_user_db(options['sim'])
+        with profiler.stage('stream') as stage:
+            packets = profiler.count(read_pcap(path, parse_options, options), stage)
+            print_analysis(analysis.analyse_stream(packets, ue_info))
+        return
+    with profiler.stage('parse_pcap') as stage:
+        cap = parse_pcap(path, parse_options, options)
+        stage['packets'] += len(cap)
     if options['analyse']:
+        ue_info = {}
         if options['sim']:
-            ue_info = {}
-            ue_info['sim_info'] = load_user_db(options['sim'])
-            lte_analyser = analysis.Analyser(cap, list_categories(cap), ue_info)
-        else:
-            lte_analyser = analysis.Analyser(cap, list_categories(cap))
-        lte_analyser.analyse()
+            ue_info['user_db'] = load_user_db(options['sim'])
+            ue_info['subscriber_search'] = options['search']
+        with profiler.stage('analysis', len(cap)):
+            sessions = analyse_sessions(cap, ue_info, path, parse_options, options)
+        for session in sessions:
+            if session.subscriber is not None and session.imsi is None:
+                rntis = ', '.join(str(rnti) for rnti in session.rntis)
+                print(f'Session of UE with RNTI {rntis} belongs to subscriber {session.subscriber}, '
+                      f'found by its authentication request.')
+            if session.error:
+                rntis = ', '.join(str(rnti) for rnti in session.rntis)
+                print(f'WARNING: Session of UE with RNTI {rntis} not fully analysed. {session.error}')
     if options['visualise']:
-        img = visualiser.Visualiser(cap)
+        full_dissection = None if options['full'] else tshark.FrameDissector(path, parse_options, pool=shared_pool())
+        with profiler.stage('index', len(cap)):
+            index = CaptureIndex(cap)
+        img = visualiser.Visualiser(cap, full_dissection, index)
         img.visualise()
     else:
-        print_analysis(cap)
+        with profiler.stage('print_analysis', len(cap)):
+            print_analysis(cap)
 
 def config(path=""):
     """Configures a Wireshark profile such that 4G/LTE packets can be read correctly."""
@@ -52,33 +97,14 @@ def config(path=""):
 
 
 def load_user_db(filename):
-    """Loads a user_db.csv file according to srsRAN standards, and returns these values in a dictionary."""
-    sim_info = None
-    with open(filename, 'r') as f:
-        lines = f.readlines()
-    for line in lines:
-        if '#' not in line:
-            try:
-                data = line.split(',')[1:]
-                sim_info = {
-                    'auth'      : data[0],
-                    'imsi'      : data[1],
-                    'key'       : bytes.fromhex(data[2]),
-                    data[3]     : data[4],
-                    'amf'       : bytes.fromhex(data[5]),
-                    'sqn'       : data[6],
-                    'qci'       : data[7],
-                    'ip_alloc'  : data[8]
-                }
-            except Exception:
-                raise IndexError('Something went wrong reading the file. Make sure you entered the correct filename.')
-            break
-    return sim_info
+    """Loads a user_db.csv file according to srsRAN standards, and returns its subscribers indexed by IMSI."""
+    return subscribers.load(filename)
 
 
 def parse_arguments():
     """Parses command line arguments."""
-    options = {'analyse': True, 'visualise': True, 'sim': None}
+    options = {'analyse': True, 'visualise': True, 'sim': None, 'stream': False, 'cache': True,
+               'jobs': 1, 'full': False, 'batch': None, 'timings': None, 'search': False}
     parse_options = {'-C': '4GLTE'}
     i = 1
     while i < len(sys.argv):
@@ -87,6 +113,14 @@ def parse_arguments():
             continue
         if sys.argv[i] == '-analyse' or sys.argv[i] == '-a':
             options['visualise'] = False
+        if (sys.argv[i] == '-batch' or sys.argv[i] == '-b') and i + 1 < len(sys.argv):
+            if sys.argv[i+1][0] != '-' and sys.argv[i+1].endswith('.json'):
+                options['batch'] = sys.argv[i+1]
+            else:
+                options['batch'] = 'report.json'
+                print('WARNING: Batch option is set, but no report file is provided.')
+                print('Program will write the report to report.json.')
+            options['visualise'] = False
         if sys.argv[i] == '-config' or sys.argv[i] == '-c':
             if i + 1 < len(sys.argv) and sys.argv[i+1][0] != '-' and not sys.argv[i+1].endswith('.pcap'):
                 config(sys.argv[i+1])
@@ -99,12 +133,22 @@ def parse_arguments():
             else:
                 print('WARNING: Filter option is set, but no filter string is provided.')
                 print('Program will be run without filter.')
+        if sys.argv[i] == '-full':
+            options['full'] = True
+        if (sys.argv[i] == '-jobs' or sys.argv[i] == '-j') and i + 1 < len(sys.argv):
+            if sys.argv[i+1].isdigit() and int(sys.argv[i+1]) > 0:
+                options['jobs'] = int(sys.argv[i+1])
+            else:
+                print('WARNING: Jobs option is set, but no number of jobs is provided.')
+                print('Program will dissect the packet capture in a single process.')
         if (sys.argv[i] == '-limit' or sys.argv[i] == '-l') and i + 1 < len(sys.argv):
             if sys.argv[i+1][0] != '-' and not sys.argv[i+1].endswith('.pcap'):
                 parse_options['-c'] = sys.argv[i+1]
             else:
                 print('WARNING: Limit option is set, but no limit count is provided.')
                 print('Program will be run without capture limit.')
+        if sys.argv[i] == '-nocache' or sys.argv[i] == '-n':
+            options['cache'] = False
         if (sys.argv[i] == '-profile' or sys.argv[i] == '-p') and i + 1 < len(sys.argv):
             if sys.argv[i+1][0] != '-' and not sys.argv[i+1].endswith('.pcap'):
                 parse_options['-C'] = sys.argv[i+1]
@@ -117,6 +161,18 @@ def parse_arguments():
             else:
                 print('WARNING: SIM option is set, but no user_db file is provided.')
                 print('Program will not load user_db file.')
+        if sys.argv[i] == '-stream' or sys.argv[i] == '-st':
+            options['stream'] = True
+        if sys.argv[i] == '-search':
+            options['search'] = True
+            options['visualise'] = False
+        if (sys.argv[i] == '-timings' or sys.argv[i] == '-t') and i + 1 < len(sys.argv):
+            if sys.argv[i+1][0] != '-' and sys.argv[i+1].endswith('.json'):
+                options['timings'] = sys.argv[i+1]
+            else:
+                options['timings'] = 'profile.json'
+                print('WARNING: Timings option is set, but no profile file is provided.')
+                print('Program will write the profile to profile.json.')
         if sys.argv[i] == '-visualise' or sys.argv[i] == '-v':
             options['analyse'] = False
         if sys.argv[i] == '-help' or sys.argv[i] == '-h':
@@ -132,6 +188,14 @@ def parse_arguments():
             Analysis results will be shown in the terminal from which
             this program is run.
             
+            -batch <report file>
+            Analyses every .pcap file in a directory, or every file matching
+            a pattern (e.g. "input/enb_*.pcap"), given instead of the filename.
+            Multiple files are analysed at the same time, -jobs sets the number
+            of files (by default the number of cores). The findings, error scores
+            and timing of every file, and the number of findings of every check,
+            are written to a single .json report.
+            
             -config <directory>
             Configures Wireshark and tshark correctly for 4G packet analysis.
             The directory provided is the configuration directory for Wireshark.
@@ -142,13 +206,29 @@ def parse_arguments():
             For information on how to format a capture filter, 
             check the tshark documentation.
             
+            -full
+            Extracts every field of every packet while loading the .pcap file,
+            instead of only the fields used in analysis. Full packet data
+            is then shown without dissecting the packet again.
+            
             -help
             Displays this help message.
             
+            -jobs <number of processes>
+            Splits the .pcap file into chunks which are dissected by multiple
+            tshark processes at the same time. The sessions of different UEs
+            are then analysed by the same number of processes. Recommended
+            for larger packet captures on machines with multiple cores.
+            
             -limit <number of packets>
             Limits the number of packets loaded into the program.
             Recommended for larger packet captures.
             
+            -nocache
+            Always dissects and analyses the .pcap file, instead of loading
+            it and its analysis results from the cache of previously opened
+            packet captures. The cache is stored in "~/.cache/elvis".
+            
             -profile <profile name>
             If you already have a profile that correctly captures LTE traffic,
             you can use this command to use that profile instead.
@@ -156,11 +236,33 @@ def parse_arguments():
             not work correctly, and thus it is recommended to use -config
             and work with the default configuration instead.
             
+            -search
+            Finds the subscriber of UEs whose IMSI is not seen in the capture,
+            by testing their authentication request against every entry of
+            the -sim file. With -jobs, the entries are tested by multiple
+            processes. Not available with -stream.
+            
             -sim <file>
             If you are using srsRAN, use this command to load the user_db.csv
-            in which you are using to connect to the network. Only the first
-            entry will be parsed, so make sure that this is the entry you used to
-            generate the .pcap files.
+            in which you are using to connect to the network. Every UE is
+            analysed with the entry of the IMSI it is seen with. UEs whose
+            IMSI is not seen, or not in the file, use the first entry.
+            Ciphered NAS messages are deciphered with the keys of the entry
+            and analysed like plain messages, except with -stream. The MAC
+            of every integrity protected NAS and RRC message is verified.
+            
+            -stream
+            Analyses the .pcap file while it is being read, without keeping
+            the full packet capture or its findings in memory. The capture
+            is not cached. Implies -analyse.
+            Recommended for very large packet captures.
+            
+            -timings <profile file>
+            Measures the wall time, CPU time, packet throughput and peak memory
+            of every stage of the program, and the time spent in every analysis
+            rule. The measurements are written to a .json profile on exit.
+            Rules run in other processes (-batch, or -jobs with multiple UEs)
+            are not measured separately.
             
             -visualise
             Only show the UI, without performing packet analysis.
@@ -172,37 +274,130 @@ def parse_arguments():
 
 def print_analysis(data):
     for packet in data:
-        if packet.eval != 0 and 'Analysed' in packet.category:
+        if packet.eval != 0 and packet.category & ANALYSED:
             packet_id = packet.full_summary.split()[0]
             print(f'Packet summary: {packet.full_summary}')
             print(f'------------ANALYSIS RESULTS FOR PACKET {packet_id} START------------')
-            print(packet.analysis.rstrip('\n'))
+            print(''.join(packet.analysis).rstrip('\n'))
             print(f'------------ANALYSIS RESULTS FOR PACKET {packet_id} STOP------------')
             print('')
 
 
-def list_categories(data):
-    categories = []
-    for packet in data:
-        for category in packet.category:
-            if category not in categories:
-                categories.append(category)
-    return categories
-
-
-def parse_pcap(path, options):
-    """Parses .pcap data using PyShark library."""
-    pyshark.FileCapture.SUMMARIES_BATCH_SIZE = 4
-    packet_capture = pyshark.FileCapture(path, custom_parameters=options)
-    summaries = pyshark.FileCapture(path, custom_parameters=options, only_summaries=True)
-    raw_capture = pyshark.FileCapture(path, use_json=True, include_raw=True, custom_parameters=options)
-    assert len(packet_capture) == len(summaries) and len(packet_capture) == len(raw_capture)
-    capture = []
-    for packet, summary, raw in zip(packet_capture, summaries, raw_capture):
-        if len(packet.layers) > 2 and vars(packet.layers[2])['_layer_name'] == 'mac-lte':
-            vars(packet.layers[2])['_layer_name'] = 'mac_lte'
-        sentence = summary.summary_line
-        capture.append(Packet(packet, sentence, raw, 0))
+def find_captures(path):
+    """Lists the packet captures in a directory, or the files matching a pattern."""
+    if os.path.isdir(path):
+        return sorted(glob.glob(os.path.join(path, '*.pcap')) + glob.glob(os.path.join(path, '*.pcapng')))
+    return sorted(glob.glob(path))
+
+
+def analyse_capture(path, parse_options, options, user_db=None):
+    """Reads and analyses a single packet capture in batch mode, returning its part of the report."""
+    result = {'file': path, 'packets': 0, 'sessions': 0, 'score': 0, 'findings': [], 'rules': {}, 'error': None}
+    start = time.perf_counter()
+    loaded = None
+    findings = FindingStore()
+    try:
+        cap = list(read_pcap(path, parse_options, dict(options, jobs=1), shared_pool(), findings))
+        loaded = time.perf_counter()
+        result['packets'] = len(cap)
+        ue_info = {'user_db': user_db, 'subscriber_search': options['search']} if user_db else {}
+        result['sessions'] = len(analyse_sessions(cap, ue_info, path, parse_options, dict(options, jobs=1)))
+    except Exception as e:  # a single broken capture should not stop the batch
+        result['error'] = f'{type(e).__name__}: {e}'
+    else:
+        for packet in cap:
+            if packet.eval != 0 and packet.category & ANALYSED:
+                result['score'] += packet.eval
+                result['findings'].append({'packet': packet.id, 'summary': packet.full_summary,
+                                           'score': packet.eval,
+                                           'analysis': [line.rstrip('\n') for line in packet.analysis]})
+        result['rules'] = findings.counts()
+    end = time.perf_counter()
+    if loaded is None:
+        loaded = end
+    result['time'] = {'ingest': loaded - start, 'analysis': end - loaded, 'total': end - start}
+    return result
+
+
+def analyse_batch(paths, parse_options, options, user_db=None):
+    """Analyses packet captures in a pool of processes and writes the results to a single report."""
+    if not paths:
+        print('No packet captures were found.')
+        quit()
+    jobs = options['jobs'] if options['jobs'] > 1 else os.cpu_count()
+    start = time.perf_counter()
+    results = []
+    with ProcessPoolExecutor(max_workers=min(jobs, len(paths))) as executor:
+        analyse = partial(analyse_capture, parse_options=parse_options, options=options, user_db=user_db)
+        for result in executor.map(analyse, paths):
+            results.append(result)
+            if result['error']:
+                print(f'{result["file"]}: {result["error"]}')
+            else:
+                print(f'{result["file"]}: {result["packets"]} packets, {len(result["findings"])} findings, '
+                      f'score {result["score"]} ({result["time"]["total"]:.2f}s)')
+    rules = Counter()
+    for result in results:
+        rules.update(result['rules'])
+    report = {'files': len(results),
+              'failed': sum(1 for result in results if result['error']),
+              'score': sum(result['score'] for result in results),
+              'rules': dict(rules.most_common()),
+              'time': time.perf_counter() - start,
+              'results': results}
+    with open(options['batch'], 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Analysed {len(results)} packet captures in {report["time"]:.2f}s, report written to {options["batch"]}.')
+
+
+def analyse_sessions(cap, ue_info, path, parse_options, options):
+    """Analyses a capture, or reuses the analysis results of a previous run if the capture was analysed before."""
+    if not options['cache']:
+        return analysis.analyse_sessions(cap, ue_info, options['jobs'])
+    key = cache.cache_key(path, parse_options, dissected_fields(options))
+    return analysis_cache.analyse(cap, ue_info, key, options['jobs'])
+
+
+def read_pcap(path, parse_options, options=None, pool=None, findings=None):
+    """Reads .pcap data packet by packet using a single tshark pass, or from the cache if it was read before.
+
+    The raw bytes of every packet are not copied, they are read from a memory map of the capture file.
+    Unless the -full option is used, only the fields used in analysis and visualisation are extracted.
+    A pool of warm tshark processes can be given to save the tshark start-up time when reading many files.
+    The findings of every packet are added to a single store for the capture, which can be given as well.
+    A streamed capture is not cached and has no such store, every packet keeps its own findings instead, so they
+    are released along with the packet once it is printed.
+    """
+    if options is None:
+        options = {'cache': True, 'jobs': 1, 'full': False, 'stream': False}
+    if options['jobs'] > 1:
+        dissect = partial(parallel.dissect, jobs=options['jobs'])
+    else:
+        dissect = partial(tshark.dissect, pool=pool)
+    fields = dissected_fields(options)
+    streamed = options['stream']
+    if options['cache'] and not streamed:
+        records = cache.cached(path, parse_options, dissect, fields)
+    else:
+        records = dissect(path, parse_options, fields)
+    if findings is None and not streamed:
+        findings = FindingStore()
+    for fields, sentence, raw in with_frames(path, records):
+        yield Packet(fields, sentence, raw, 0, findings)
+
+
+def dissected_fields(options):
+    """Lists the fields extracted by tshark, or None if the packets are fully dissected."""
+    return None if options['full'] else analysis.required_fields() + visualiser.FIELDS
+
+
+def parse_pcap(path, parse_options, options=None):
+    """Parses .pcap data using a single tshark pass."""
+    try:
+        capture = list(read_pcap(path, parse_options, options))
+    except tshark.TsharkException as e:
+        print(f'Could not read {path}, {e.message}')
+        quit()
     if len(capture) == 0:
         print("""
         No captures were loaded into the program.
@@ -1,3 +1,12 @@
+# fields of the UE network capability, as sent in the attach request and replayed in the NAS security mode command
+SECURITY_CAPABILITY_FIELDS = ['nas_eps.emm.eea0', 'nas_eps.emm.128eea1', 'nas_eps.emm.128eea2', 'nas_eps.emm.eea3'] + \
+                             [f'nas_eps.emm.eea{i}' for i in range(4, 8)] + \
+                             ['nas_eps.emm.eia0', 'nas_eps.emm.128eia1', 'nas_eps.emm.128eia2', 'nas_eps.emm.eia3'] + \
+                             [f'nas_eps.emm.eia{i}' for i in range(4, 8)] + \
+                             [f'nas_eps.emm.uea{i}' for i in range(0, 8)] + \
+                             [f'nas_eps.emm.uia{i}' for i in range(1, 8)]
+
+
 def safe_dict_get(dictionary, key, default=None):
     try:
         retval = dictionary[key]
@@ -6,8 +15,9 @@ def safe_dict_get(dictionary, key, default=None):
     return retval
 
 
-def get_attach_message(packets, msg_type):
-    for packet in packets:
-        if packet.data.get('nas_eps.nas_msg_emm_type') == msg_type:
-            return packet
-    return None
+class MissingUserEquipmentInfoException(Exception):
+    def __init__(self, sessions=None):
+        """Raised for a session without UE info, or with the sessions of a capture none of which has UE info."""
+        self.message = 'No attach request found, making it impossible to receive UE information.'
+        self.sessions = sessions
+        super().__init__(self.message)
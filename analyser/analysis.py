@@ -1,9 +1,51 @@
-from analyser import safe_dict_get
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from analyser import SECURITY_CAPABILITY_FIELDS, MissingUserEquipmentInfoException
+from analyser import columns
+from analyser.categoriser import ANALYSED, category_names
+from analyser.engine import AnalysisEngine
+from analyser.findings import FindingStore
+from analyser.sessions import partition
+from analyser.subscribers import authentication_request, resolve, search, select_subscriber
+from packet import Packet
+
+import analyser.decryption as decryption
+import analyser.sessions as sessions
+import analyser.subscribers as subscribers
 
 import analyser.smc as smc
 import analyser.identity as identity
 import analyser.authentication as authentication
 import analyser.attach as attach
+import analyser.integrity as integrity
+
+# fields read by the analyser itself, on top of the fields read by the analysis modules
+FIELDS = ['nas_eps.emm.m_tmsi'] + SECURITY_CAPABILITY_FIELDS
+
+# analysis modules in the order they are registered, a module is used if a session has any of its CATEGORIES
+MODULES = [identity, authentication, smc, attach, integrity]
+ANALYSED_CATEGORIES = list(dict.fromkeys(category for module in MODULES for category in module.CATEGORIES))
+
+
+def required_fields():
+    """Lists every field read during analysis, so only these have to be extracted from the packet capture."""
+    fields = []
+    for module_fields in (FIELDS, sessions.FIELDS, subscribers.FIELDS, decryption.FIELDS, identity.FIELDS,
+                          authentication.FIELDS, smc.FIELDS, attach.FIELDS, integrity.FIELDS):
+        for field in module_fields:
+            if field not in fields:
+                fields.append(field)
+    return fields
+
+
+def instrument(profiler):
+    """Measures every rule of the analysis modules, the partitioning into sessions and the reading of UE info."""
+    for module in MODULES:
+        profiler.instrument(module, exclude=['register'])
+    profiler.instrument(sys.modules[__name__], ['partition', 'get_ue_info', 'check_ue_info', 'filter_dictionary'])
+
 
 def filter_dictionary(dictionary, flist):
     new_dict = {}
@@ -15,58 +57,153 @@ def filter_dictionary(dictionary, flist):
     return new_dict
 
 
-def split_packets(data, categories):
-    packets = {}
-    for category in categories:
-        category_data = []
-        for packet in data:
-            if category in packet.category:
-                category_data.append(packet)
-        packets[category] = category_data
-    return packets
+def analyse_stream(packets, ue_info=None):
+    """Analyses a stream of packets, yielding every packet once no more analysis results can be added to it.
+
+    Packets are passed on as soon as they are analysed, only packets whose analysis looks ahead for later
+    messages (e.g. an authentication reject or a security mode failure) are held until the end of the stream.
+    """
+    return Analyser(None, ANALYSED_CATEGORIES, ue_info).stream(packets)
+
+
+def analyse_sessions(packets, ue_info=None, jobs=1, modules=None, recorder=None):
+    """Partitions a capture into the sessions of every UE, and analyses every session with its own UE info.
+
+    With multiple jobs, sessions are analysed in a pool of processes, after which their findings are added to
+    the packets. The analysis of a session without an attach request is stopped, but only if no session has an
+    attach request, MissingUserEquipmentInfoException is raised. Only the given analysis modules are used, if any,
+    and their findings are recorded in the recording finding store, if one is given.
+
+    If the UE info has a user database, every session gets the SIM info of the first IMSI seen in it. If no IMSI
+    is seen and subscriber search is enabled, the subscriber is found by its authentication request instead.
+    The ciphered NAS messages of sessions with SIM info are deciphered before they are analysed.
+    """
+    ue_sessions = partition(packets)
+    for session in ue_sessions:
+        session.subscriber = session.imsi
+        if session.imsi is None and ue_info and ue_info.get('subscriber_search'):
+            session.subscriber = search_subscriber(session, ue_info.get('user_db'), jobs)
+        session_ue_info(session, ue_info)
+    decryption.decrypt(ue_sessions, required_fields())
+    if jobs > 1 and len(ue_sessions) > 1:
+        records = [[(packet.data, packet.full_summary) for packet in session.packets] for session in ue_sessions]
+        chunk_size = max(1, len(ue_sessions) // (4 * jobs))
+        with ProcessPoolExecutor(max_workers=min(jobs, len(ue_sessions))) as executor:
+            analyse = partial(analyse_records, modules=modules, record=recorder is not None)
+            results = executor.map(analyse, records, [session.ue_info for session in ue_sessions],
+                                   chunksize=chunk_size)
+            for (session, (categories, findings, ue_info, error)) in zip(ue_sessions, results):
+                for (i, category) in categories:
+                    session.packets[i].category = category
+                packets = {packet.id: packet for packet in session.packets}
+                for finding in range(len(findings)):
+                    if recorder is not None:
+                        recorder.clock = findings.order[finding]
+                    packets[findings.packets[finding]].add_analysis(findings.rule(finding),
+                                                                    *findings.arguments.get(finding, ()))
+                if recorder is not None:
+                    for (module, marked) in findings.marks.items():
+                        recorder.marks.setdefault(module, []).extend(marked)
+                session.ue_info = ue_info
+                session.error = error
+    else:
+        for session in ue_sessions:
+            session.error = analyse_session(session.packets, session.ue_info, modules, recorder)
+    if ue_sessions and all(session.error for session in ue_sessions):
+        raise MissingUserEquipmentInfoException(ue_sessions)
+    return ue_sessions
+
+
+def session_ue_info(session, ue_info):
+    """Gives a session its own copy of the UE info, with the SIM info of its subscriber."""
+    session.ue_info = dict(ue_info) if ue_info else {}
+    resolve(session.ue_info, session.subscriber)
+    session.ue_info.pop('user_db', None)  # not sent to every worker, the subscriber is known
+
+
+def search_subscriber(session, user_db, jobs):
+    """Finds the subscriber of a session without IMSI by the AUTN of its authentication request."""
+    request = authentication_request(session.packets)
+    if request is None or not user_db:
+        return None
+    return search(user_db, *request, jobs)
+
+
+def analyse_session(packets, ue_info, modules=None, recorder=None):
+    """Analyses the packets of a single UE, returning the message of the exception which stopped the analysis."""
+    mask = 0
+    for packet in packets:
+        mask |= packet.category
+    try:
+        Analyser(packets, category_names(mask), ue_info, modules, recorder).analyse()
+    except MissingUserEquipmentInfoException as e:
+        return e.message
+    return None
+
+
+def analyse_records(records, ue_info, modules=None, record=False):
+    """Analyses a session in a worker process, returning the categories of its analysed packets by position
+    and their findings."""
+    findings = FindingStore(record)
+    packets = [Packet(fields, summary, b'', 0, findings) for (fields, summary) in records]
+    error = analyse_session(packets, ue_info, modules, findings if record else None)
+    categories = [(i, packet.category) for (i, packet) in enumerate(packets) if packet.category & ANALYSED]
+    return categories, findings, ue_info, error
+
+
+def module_name(module):
+    return module.__name__.split('.')[-1]
 
 
 class Analyser:
-    def __init__(self, data, categories, ue_info=None):
-        """Class representing the 4G/LTE network analyser."""
+    def __init__(self, data, categories, ue_info=None, modules=None, recorder=None):
+        """Class representing the 4G/LTE network analyser.
+
+        The analysis modules of the given categories are used, or only those of them named in modules. The other
+        modules are registered but skipped, so findings are recorded in the same order as when every module runs.
+        If the data is given (instead of streamed) and NumPy is available, checks can be evaluated over columns.
+        """
         if ue_info is None:
             ue_info = {}
         self.data = data
-        self.split_data = split_packets(data, categories)
         self.ue_info = ue_info
+        self.ue_info['locations'] = {}
+        self.engine = AnalysisEngine(self.ue_info, recorder, data is not None and columns.available())
+        self.engine.module = module_name(sys.modules[__name__])
+        self.engine.on_packet(get_ue_info, categories)
+        if 'user_db' in self.ue_info:
+            # a streamed capture uses the default subscriber until the IMSI of the UE is seen
+            resolve(self.ue_info)
+            self.engine.on_packet(select_subscriber)
+        self.engine.on_end(check_ue_info)
+        for module in MODULES:
+            if any(category in categories for category in module.CATEGORIES):
+                self.engine.module = module_name(module)
+                module.register(self.engine)
+                if modules is not None and self.engine.module not in modules:
+                    self.engine.skipped.add(self.engine.module)
 
     def analyse(self):
-        self.get_ue_info()
-        if safe_dict_get(self.split_data, 'Identity Request/Response'):
-            identity.analyse(self.split_data['Identity Request/Response'], self.ue_info)
-        if safe_dict_get(self.split_data, 'Authentication Procedure'):
-            authentication.analyse(self.split_data['Authentication Procedure'], self.ue_info)
-        if safe_dict_get(self.split_data, 'Security Mode Command'):
-            smc.analyse(self.split_data['Security Mode Command'], self.ue_info)
-        if safe_dict_get(self.split_data, 'Attach Procedure'):
-            attach.analyse(self.data, self.split_data['Attach Procedure'], self.ue_info)
-
-    def get_ue_info(self):
-        """Get UE info based on attach request packet."""
-
-        # find interesting packets
-        request = None
-        for (_, category) in self.split_data.items():
-            for packet in category:
-                if 'Attach request' in packet.full_summary:
-                    request = packet.data
-                    break
-        if not request:
-            raise MissingUserEquipmentInfoException
-
-        # get interesting values
-        self.ue_info['locations'] = {}
-        self.ue_info['m-tmsi'] = request.get('nas_eps_emm_m_tmsi')
-        self.ue_info['security_capabilities'] = filter_dictionary(vars(request)['_all_fields'], ['eea', 'eia', 'uea', 'uia', '.gea'])
-        self.ue_info['security_capabilities'] = {k.split('.')[-1]: v for (k, v) in self.ue_info['security_capabilities'].items()}
+        for _ in self.stream(self.data):
+            pass
+
+    def stream(self, packets):
+        """Analyses the packets in a single pass, yielding them once no more analysis results can be added."""
+        return self.engine.run(packets)
+
+
+def get_ue_info(packet, engine, ue_info):
+    """Get UE info based on the first attach request packet."""
+    if 'security_capabilities' in ue_info or 'Attach request' not in packet.full_summary:
+        return
+
+    # get interesting values
+    request = packet.data
+    ue_info['m-tmsi'] = request.get('nas_eps.emm.m_tmsi')
+    ue_info['security_capabilities'] = filter_dictionary(request, ['eea', 'eia', 'uea', 'uia', '_gea'])
+    ue_info['security_capabilities'] = {k.split('_')[-1]: v for (k, v) in ue_info['security_capabilities'].items()}
 
 
-class MissingUserEquipmentInfoException(Exception):
-    def __init__(self):
-        self.message = 'No attach request found, making it impossible to receive UE information.'
-        super().__init__(self.message)
+def check_ue_info(last_packet, engine, ue_info):
+    if 'security_capabilities' not in ue_info:
+        raise MissingUserEquipmentInfoException
@@ -1,100 +1,235 @@
-from analyser import safe_dict_get, get_attach_message
+from analyser import safe_dict_get
+from analyser.categoriser import ANALYSED, category_mask
+from analyser.columns import np
+from analyser.engine import EMM_TYPE, PRESENT
+from analyser.findings import Severity, rule
+from analyser.smc import RRC_SMC_COMMAND
 
+# fields read by this analyser, only these are extracted from the packet capture
+FIELDS = ['nas_eps.nas_msg_emm_type', 'lte-rrc.SRB_ToAddMod_element', 'rlc-lte.mode', 'rlc-lte.channel-type',
+          'rlc-lte.channel-id', 'pdcp-lte.security-config.ciphering', 'pdcp-lte.security-config.integrity']
+
+CATEGORIES = ['Attach Procedure']
+ATTACH_MASK = category_mask(CATEGORIES)
+# analysis modules whose UE info is read by this analyser, they are run along with it
+DEPENDENCIES = ['smc']
+
+NO_SRB_TO_ADD_MOD = rule('attach.no-srb-to-add-mod', Severity.MAJOR_WARNING,
+                         'No SRB-ToAddMod present. From attach accept, NAS/RRC should travel over SRB2.')
+CAPABILITY_BEFORE_SECURITY = rule('attach.capability-before-security', Severity.MAJOR_WARNING,
+                                  'Capabilities sent before security options were set.\nA malicious actor could perform downgrade attacks or accelerated battery draining.')
+RLC_NOT_ACKNOWLEDGED = rule('attach.rlc-not-acknowledged', Severity.MAJOR_WARNING,
+                            'RLC not travelling over acknowledged mode. In the attach process, every packet should be acknowledged.')
+NOT_SRB = rule('attach.not-srb', Severity.ERROR, 'Attach message not travelling over SRB. This should always be the case.')
+SRB1_AFTER_ACCEPT = rule('attach.srb1-after-accept', Severity.MAJOR_WARNING,
+                         'Attach message travelling over SRB1 after attach accept.')
+NOT_SRB1_OR_SRB2 = rule('attach.not-srb1-or-srb2', Severity.ERROR,
+                        'Attach message not travelling over SRB1 or SRB2 after attach accept.')
+NOT_SRB1 = rule('attach.not-srb1', Severity.ERROR,
+                'Attach message not travelling over SRB1. This should always be the case during the attach procedure.')
+PDCP_CIPHERING_MISMATCH = rule('attach.pdcp-ciphering-mismatch', Severity.MAJOR_WARNING,
+                               'PDCP ciphering algorithm does not match configured algorithm.')
+PDCP_INTEGRITY_MISMATCH = rule('attach.pdcp-integrity-mismatch', Severity.MAJOR_WARNING,
+                               'PDCP integrity algorithm does not match configured algorithm.')
+INCOMPLETE = rule('attach.incomplete', Severity.WARNING,
+                  'Attach procedure incomplete.\nIf there are no possible causes listed in this packet, it might be because of an invalid MAC.')
+INCOMPLETE_INVALID_MAC = rule('attach.incomplete-invalid-mac', Severity.ERROR,
+                              'Attach procedure incomplete.\nThis might be because of an invalid PDCP MAC.')
 
-def analyse(packets, attach_packets, ue_info):
-    # check for possible disruption of service because of invalid MAC
-    mac_invalid_behaviour(packets, attach_packets, ue_info)
 
-    # check if security options are used correctly if there is a security mode command in pcap
-    if safe_dict_get(ue_info['locations'], 'rrc_smc'):
-        correct_security_options(packets, ue_info)
+def register(engine):
+    engine.ue_info['attach'] = {'last': None, 'capability': None, 'rlc_pending': [], 'security': []}
+    engine.on_message(EMM_TYPE, '65', attach_request, CATEGORIES)  # in RRCConnectionSetupComplete
+    engine.on_message(EMM_TYPE, '66', attach_accept, CATEGORIES)  # in RRCConnectionReconfiguration
+    engine.on_packet(rrc_connection_reconfiguration, ['RRC Connection Establishment'])
 
-    # check if the right bearers are used in analysis, and if RLC uses acknowledged mode
-    correct_bearer_in_attach(attach_packets, ue_info)
-    correct_rlc_mode(attach_packets)
+    if engine.columnar:
+        # check security options, bearers and RLC mode of every packet at once, at the end of the capture
+        engine.on_message(RRC_SMC_COMMAND, PRESENT, rrc_security_mode_command, ['Security Mode Command'])
+        engine.on_packet(track_attach_packet, CATEGORIES)
+        engine.on_columns(check_columns)
+    else:
+        # check if security options are used correctly if there is a security mode command in pcap
+        engine.on_packet(correct_security_options)
+
+        # check if the right bearers are used in analysis, and if RLC uses acknowledged mode
+        engine.on_packet(attach_packet, CATEGORIES)
+
+    # check for possible disruption of service because of invalid MAC
+    engine.on_end(mac_invalid_behaviour)
 
     # check if UE capabilities are transmitted after security options are set
-    capability_after_security(attach_packets, ue_info)
+    engine.on_end(capability_after_security)
+
+
+def attach_request(packet, engine, ue_info):
+    """Finds where SRB1 should be used, from the RRCConnectionSetupComplete carrying the attach request."""
+    if safe_dict_get(ue_info['locations'], 'attach_request'):
+        return
+    ue_info['locations']['attach_request'] = packet.id
+
+    # RLC mode of attach packets before the attach request is only checked once there is an attach procedure
+    for pending in ue_info['attach']['rlc_pending']:
+        correct_rlc_mode(pending)
+        engine.release(pending)
+    ue_info['attach']['rlc_pending'] = []
+
+
+def attach_accept(packet, engine, ue_info):
+    """Finds where SRB2 should be used, from the RRCConnectionReconfiguration carrying the attach accept."""
+    if safe_dict_get(ue_info['locations'], 'attach_accept'):
+        return
+    ue_info['locations']['attach_accept'] = packet.id
+    if not packet.data.get('lte-rrc.SRB_ToAddMod_element'):
+        packet.add_analysis(NO_SRB_TO_ADD_MOD)
+
+
+def rrc_connection_reconfiguration(packet, engine, ue_info):
+    # if RRCConnectionReconfiguration does not occur, attach procedure is incomplete
+    if 'RRCConnectionReconfiguration' in packet.summary:
+        ue_info['locations']['rrc_reconfiguration'] = packet.id
+
+
+def attach_packet(packet, engine, ue_info):
+    correct_bearer_in_attach(packet, ue_info)
+    if safe_dict_get(ue_info['locations'], 'attach_request'):
+        correct_rlc_mode(packet)
+    else:
+        engine.hold(packet)
+        ue_info['attach']['rlc_pending'].append(packet)
+    track_attach_packet(packet, engine, ue_info)
+
+
+def track_attach_packet(packet, engine, ue_info):
+    """Holds the last attach packet and UE capability information, they are checked at the end of the capture."""
+    state = ue_info['attach']
+    if state['last']:
+        engine.release(state['last'])
+    engine.hold(packet)
+    state['last'] = packet
+    if 'UECapabilityInformation' in packet.full_summary:
+        if state['capability']:
+            engine.release(state['capability'])
+        engine.hold(packet)
+        state['capability'] = packet
 
 
-def capability_after_security(attach_packets, ue_info):
-    # find UE capability information
-    capability = None
-    for packet in attach_packets:
-        if 'UECapabilityInformation' in packet.full_summary:
-            capability = packet
+def capability_after_security(last_packet, engine, ue_info):
+    capability = ue_info['attach']['capability']
     if not capability:
         return
 
-    if capability.id < ue_info['locations']['rrc_smc']:
-        capability.add_analysis(
-            'Capabilities sent before security options were set.\nA malicious actor could perform downgrade attacks or accelerated battery draining.',
-            2)
-
-
-def correct_rlc_mode(attach_packets):
-    """Checks if every attach packet uses RLC acknowledged mode."""
-    rrc_conn_setup_complete = get_attach_message(attach_packets, '65')
-    if not rrc_conn_setup_complete:
-        return  # no attach procedure should happen so no need to check for correct RLC mode
-    for packet in attach_packets:
-        if not packet.data.get('rlc-lte.mode') == '4':
-            packet.add_analysis(
-                'RLC not travelling over acknowledged mode. In the attach process, every packet should be acknowledged.',
-                2)
-
-
-def correct_bearer_in_attach(attach_packets, ue_info):
-    """Checks if correct SRB is used in packets and if correct RLC modes are used."""
-    # get RRCConnectionSetupComplete to find where SRB1 should be used
-    rrc_conn_setup_complete = get_attach_message(attach_packets, '65')
-    if rrc_conn_setup_complete:
-        ue_info['locations']['attach_accept'] = rrc_conn_setup_complete.id
-
-    # get RRCConnectionReconfiguration to find where SRB2 should be used
-    rrc_conn_reconf = get_attach_message(attach_packets, '66')
-    if rrc_conn_reconf:
-        ue_info['locations']['attach_accept'] = rrc_conn_reconf.id
-
-    if rrc_conn_reconf and not rrc_conn_reconf.data.get('lte-rrc.SRB_ToAddMod_element'):
-        rrc_conn_reconf.add_analysis('No SRB-ToAddMod present. From attach accept, NAS/RRC should travel over SRB2.', 2)
-
-    # for all packets, check for correct SRB
-    for packet in attach_packets:
-        if rrc_conn_reconf and packet.id > rrc_conn_reconf.id + 1:
-            if packet.data.get('rlc-lte.channel-type') != '4':
-                packet.add_analysis('Attach message not travelling over SRB. This should always be the case.', 3)
-            elif packet.data.get('rlc-lte.channel-id') == '1':
-                packet.add_analysis('Attach message travelling over SRB1 after attach accept.', 2)
-            elif packet.data.get('rlc-lte.channel-id') != '2':
-                packet.add_analysis('Attach message not travelling over SRB1 or SRB2 after attach accept.', 3)
-        elif packet.id >= rrc_conn_setup_complete.id:
-            if packet.data.get('rlc-lte.channel-type') != '4':
-                packet.add_analysis('Attach message not travelling over SRB. This should always be the case.', 3)
-            elif packet.data.get('rlc-lte.channel-id') != '1' and 'Ciphered message' not in packet.full_summary:
-                packet.add_analysis(
-                    'Attach message not travelling over SRB1. This should always be the case during the attach procedure.',
-                    3)
-
-
-def correct_security_options(packets, ue_info):
-    """Checks if correct security options are used every time for PDCP."""
-    rrc_smc = ue_info['locations']['rrc_smc'] + 1
-    secure_packets = packets[rrc_smc:]
+    rrc_smc = safe_dict_get(ue_info['locations'], 'rrc_smc')
+    if rrc_smc is None or capability.id < rrc_smc:
+        capability.add_analysis(CAPABILITY_BEFORE_SECURITY)
+
+
+def correct_rlc_mode(packet):
+    """Checks if an attach packet uses RLC acknowledged mode."""
+    if not packet.data.get('rlc-lte.mode') == '4':
+        packet.add_analysis(RLC_NOT_ACKNOWLEDGED)
+
+
+def correct_bearer_in_attach(packet, ue_info):
+    """Checks if correct SRB is used in an attach packet."""
+    rrc_conn_setup_complete = safe_dict_get(ue_info['locations'], 'attach_request')
+    rrc_conn_reconf = safe_dict_get(ue_info['locations'], 'attach_accept')
+    if rrc_conn_reconf and packet.id > rrc_conn_reconf + 1:
+        if packet.data.get('rlc-lte.channel-type') != '4':
+            packet.add_analysis(NOT_SRB)
+        elif packet.data.get('rlc-lte.channel-id') == '1':
+            packet.add_analysis(SRB1_AFTER_ACCEPT)
+        elif packet.data.get('rlc-lte.channel-id') != '2':
+            packet.add_analysis(NOT_SRB1_OR_SRB2)
+    elif rrc_conn_setup_complete and packet.id >= rrc_conn_setup_complete:
+        if packet.data.get('rlc-lte.channel-type') != '4':
+            packet.add_analysis(NOT_SRB)
+        elif packet.data.get('rlc-lte.channel-id') != '1' and 'Ciphered message' not in packet.full_summary:
+            packet.add_analysis(NOT_SRB1)
+
+
+def correct_security_options(packet, engine, ue_info):
+    """Checks if correct security options are used every time for PDCP after the RRC security mode command."""
+    rrc_smc = safe_dict_get(ue_info['locations'], 'rrc_smc')
+    if not rrc_smc or packet.id <= rrc_smc + 1 or 'RRC' not in packet.summary:
+        return
     ca = ue_info['rrc_ca'][-1]
     ia = ue_info['rrc_ia'][-1]
-    for packet in secure_packets:
-        if 'RRC' in packet.summary:
-            packet_ca = packet.data.get('pdcp-lte.security-config.ciphering')
-            if not ca == packet_ca:
-                packet.add_analysis('PDCP ciphering algorithm does not match configured algorithm.', 2)
-            packet_ia = packet.data.get('pdcp-lte.security-config.integrity')
-            if not ia == packet_ia:
-                packet.add_analysis('PDCP integrity algorithm does not match configured algorithm.', 2)
-            packet.category.append('Analysed')
-
-
-def mac_invalid_behaviour(packets, attach_packets, ue_info):
+    packet_ca = packet.data.get('pdcp-lte.security-config.ciphering')
+    if not ca == packet_ca:
+        packet.add_analysis(PDCP_CIPHERING_MISMATCH)
+    packet_ia = packet.data.get('pdcp-lte.security-config.integrity')
+    if not ia == packet_ia:
+        packet.add_analysis(PDCP_INTEGRITY_MISMATCH)
+    packet.category |= ANALYSED
+
+
+def rrc_security_mode_command(packet, engine, ue_info):
+    """Keeps the algorithms configured by every RRC security mode command, after they were read by analyser.smc."""
+    ue_info['attach']['security'].append((packet.id, ue_info['rrc_ca'][-1], ue_info['rrc_ia'][-1]))
+
+
+def check_columns(columns, engine, ue_info):
+    """Checks the security options, bearers and RLC mode of every packet at once.
+
+    The checks are the same as correct_security_options, correct_bearer_in_attach and correct_rlc_mode, the
+    findings of every packet are added in the same order as well. The engine lists them before the findings of
+    later modules (e.g. analyser.integrity), where the per-packet checks would have added them.
+    """
+    (ciphering, integrity) = security_option_mismatches(columns, engine, ue_info)
+    (not_srb, srb1_after_accept, not_srb1_or_srb2, not_srb1) = bearer_mismatches(columns, ue_info)
+    rlc = columns.none()
+    if safe_dict_get(ue_info['locations'], 'attach_request'):
+        rlc = columns.in_categories(ATTACH_MASK) & ~columns.equals('rlc-lte.mode', '4')
+    checks = [(ciphering, PDCP_CIPHERING_MISMATCH), (integrity, PDCP_INTEGRITY_MISMATCH), (not_srb, NOT_SRB),
+              (srb1_after_accept, SRB1_AFTER_ACCEPT), (not_srb1_or_srb2, NOT_SRB1_OR_SRB2), (not_srb1, NOT_SRB1),
+              (rlc, RLC_NOT_ACKNOWLEDGED)]
+    failed = columns.none()
+    for (mask, _) in checks:
+        failed |= mask
+    for i in np.flatnonzero(failed):
+        packet = columns.packets[i]
+        for (mask, finding) in checks:
+            if mask[i]:
+                packet.add_analysis(finding)
+
+
+def security_option_mismatches(columns, engine, ue_info):
+    """Finds the RRC packets after a security mode command whose PDCP algorithms differ from the configured ones,
+    and marks every checked packet as analysed."""
+    commands = ue_info['attach']['security']
+    if not commands:
+        return columns.none(), columns.none()
+    command_ids = np.array([command_id for (command_id, _, _) in commands])
+    last = np.searchsorted(command_ids, columns.ids, side='right') - 1  # last command before every packet
+    checked = (last >= 0) & (columns.ids > command_ids[last.clip(0)] + 1)
+    checked &= columns.summary_contains('RRC', short=True, mask=checked)
+    for packet in columns.rows(checked):
+        engine.mark(packet)
+    ciphering = np.array([columns.code('pdcp-lte.security-config.ciphering', ca) for (_, ca, _) in commands])
+    integrity = np.array([columns.code('pdcp-lte.security-config.integrity', ia) for (_, _, ia) in commands])
+    return (checked & (columns.codes('pdcp-lte.security-config.ciphering')[0] != ciphering[last.clip(0)]),
+            checked & (columns.codes('pdcp-lte.security-config.integrity')[0] != integrity[last.clip(0)]))
+
+
+def bearer_mismatches(columns, ue_info):
+    """Finds the attach packets which do not use the right SRB."""
+    rrc_conn_setup_complete = safe_dict_get(ue_info['locations'], 'attach_request')
+    rrc_conn_reconf = safe_dict_get(ue_info['locations'], 'attach_accept')
+    attach = columns.in_categories(ATTACH_MASK)
+    after_accept = attach & (columns.ids > rrc_conn_reconf + 1) if rrc_conn_reconf else columns.none()
+    after_request = attach & ~after_accept & (columns.ids >= rrc_conn_setup_complete) \
+        if rrc_conn_setup_complete else columns.none()
+    srb = columns.equals('rlc-lte.channel-type', '4')
+    srb1 = columns.equals('rlc-lte.channel-id', '1')
+    srb2 = columns.equals('rlc-lte.channel-id', '2')
+    not_srb1 = after_request & srb & ~srb1
+    not_srb1 &= ~columns.summary_contains('Ciphered message', mask=not_srb1)
+    return ((after_accept | after_request) & ~srb, after_accept & srb & srb1, after_accept & srb & ~srb1 & ~srb2,
+            not_srb1)
+
+
+def mac_invalid_behaviour(last_packet, engine, ue_info):
     """Finds if unfinished attach occurred and looks if behaviour could be caused by an invalid PDCP MAC.
 
     In this case, behaviour caused by an invalid MAC is defined as follows:
@@ -106,23 +241,18 @@ def mac_invalid_behaviour(packets, attach_packets, ue_info):
       Capture file could simply be incomplete, or could be because of invalid MAC.
       This behaviour can be found in enb_mac_incomplete.pcap
     """
-
-    # find if RRCConnectionReconfiguration occurred, if not, attach procedure is incomplete
-    complete = False
-    for packet in packets:
-        if 'RRCConnectionReconfiguration' in packet.summary:
-            complete = True
+    last_attach = ue_info['attach']['last']
+    if not last_attach:
+        return
+    complete = safe_dict_get(ue_info['locations'], 'rrc_reconfiguration') is not None
     if complete or safe_dict_get(ue_info,
                                  'rrc_ca') != 'eea0':  # if AS ciphering is enabled, we will not be able to know if attach finished
         return
 
     # find if attach packet is last packet of capture
-    last_attach = attach_packets[-1]
-    if last_attach == packets[-1]:
+    if last_attach is last_packet:
         # send warning for possible incomplete file or invalid PDCP MAC
-        last_attach.add_analysis(
-            'Attach procedure incomplete.\nIf there are no possible causes listed in this packet, it might be because of an invalid MAC.',
-            1)
+        last_attach.add_analysis(INCOMPLETE)
     else:
         # send error for probable invalid PDCP MAC
-        last_attach.add_analysis('Attach procedure incomplete.\nThis might be because of an invalid PDCP MAC.', 3)
+        last_attach.add_analysis(INCOMPLETE_INVALID_MAC)
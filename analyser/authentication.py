@@ -1,21 +1,58 @@
-from analyser import *
-from CryptoMobile.Milenage import Milenage
-
-
-def analyse(packets, ue_info):
-    for packet in packets:
-        if packet.data.get('nas_eps.nas_msg_emm_type') == '82':
-            nas_authentication_82(packet, packets, ue_info)  # NAS authentication request
-        elif packet.data.get('nas_eps.nas_msg_emm_type') == '83':
-            nas_authentication_83(packet, packets, ue_info)  # NAS authentication response
-        elif packet.data.get('nas_eps.nas_msg_emm_type') == '84':
-            nas_authentication_84(packet, packets, ue_info)  # NAS authentication reject
-        elif packet.data.get('nas_eps.nas_msg_emm_type') == '92':
-            nas_authentication_92(packet, packets, ue_info)  # NAS authentication failure
-        packet.category.append('Analysed')
-
+from functools import lru_cache
 
-def nas_authentication_82(packet, packets, ue_info):
+from analyser import *
+from analyser.engine import EMM_TYPE, mark_analysed
+from analyser.findings import Severity, rule
+from CryptoMobile.Milenage import MilenageContext
+
+# fields read by this analyser, only these are extracted from the packet capture
+FIELDS = ['nas_eps.nas_msg_emm_type', 'gsm_a.dtap.rand', 'gsm_a.dtap.autn', 'nas_eps.emm.res', 'nas_eps.emm.cause']
+
+
+CATEGORIES = ['Authentication Procedure']
+# analysis modules whose UE info is read by this analyser, they are run along with it
+DEPENDENCIES = []
+
+RAND_MISSING = rule('authentication.rand-missing', Severity.ERROR, 'RAND value not present.')
+AUTN_MISSING = rule('authentication.autn-missing', Severity.ERROR, 'AUTN value not present.')
+RES_NOT_ANALYSED = rule('authentication.res-not-analysed', Severity.WARNING, 'RES value not analysed.')
+RES_MISMATCH = rule('authentication.res-mismatch', Severity.ERROR, 'RES ({}) does not match expected value ({})')
+REJECT_MISSING = rule('authentication.reject-missing', Severity.ERROR,
+                      'No authentication reject was sent after mismatch in RES values.')
+REJECT_BEFORE_RESPONSE = rule('authentication.reject-before-response', Severity.MAJOR_ERROR,
+                              'Authentication reject sent before authentication response.\nThis could be because of a malicious eNodeB carrying out a disruption of service attack.')
+REJECT_RES_NOT_ANALYSED = rule('authentication.reject-res-not-analysed', Severity.NOTE,
+                               'RES was not analysed in authentication response.\nTo analyse RES, use -sim option.')
+REJECT_RES_MATCHED = rule('authentication.reject-res-matched', Severity.ERROR,
+                          'Authentication reject was sent, though RES matched XRES.')
+FAILURE_BEFORE_RESPONSE = rule('authentication.failure-before-response', Severity.ERROR,
+                               'Authentication failure sent before authentication response.')
+FAILURE_MAC_NOT_ANALYSED = rule('authentication.failure-mac-not-analysed', Severity.NOTE,
+                                'MAC was not analysed in authentication response.\nTo analyse MAC, use -sim option.')
+FAILURE_MAC_MATCHED = rule('authentication.failure-mac-matched', Severity.ERROR,
+                           'Authentication failure was sent with cause 20 (MAC failure), though MAC was as expected.')
+NO_SIM_INFO = rule('authentication.no-sim-info', Severity.NOTE,
+                   'No SIM info available.\nTo analyse authentication response, use -sim option.')
+KEY_UNKNOWN = rule('authentication.key-unknown', Severity.WARNING,
+                   'RES value can not be analysed, due to the key not being known.\nTo analyse RES value, use -sim option.')
+ALGORITHM_UNKNOWN = rule('authentication.algorithm-unknown', Severity.WARNING,
+                         'RES value can not be analysed, due to the algorithm not being known.\nTo analyse RES value, use -sim option.')
+MAC_MISMATCH = rule('authentication.mac-mismatch', Severity.MAJOR_ERROR, 'MAC ({}) does not match calculated value ({})')
+FAILURE_MISSING = rule('authentication.failure-missing', Severity.ERROR,
+                       'No authentication failure message sent after mismatch in expected value.')
+
+MILENAGE_CONTEXTS = 65536  # subscribers whose OPc and AES key schedule are kept, e.g. while searching a subscriber
+
+
+def register(engine):
+    engine.on_message(EMM_TYPE, '82', nas_authentication_82, CATEGORIES)  # NAS authentication request
+    engine.on_message(EMM_TYPE, '83', nas_authentication_83, CATEGORIES)  # NAS authentication response
+    engine.on_message(EMM_TYPE, '84', nas_authentication_84, CATEGORIES)  # NAS authentication reject
+    engine.on_message(EMM_TYPE, '92', nas_authentication_92, CATEGORIES)  # NAS authentication failure
+    engine.on_packet(mark_analysed, CATEGORIES)
+
+
+def nas_authentication_82(packet, engine, ue_info):
     # initialise authentication field for UE info
     ue_info['authentication'] = {}
     ue_info['locations']['nas_82'] = packet.id
@@ -25,20 +62,20 @@ def nas_authentication_82(packet, packets, ue_info):
     if rand:
         ue_info['authentication']['rand'] = rand
     else:
-        packet.add_analysis('RAND value not present.', 3)
+        packet.add_analysis(RAND_MISSING)
 
     # check for AUTN value
     autn = ''.join(packet.data.get('gsm_a.dtap.autn').split(':'))
     if autn:
         ue_info['authentication']['autn'] = autn
     else:
-        packet.add_analysis('AUTN value not present.', 3)
+        packet.add_analysis(AUTN_MISSING)
 
     # calculate expected values
-    calculate_auth_response(packet, packets, ue_info)
+    calculate_auth_response(packet, engine, ue_info)
 
 
-def nas_authentication_83(packet, packets, ue_info):
+def nas_authentication_83(packet, engine, ue_info):
     # get values received from authentication request
     ue_info['locations']['nas_83'] = packet.id
 
@@ -46,51 +83,55 @@ def nas_authentication_83(packet, packets, ue_info):
     res = bytes.fromhex(''.join(packet.data.get('nas_eps.emm.res').split(':')))
     xres = safe_dict_get(ue_info['authentication'], 'xres')
     if not xres:
-        packet.add_analysis('RES value not analysed.', 1)
+        packet.add_analysis(RES_NOT_ANALYSED)
     elif res != xres:
-        packet.add_analysis(f'RES ({bytes.hex(res)}) does not match expected value ({bytes.hex(xres)})', 3)
+        packet.add_analysis(RES_MISMATCH, bytes.hex(res), bytes.hex(xres))
         ue_info['authentication']['passed'] = False
-        if not get_attach_message(packets, '84'):
-            packet.add_analysis('No authentication reject was sent after mismatch in RES values.', 3)
+        engine.defer(packet, authentication_reject_sent)
     else:
         ue_info['authentication']['passed'] = True
 
 
-def nas_authentication_84(packet, packets, ue_info):
+def authentication_reject_sent(packet, engine, ue_info):
+    if not engine.has_seen(EMM_TYPE, '84'):
+        packet.add_analysis(REJECT_MISSING)
+
+
+def nas_authentication_84(packet, engine, ue_info):
     # check if authentication procedure happened
     autn_response = safe_dict_get(ue_info['locations'], 'nas_83')
 
     # if no authentication procedure happened when this message was sent, add error
     if not autn_response or autn_response > packet.id:
-        packet.add_analysis('Authentication reject sent before authentication response.\nThis could be because of a malicious eNodeB carrying out a disruption of service attack.', 4)
+        packet.add_analysis(REJECT_BEFORE_RESPONSE)
     # if authentication response is present and reject happened after response, check if rejection is justified
     else:
         passed = safe_dict_get(ue_info['authentication'], 'passed')
         # add note if RES was not calculated
         if passed is None:
-            packet.add_analysis('RES was not analysed in authentication response.\nTo analyse RES, use -sim option.', 0)
+            packet.add_analysis(REJECT_RES_NOT_ANALYSED)
         # add error if RES != XRES
         elif passed:
-            packet.add_analysis('Authentication reject was sent, though RES matched XRES.', 3)
+            packet.add_analysis(REJECT_RES_MATCHED)
 
 
-def nas_authentication_92(packet, packets, ue_info):
+def nas_authentication_92(packet, engine, ue_info):
     # check if authentication procedure happened
     autn_response = safe_dict_get(ue_info['locations'], 'nas_82')
 
     # if no authentication procedure happened when this messgae was sent, add error
     if not autn_response or autn_response > packet.id:
-        packet.add_analysis('Authentication failure sent before authentication response.', 3)
+        packet.add_analysis(FAILURE_BEFORE_RESPONSE)
     else:
         passed = safe_dict_get(ue_info['authentication'], 'mac_passed')
         # add note if MAC was not calculated
         if passed is None:
-            packet.add_analysis('MAC was not analysed in authentication response.\nTo analyse MAC, use -sim option.', 0)
+            packet.add_analysis(FAILURE_MAC_NOT_ANALYSED)
         elif passed and packet.data.get('nas_eps.emm.cause') == '20':
-            packet.add_analysis('Authentication failure was sent with cause 20 (MAC failure), though MAC was as expected.', 3)
+            packet.add_analysis(FAILURE_MAC_MATCHED)
 
 
-def calculate_auth_response(packet, packets, ue_info):
+def calculate_auth_response(packet, engine, ue_info):
     # get values received from authentication request
     autn_str = safe_dict_get(ue_info['authentication'], 'autn')
     rand_str = safe_dict_get(ue_info['authentication'], 'rand')
@@ -102,63 +143,25 @@ def calculate_auth_response(packet, packets, ue_info):
         rand = bytes.fromhex(rand_str)
 
         if not safe_dict_get(ue_info, 'sim_info'):
-            packet.add_analysis('No SIM info available.\nTo analyse authentication response, use -sim option.', 0)
+            packet.add_analysis(NO_SIM_INFO)
             return
         key = safe_dict_get(ue_info['sim_info'], 'key')
-        algo = safe_dict_get(ue_info['sim_info'], 'auth')
         # print warning if correctness of res can not be checked
         if not key:
-            packet.add_analysis(
-                'RES value can not be analysed, due to the key not being known.\nTo analyse RES value, use -sim option.',
-                1)
+            packet.add_analysis(KEY_UNKNOWN)
             return
-        # check correctness for milenage algorithm
         else:
-            if algo == 'mil':
-                # create cipher
-                if op := safe_dict_get(ue_info['sim_info'], 'op'):
-                    cipher = Milenage(op)
-                else:
-                    opc = bytes.fromhex(safe_dict_get(ue_info['sim_info'], 'opc'))
-                    cipher = Milenage(op)
-                    cipher.set_opc(opc)
-
-                # get RES, CK, IK and AK values
-                xres, ck, ik, ak = cipher.f2345(key, rand)
-
-                # get MAC
-                sqn = bytes([autn[i] ^ ak[i] for i in range(0, 6)])
-                mac = autn[8:]
-                amf = safe_dict_get(ue_info['sim_info'], 'amf')
-
-                xmac = cipher.f1(key, rand, sqn, amf)
-            elif algo == 'xor':
-                # get RES, CK, IK and AK values
-                xdout = bytes([key[i] ^ rand[i] for i in range(len(key))])
-                xres = bytes.hex(xdout)
-                ck = bytes([xdout[(i + 1) % len(xdout)] for i in range(len(xdout))])
-                ik = bytes([xdout[(i + 2) % len(xdout)] for i in range(len(xdout))])
-                ak = bytes([xdout[(i + 3)] for i in range(6)])
-
-                # get MAC
-                sqn = bytes([autn[i] ^ ak[i] for i in range(6)])
-                mac = autn[8:]
-                amf = safe_dict_get(ue_info['sim_info'], 'amf')
-                cdout = sqn + amf
-
-                xmac = bytes([xdout[i] ^ cdout[i] for i in range(8)])
-            else:
-                packet.add_analysis(
-                    'RES value can not be analysed, due to the algorithm not being known.\nTo analyse RES value, use -sim option.',
-                    1)
+            vector = authentication_vector(ue_info['sim_info'], rand, autn, safe_dict_get(ue_info['sim_info'], 'amf'))
+            if vector is None:
+                packet.add_analysis(ALGORITHM_UNKNOWN)
                 return
+            xres, ck, ik, ak, xmac = vector
+            mac = autn[8:]
 
             # check if message authentication should be successful by comparing MAC and our own calculations
             if mac != xmac:
-                packet.add_analysis(f'MAC ({bytes.hex(mac)}) does not match calculated value ({bytes.hex(xmac)})', 4)
-                if not get_attach_message(packets, '92'):
-                    packet.add_analysis(
-                        'No authentication failure message sent after mismatch in expected value.', 3)
+                packet.add_analysis(MAC_MISMATCH, bytes.hex(mac), bytes.hex(xmac))
+                engine.defer(packet, authentication_failure_sent)
                 ue_info['authentication']['mac_passed'] = False
             else:
                 ue_info['authentication']['mac_passed'] = True
@@ -169,4 +172,47 @@ def calculate_auth_response(packet, packets, ue_info):
             ue_info['keys'] = {}
             ue_info['keys']['ck'] = ck
             ue_info['keys']['ik'] = ik
-            ue_info['keys']['ak'] = ak
\ No newline at end of file
+            ue_info['keys']['ak'] = ak
+
+
+def authentication_vector(sim_info, rand, autn, amf):
+    """Calculates the expected RES, CK, IK, AK and MAC of a subscriber for an authentication request, or returns
+    None if the algorithm of the subscriber is not known."""
+    key = sim_info['key']
+    algo = safe_dict_get(sim_info, 'auth')
+    # check correctness for milenage algorithm
+    if algo == 'mil':
+        # OP and OPc are converted to bytes when the user database is loaded
+        cipher = milenage_context(key, safe_dict_get(sim_info, 'op'), safe_dict_get(sim_info, 'opc'))
+
+        # get RES, CK, IK, AK and MAC values, the SQN in the AUTN is concealed by AK
+        xres, ck, ik, ak, xmac, _ = cipher.f12345(rand, autn[:6], amf, concealed=True)
+    elif algo == 'xor':
+        # get RES, CK, IK and AK values
+        xdout = bytes([key[i] ^ rand[i] for i in range(len(key))])
+        xres = bytes.hex(xdout)
+        ck = bytes([xdout[(i + 1) % len(xdout)] for i in range(len(xdout))])
+        ik = bytes([xdout[(i + 2) % len(xdout)] for i in range(len(xdout))])
+        ak = bytes([xdout[(i + 3)] for i in range(6)])
+
+        # get MAC
+        sqn = bytes([autn[i] ^ ak[i] for i in range(6)])
+        cdout = sqn + amf
+
+        xmac = bytes([xdout[i] ^ cdout[i] for i in range(8)])
+    else:
+        return None
+    return xres, ck, ik, ak, xmac
+
+
+@lru_cache(maxsize=MILENAGE_CONTEXTS)
+def milenage_context(key, op, opc):
+    """Returns the Milenage context of a subscriber, which derives its OPc and AES key schedule only once."""
+    if op:
+        return MilenageContext(key, OP=op)
+    return MilenageContext(key, OPc=opc)
+
+
+def authentication_failure_sent(packet, engine, ue_info):
+    if not engine.has_seen(EMM_TYPE, '92'):
+        packet.add_analysis(FAILURE_MISSING)
@@ -0,0 +1,184 @@
+import hashlib
+import inspect
+import marshal
+import os
+import sys
+
+from analyser import MissingUserEquipmentInfoException, analysis, decryption, subscribers
+from analyser.categoriser import ANALYSED
+from analyser.findings import RULES, FindingStore
+from analyser.sessions import partition
+from ingest.cache import CACHE_DIRECTORY, evict
+
+CACHE_VERSION = 2  # increase whenever the layout of the cached results changes
+
+# modules which affect the results of every analysis module, their sources are part of every key
+CORE = ['analyser', 'analyser.analysis', 'analyser.engine', 'analyser.columns', 'analyser.findings',
+        'analyser.categoriser', 'analyser.sessions', 'analyser.decryption', 'packet']
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def analyse(packets, ue_info, capture_key, jobs=1):
+    """Analyses a capture like analysis.analyse_sessions, reusing the cached results of every analysis module.
+
+    Results are cached per analysis module, keyed by the capture, the SIM info and the sources of the module,
+    the modules it depends on and the core of the analyser. Only the modules whose results are not cached are run,
+    along with the modules they depend on, after which the results of all modules are added to the packets in the
+    order an uncached analysis would have added them. The ciphered NAS messages are deciphered either way.
+    """
+    sessions = partition(packets)  # before deciphering, which can reveal identities that link sessions
+    sim_key = sim_digest(ue_info)
+    keys = {name: entry_key(capture_key, sim_key, name) for name in module_names()}
+    keys['analysis'] = entry_key(capture_key, sim_key, 'analysis')
+    entries = {name: load(key) for (name, key) in keys.items()}
+    stale = [name for (name, entry) in entries.items() if entry is None]
+    if stale:
+        run = dependency_closure(stale)
+        recorded = record(packets, ue_info, run, jobs)
+        for name in stale:
+            entries[name] = recorded[name]
+            store(keys[name], entries[name])
+        evict()
+    apply(packets, entries)
+
+    for (session, error, subscriber) in zip(sessions, entries['analysis']['errors'],
+                                            entries['analysis']['subscribers']):
+        session.error = error
+        session.subscriber = subscriber
+        analysis.session_ue_info(session, ue_info)
+    decryption.decrypt(sessions, analysis.required_fields())
+    if sessions and all(session.error for session in sessions):
+        raise MissingUserEquipmentInfoException(sessions)
+    return sessions
+
+
+def record(packets, ue_info, modules, jobs):
+    """Runs the given analysis modules, returning the findings and analysed packets of every module. The errors
+    of every session are kept with the results of the analyser itself."""
+    recorder = FindingStore(record=True)
+    stores = [packet.findings for packet in packets]
+    for packet in packets:
+        packet.findings = recorder
+    try:
+        sessions = analysis.analyse_sessions(packets, ue_info, jobs, modules, recorder)
+    except MissingUserEquipmentInfoException as e:
+        sessions = e.sessions
+    finally:
+        for (packet, findings) in zip(packets, stores):
+            packet.findings = findings
+            packet.eval = 0
+            packet.category &= ~ANALYSED
+    errors = [session.error for session in sessions]
+    found = [session.subscriber for session in sessions]
+
+    entries = {name: {'findings': [], 'marks': []} for name in ['analysis'] + modules}
+    for finding in range(len(recorder)):
+        name = recorder.rule(finding).id.split('.', 1)[0]
+        entries[name]['findings'].append((recorder.order[finding], recorder.packets[finding],
+                                          recorder.rule(finding).id, recorder.arguments.get(finding, ())))
+    for (name, marked) in recorder.marks.items():
+        entries[name]['marks'] = sorted(set(marked))
+    entries['analysis']['errors'] = errors
+    entries['analysis']['subscribers'] = found
+    return entries
+
+
+def apply(packets, entries):
+    """Adds the cached findings of every module to the packets, and marks the packets they analysed."""
+    by_id = {packet.id: packet for packet in packets}
+    findings = []
+    for (rank, name) in enumerate(entries):
+        for packet_id in entries[name]['marks']:
+            by_id[packet_id].category |= ANALYSED
+        findings.extend((finding[0], rank, i, finding) for (i, finding) in enumerate(entries[name]['findings']))
+    findings.sort(key=lambda finding: finding[:3])
+    for (_, _, _, (_, packet_id, rule_id, arguments)) in findings:
+        by_id[packet_id].add_analysis(RULES[rule_id], *arguments)
+
+
+def module_names():
+    return [analysis.module_name(module) for module in analysis.MODULES]
+
+
+def dependency_closure(names):
+    """Adds the modules the given modules depend on, in the order the modules are registered."""
+    modules = {analysis.module_name(module): module for module in analysis.MODULES}
+    needed = set()
+    pending = [name for name in names if name in modules]
+    while pending:
+        name = pending.pop()
+        if name not in needed:
+            needed.add(name)
+            pending.extend(modules[name].DEPENDENCIES)
+    return [name for name in modules if name in needed]
+
+
+def entry_key(capture_key, sim_key, name):
+    digest = hashlib.sha256(f'{CACHE_VERSION}\0{capture_key}\0{sim_key}\0{name}'.encode())
+    for source in CORE:
+        digest.update(source_digest(sys.modules[source]))
+    if name != 'analysis':
+        for dependency in dependency_closure([name]):
+            for module in local_modules(sys.modules[f'analyser.{dependency}']):
+                digest.update(source_digest(module))
+    else:
+        # the analyser itself keeps the subscribers found by their authentication request
+        for module in local_modules(subscribers):
+            digest.update(source_digest(module))
+    return digest.hexdigest()
+
+
+def sim_digest(ue_info):
+    """Identifies the user database or SIM info the capture is analysed with."""
+    if ue_info.get('user_db') is not None:
+        return ue_info['user_db'].digest + (':search' if ue_info.get('subscriber_search') else '')
+    return hashlib.sha256(repr(sorted((ue_info.get('sim_info') or {}).items())).encode()).hexdigest()
+
+
+def local_modules(module, found=None):
+    """Lists a module and the modules of this repository it uses, so a change in any of them changes the key."""
+    if found is None:
+        found = {}
+    found[module.__name__] = module
+    for value in vars(module).values():
+        if inspect.ismodule(value) and value.__name__.startswith(module.__name__ + '.'):
+            continue  # the imported submodules of a package are attributes of it, but not used by it
+        used = value if inspect.ismodule(value) else inspect.getmodule(value)
+        path = getattr(used, '__file__', None)
+        if used is not None and used.__name__ not in found and path and \
+                os.path.abspath(path).startswith(ROOT + os.sep):
+            local_modules(used, found)
+    return list(found.values())
+
+
+def source_digest(module):
+    with open(module.__file__, 'rb') as f:
+        return hashlib.sha256(f.read()).digest()
+
+
+def cache_path(key):
+    return os.path.join(CACHE_DIRECTORY, key + '.elva')
+
+
+def load(key):
+    """Returns the cached results of an analysis module, or None if they are not cached."""
+    path = cache_path(key)
+    try:
+        with open(path, 'rb') as f:
+            entry = marshal.load(f)
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+    try:
+        os.utime(path)  # the modification time doubles as the last access time for eviction
+    except FileNotFoundError:
+        pass  # evicted by another process after it was read
+    return entry
+
+
+def store(key, entry):
+    os.makedirs(CACHE_DIRECTORY, exist_ok=True)
+    path = cache_path(key)
+    temporary = f'{path}.{os.getpid()}.tmp'
+    with open(temporary, 'wb') as f:
+        marshal.dump(entry, f)
+    os.replace(temporary, path)
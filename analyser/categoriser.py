@@ -1,26 +1,69 @@
+import re
+
+# every category is a bit in the category mask of a packet, the bit is the index of the category in this list
+CATEGORIES = ['Unassigned', 'RRC Connection Establishment', 'Attach Procedure', 'Information Transfer',
+              'Identity Request/Response', 'Authentication Procedure', 'Security Mode Command',
+              'UE Capability Information', 'Analysed']
+CATEGORY_BITS = {name: 1 << i for (i, name) in enumerate(CATEGORIES)}
+
+UNASSIGNED = CATEGORY_BITS['Unassigned']
+ATTACH = CATEGORY_BITS['Attach Procedure']
+ANALYSED = CATEGORY_BITS['Analysed']
+DETACH = 1 << len(CATEGORIES)  # not a category, removes the attach procedure category
+
+# text in the packet summary -> categories of the packet
+RULES = {
+    'RRCConnection': ['RRC Connection Establishment'],
+    'Attach': ['Attach Procedure'],
+    'InformationTransfer': ['Information Transfer', 'Attach Procedure'],
+    'Identity': ['Identity Request/Response'],
+    'Authentication': ['Authentication Procedure'],
+    'SecurityMode': ['Security Mode Command', 'Attach Procedure'],
+    'Security mode': ['Security Mode Command', 'Attach Procedure'],
+    'UECapability': ['UE Capability Information', 'Attach Procedure'],
+}
+
+
+def category_mask(names):
+    """Converts category names to a category mask."""
+    mask = 0
+    for name in names:
+        mask |= CATEGORY_BITS[name]
+    return mask
+
+
+def category_names(mask):
+    """Converts a category mask to the names of its categories."""
+    return [name for name in CATEGORIES if mask & CATEGORY_BITS[name]]
+
+
+RULE_MASKS = {text: category_mask(names) for (text, names) in RULES.items()}
+RULE_MASKS['Detach'] = DETACH
+RULE_PATTERN = re.compile('|'.join(re.escape(text) for text in RULE_MASKS))
+
+MASK_CACHE_SIZE = 4096  # summaries, captures usually repeat far fewer once frame number and time are left out
+_masks = {}
+
+
 def categorise(packet):
-    summary = packet.full_summary
-    categories = []
-    if 'RRCConnection' in summary:
-        categories.append('RRC Connection Establishment')
-    if 'Attach' in summary:
-        categories.append('Attach Procedure')
-    if 'InformationTransfer' in summary:
-        categories.append('Information Transfer')
-    if 'Identity' in summary:
-        categories.append('Identity Request/Response')
-    if 'Authentication' in summary:
-        categories.append('Authentication Procedure')
-    if 'SecurityMode' in summary or 'Security mode' in summary:
-        categories.append('Security Mode Command')
-    if 'UECapability' in summary:
-        categories.append('UE Capability Information')
-    if 'Information Transfer' in categories or 'Security Mode Command' in categories or 'UE Capability Information' in categories:
-        categories.append('Attach Procedure')
-    if 'Detach' in summary and 'Attach Procedure' in categories:
-        categories.remove('Attach Procedure')
-    if len(categories) == 0:
-        categories.append('Unassigned')
-    categories = list(dict.fromkeys(categories))
-    return categories
+    """Finds the category mask of a packet from its summary, reusing the mask of an identical summary.
+
+    The frame number and time never match a rule, so they are left out of the summary to find repeats.
+    """
+    text = packet.full_summary.split(None, 2)[-1]
+    mask = _masks.get(text)
+    if mask is None:
+        if len(_masks) >= MASK_CACHE_SIZE:
+            _masks.clear()
+        mask = _masks[text] = match_rules(text)
+    return mask
+
 
+def match_rules(text):
+    """Matches all rules in a single pass over the text."""
+    mask = 0
+    for match in RULE_PATTERN.findall(text):
+        mask |= RULE_MASKS[match]
+    if mask & DETACH:
+        mask &= ~(ATTACH | DETACH)
+    return mask or UNASSIGNED
@@ -0,0 +1,67 @@
+try:
+    import numpy as np
+except ImportError:  # checks are then evaluated packet by packet, see AnalysisEngine
+    np = None
+
+from packet import FieldTable
+
+MISSING = -1  # code of a field which is not in a packet
+UNKNOWN = -2  # code of a value which is in no packet, so it never matches
+
+
+def available():
+    return np is not None
+
+
+class Columns:
+    def __init__(self, packets):
+        """Fields of the packets of a session as NumPy columns, so a check is evaluated for every packet at once.
+
+        Every field is encoded as small integers, one code per distinct value, when it is first used. Checks
+        combine the columns into boolean masks, and only the rows of the packets which fail a check are visited.
+        """
+        self.packets = packets
+        self.ids = np.fromiter((packet.id for packet in packets), np.int64, len(packets))
+        self.categories = np.fromiter((packet.category for packet in packets), np.int64, len(packets))
+        self.columns = {}  # field -> (codes, value -> code)
+
+    def __len__(self):
+        return len(self.packets)
+
+    def codes(self, field):
+        """Encodes a field, returning the code of every packet and the code of every value."""
+        if field not in self.columns:
+            values = {}
+            codes = np.fromiter((MISSING if value is None else values.setdefault(value, len(values))
+                                 for value in FieldTable.column([packet.data for packet in self.packets], field)),
+                                np.int32, len(self.packets))
+            self.columns[field] = (codes, values)
+        return self.columns[field]
+
+    def code(self, field, value):
+        """Returns the code of a value of a field, MISSING for None and UNKNOWN if no packet has the value."""
+        if value is None:
+            return MISSING
+        return self.codes(field)[1].get(value, UNKNOWN)
+
+    def equals(self, field, value):
+        return self.codes(field)[0] == self.code(field, value)
+
+    def in_categories(self, mask):
+        return (self.categories & mask) != 0
+
+    def summary_contains(self, text, short=False, mask=None):
+        """Finds the packets with text in their (shortened) summary, only looking at the packets in the mask."""
+        found = np.zeros(len(self.packets), bool)
+        rows = range(len(self.packets)) if mask is None else np.flatnonzero(mask)
+        for i in rows:
+            packet = self.packets[i]
+            found[i] = text in (packet.summary if short else packet.full_summary)
+        return found
+
+    def none(self):
+        return np.zeros(len(self.packets), bool)
+
+    def rows(self, mask):
+        """Lists the packets selected by a mask."""
+        return [self.packets[i] for i in np.flatnonzero(mask)]
@@ -0,0 +1,247 @@
+from functools import lru_cache
+from struct import pack
+
+from analyser.authentication import authentication_vector
+from analyser.categoriser import ANALYSED, categorise
+from analyser.engine import EMM_TYPE
+from analyser.subscribers import AUTN_FIELD, IMSI_FIELD, RAND_FIELD
+from CryptoMobile.AES import AES_ECB
+from CryptoMobile.CMAC import CMAC
+from CryptoMobile.conv import conv_401_A2, conv_401_A7
+from ingest.tshark import dissect_nas
+from packet import FieldTable, sanitize_field_name
+
+import CryptoMobile.CM as CM
+
+SECURITY_HEADER_FIELD = 'nas_eps.security_header_type'
+SEQUENCE_FIELD = 'nas_eps.seq_no'
+CIPHERED_FIELD = 'nas_eps.ciphered_msg'
+DIRECTION_FIELD = 'mac-lte.direction'
+CIPHERING_FIELD = 'nas_eps.emm.toc'
+INTEGRITY_FIELD = 'nas_eps.emm.toi'
+MCC_FIELD = 'e212.tai.mcc'
+MNC_FIELD = 'e212.tai.mnc'
+NAS_PDU_FIELD = 'lte-rrc.dedicatedInfoNAS'
+DECIPHERED_FIELD = 'elvis.deciphered'  # added to the fields of a deciphered message, so it is not deciphered again
+
+# fields read to decipher NAS messages, only these are extracted from the packet capture
+FIELDS = [EMM_TYPE, SECURITY_HEADER_FIELD, SEQUENCE_FIELD, CIPHERED_FIELD, DIRECTION_FIELD, CIPHERING_FIELD,
+          INTEGRITY_FIELD, MCC_FIELD, MNC_FIELD, NAS_PDU_FIELD, RAND_FIELD, AUTN_FIELD, IMSI_FIELD]
+
+CIPHERED_HEADERS = ('2', '4')  # integrity protected and ciphered, with the current or a new EPS security context
+NAS_ENCRYPTION = 1  # algorithm type distinguishers of the NAS keys, see TS 33.401 annex A.7
+NAS_INTEGRITY = 2
+NAS_BEARER = 0
+MAC_LENGTH = 4
+# keystreams and MAC of 128-EEA1 / 128-EIA1 and 128-EEA3 / 128-EIA3, None if their extension is not installed
+STREAM_CIPHERS = {1: getattr(CM, 'EEA1_keystreams', None), 3: getattr(CM, 'EEA3_keystreams', None)}
+STREAM_MACS = {1: getattr(CM, 'EIA1', None), 3: getattr(CM, 'EIA3', None)}
+
+
+class SecurityContext:
+    def __init__(self, kasme, ciphering, integrity):
+        """NAS security context established by a NAS security mode command, see TS 33.401.
+
+        The NAS keys are derived from KASME for the algorithms chosen by the MME. The NAS COUNT of every direction
+        is the sequence number of a message, extended by the number of times the sequence number wrapped.
+        """
+        self.kasme = kasme
+        self.ciphering = ciphering
+        self.integrity = integrity
+        self.encryption_key = conv_401_A7(kasme, NAS_ENCRYPTION, ciphering)[16:]
+        self.integrity_key = conv_401_A7(kasme, NAS_INTEGRITY, integrity)[16:]
+        self.sequence = {}  # direction -> (overflow, last sequence number)
+
+    def count(self, direction, sequence):
+        overflow, last = self.sequence.get(direction, (0, -1))
+        if sequence < last:
+            overflow += 1
+        self.sequence[direction] = (overflow, sequence)
+        return ((overflow << 8) | sequence) & 0xffffffff
+
+
+def decrypt(sessions, fields):
+    """Deciphers the ciphered NAS messages of every session whose subscriber is known.
+
+    The NAS keys are derived from the CK and IK of the authentication before every NAS security mode command.
+    128-EEA2 messages of a key are deciphered together, with one AES call for the key stream of all of them.
+    The plaintexts of all sessions are then dissected by a single tshark run, after which their fields and
+    Info column are added to the packets, so the analysis modules read them like those of plain messages.
+    Messages which are already deciphered are skipped, so sessions can be deciphered again.
+    """
+    deciphered = []
+    for session in sessions:
+        messages = ciphered_messages(session.packets, (session.ue_info or {}).get('sim_info'))
+        found = [(message[0], plaintext) for (message, plaintext) in zip(messages, decipher(messages))
+                 if plaintext is not None]
+        if found and session.ue_info is not None:
+            session.ue_info['nas_deciphered'] = len(found)
+        deciphered.extend(found)
+    plaintexts = dissect_nas([plaintext for (_, plaintext) in deciphered], fields)
+    for ((packet, _), (table, info)) in zip(deciphered, plaintexts):
+        merged = dict(packet.data.items())
+        merged[sanitize_field_name(DECIPHERED_FIELD)] = '1'
+        for (name, value) in table.items():
+            merged.setdefault(name, value)  # fields of the outer message come first, like in tshark
+        packet.data = FieldTable(merged)
+        if info:
+            packet.full_summary = f'{packet.full_summary}, {info}'
+            packet._summary = None
+        packet.category = categorise(packet) | (packet.category & ANALYSED)
+    return len(deciphered)
+
+
+def ciphered_messages(packets, sim_info):
+    """Lists the ciphered NAS messages of a session as (packet, context, count, direction, message) tuples."""
+    if not sim_info:
+        return []
+    messages = []
+    request = None
+    sn_ids = None
+    context = None
+    for packet in packets:
+        data = packet.data
+        emm_type = data.get(EMM_TYPE)
+        if sn_ids is None:
+            sn_ids = serving_networks(data)
+        if emm_type == '82' and data.get(RAND_FIELD) and data.get(AUTN_FIELD):
+            request = (hex_bytes(data.get(RAND_FIELD)), hex_bytes(data.get(AUTN_FIELD)))
+        elif emm_type == '93' and request is not None:
+            context = security_context(sim_info, request, sn_ids or imsi_networks(sim_info), data)
+        elif context is not None and data.get(SECURITY_HEADER_FIELD) in CIPHERED_HEADERS and \
+                data.get(CIPHERED_FIELD):
+            direction = 1 if data.get(DIRECTION_FIELD) == '1' else 0
+            count = context.count(direction, int(data.get(SEQUENCE_FIELD) or 0))
+            if data.get(DECIPHERED_FIELD) is None:
+                messages.append((packet, context, count, direction, hex_bytes(data.get(CIPHERED_FIELD))))
+    return messages
+
+
+def security_context(sim_info, request, sn_ids, command):
+    """Derives KASME from the authentication vector of the subscriber, see TS 33.401 annex A.2, for the NAS
+    security mode command in the fields of command.
+
+    KASME depends on the serving network, which can have more than one identity (see serving_networks). The
+    security mode command is integrity protected with the new context, so the identity whose context matches the
+    MAC of the command is used. If the MAC can not be checked, the first identity is used.
+    """
+    rand, autn = request
+    ciphering = command.get(CIPHERING_FIELD)
+    integrity = command.get(INTEGRITY_FIELD)
+    if not sn_ids or ciphering is None or integrity is None or len(rand) != 16 or len(autn) != 16:
+        return None
+    vector = authentication_vector(sim_info, rand, autn, autn[6:8])
+    if vector is None:
+        return None
+    (_, ck, ik, _, _) = vector
+    contexts = [SecurityContext(conv_401_A2(ck, ik, sn_id, autn[:6]), int(ciphering), int(integrity))
+                for sn_id in sn_ids]
+    pdu = hex_bytes(command.get(NAS_PDU_FIELD)) if command.get(NAS_PDU_FIELD) else b''
+    if len(contexts) > 1 and len(pdu) > 1 + MAC_LENGTH:
+        # the first downlink message of a new context, its NAS COUNT is its sequence number
+        for context in contexts:
+            if mac(context.integrity, context.integrity_key, pdu[1 + MAC_LENGTH], NAS_BEARER, 1,
+                   pdu[1 + MAC_LENGTH:]) == pdu[1:1 + MAC_LENGTH]:
+                return context
+    return contexts[0]
+
+
+def decipher(messages):
+    """Deciphers the messages, returning None for messages whose algorithm is not available.
+
+    The key streams of the messages of a key are produced together: for 128-EEA2 by one AES call, for 128-EEA1
+    and 128-EEA3 by one call to the extension.
+    """
+    plaintexts = [None] * len(messages)
+    keystreams = {}  # (algorithm, key) -> positions of its messages
+    for (i, (_, context, _, _, message)) in enumerate(messages):
+        if context.ciphering == 0:
+            plaintexts[i] = message
+        elif context.ciphering == 2 or STREAM_CIPHERS.get(context.ciphering) is not None:
+            keystreams.setdefault((context.ciphering, context.encryption_key), []).append(i)
+    for ((algorithm, key), positions) in keystreams.items():
+        if algorithm != 2:
+            requests = [(messages[i][2], NAS_BEARER, messages[i][3], len(messages[i][4])) for i in positions]
+            for (i, keystream) in zip(positions, STREAM_CIPHERS[algorithm](key, requests)):
+                plaintexts[i] = xor(messages[i][4], keystream)
+            continue
+        counters = [eea2_counters(messages[i][2], NAS_BEARER, messages[i][3], len(messages[i][4])) for i in positions]
+        keystream = eea2_cipher(key).encrypt(b''.join(counters))
+        offset = 0
+        for (i, counter) in zip(positions, counters):
+            message = messages[i][4]
+            plaintexts[i] = xor(message, keystream[offset:offset + len(message)])
+            offset += len(counter)
+    return plaintexts
+
+
+@lru_cache(maxsize=256)
+def eea2_cipher(key):
+    """Returns the AES context of a 128-EEA2 key, its key schedule is kept for every message of the key."""
+    return AES_ECB(key)
+
+
+def eea2(key, count, bearer, direction, data):
+    """Deciphers (or ciphers) a single 128-EEA2 message."""
+    keystream = eea2_cipher(key).encrypt(eea2_counters(count, bearer, direction, len(data)))
+    return xor(data, keystream[:len(data)])
+
+
+def eea2_counters(count, bearer, direction, length):
+    """Returns the counter blocks of a 128-EEA2 message, whose encryption is the key stream of the message."""
+    nonce = pack('>II', count, (bearer << 27) | (direction << 26))
+    return b''.join(nonce + pack('>Q', block) for block in range((length + 15) // 16))
+
+
+def mac(algorithm, key, count, bearer, direction, message):
+    """Calculates the MAC of a message, or returns None for 128-EIA0 and algorithms which are not available."""
+    if algorithm == 2:
+        return eia2_context(key).cmac(pack('>II', count, (bearer << 27) | (direction << 26)) + message)
+    if STREAM_MACS.get(algorithm) is not None:
+        return STREAM_MACS[algorithm](key, count, bearer, direction, message)
+    return None
+
+
+@lru_cache(maxsize=256)
+def eia2_context(key):
+    """Returns the CMAC context of a 128-EIA2 key, its AES key schedule and subkeys are kept for every message."""
+    return CMAC(key, AES_ECB, Tlen=32)
+
+
+def xor(data, keystream):
+    return (int.from_bytes(data, 'big') ^ int.from_bytes(keystream, 'big')).to_bytes(len(data), 'big')
+
+
+def hex_bytes(value):
+    return bytes.fromhex(value.replace(':', ''))
+
+
+def serving_networks(data):
+    """Lists the identities the PLMN of the tracking area in a message can have as serving network, if any.
+
+    tshark outputs the MNC as a number, which drops the leading zeros of the MNC digits. A three digit MNC is kept
+    as dissected. A shorter one can be a two or a three digit MNC (e.g. 10 is either 10 or 010), so both
+    identities are listed, see security_context.
+    """
+    mcc = data.get(MCC_FIELD)
+    mnc = data.get(MNC_FIELD)
+    if not mcc or not mnc or len(mnc) > 3:
+        return None
+    if len(mnc) == 3:
+        return [plmn_identity(mcc.zfill(3), mnc)]
+    return [plmn_identity(mcc.zfill(3), mnc.zfill(2)), plmn_identity(mcc.zfill(3), mnc.zfill(3))]
+
+
+def imsi_networks(sim_info):
+    """Falls back to the home network of the subscriber. The IMSI does not tell the length of the MNC, so both
+    the two digit MNC, which srsRAN uses by default, and the three digit MNC are listed."""
+    imsi = sim_info.get('imsi') or ''
+    if len(imsi) < 6:
+        return None
+    return [plmn_identity(imsi[:3], imsi[3:5]), plmn_identity(imsi[:3], imsi[3:6])]
+
+
+def plmn_identity(mcc, mnc):
+    """Encodes an MCC and MNC like TS 24.301 does, with the filler digit for a two digit MNC."""
+    mnc3 = int(mnc[2]) if len(mnc) == 3 else 0xf
+    return bytes([int(mcc[1]) << 4 | int(mcc[0]), mnc3 << 4 | int(mcc[2]), int(mnc[1]) << 4 | int(mnc[0])])
@@ -0,0 +1,232 @@
+from analyser.categoriser import ANALYSED, category_mask
+from analyser.columns import Columns
+
+# fields holding the message type of NAS and RRC messages, used to dispatch packets to their handlers
+EMM_TYPE = 'nas_eps.nas_msg_emm_type'
+# value matching every packet which has a field, for fields without a value of their own such as the elements of
+# RRC messages, which tshark shows as 1 in the fields output and as their name in PDML
+PRESENT = object()
+
+# phases of the analysis, the order key of a finding is the frame number of the packet being analysed, the phase
+# and the position of the handler in it
+MESSAGE, PACKET, COLUMNS, END, DEFERRED = range(5)
+END_OF_STREAM = 1 << 60  # frame number used in the order key of findings added once the stream ended
+
+
+class AnalysisEngine:
+    def __init__(self, ue_info, recorder=None, columnar=False):
+        """Analyses a capture in a single pass, dispatching every packet to the handlers registered for it.
+
+        Handlers are called as handler(packet, engine, ue_info). Message handlers are called first, for packets
+        with a given value in a message type field, followed by the handlers for every packet in a category.
+        Checks which look ahead (e.g. for an authentication reject) are deferred to the end of the stream.
+        Packets are passed on once they are analysed, unless a handler holds them for a deferred check.
+
+        A columnar engine keeps every packet, so column handlers can check all of them at once at the end of the
+        stream (see analyser.columns). Modules register per-packet handlers instead if the engine is not columnar.
+        The findings of a column handler are listed as if they were added by the packet handler registered last
+        before it, which is where a module registers its per-packet handler otherwise.
+
+        If a recording finding store is given, the order key of every finding is kept, and every packet marked
+        as analysed is attributed to the analysis module whose handler marked it. Handlers of skipped modules are
+        registered but not called, so the order keys of the other modules are the same as when every module runs.
+        """
+        self.ue_info = ue_info
+        self.recorder = recorder
+        self.columnar = columnar
+        self.module = None  # analysis module whose handlers are being registered, or called while recording
+        self.skipped = set()  # analysis modules whose handlers are not called
+        self.fields = []  # message type fields, in the order they are registered
+        self.elements = set()  # message type fields matched on their presence
+        self.message_handlers = {}  # (field, value) -> [(category mask, handler, module)]
+        self.packet_handlers = []  # (category mask, handler, module), a mask of 0 matches every packet
+        self.column_handlers = []  # (handler, module, position) called with the columns of every packet at the end
+        self.splits = {}  # position of a column handler -> frame number -> findings of the packet up to the position
+        self.end_handlers = []  # (handler, module) called once at the end of the stream
+        self.deferred = []  # (packet, handler, module, order key when deferred) to be called at the end of the stream
+        self.seen = set()  # (field, value) of the messages which were handled
+        self.held = {}  # frame number -> [number of holds, packet]
+        self.released = []  # packets which are no longer held, to be passed on
+        self.last = None  # last packet of the stream
+        self.packets = []  # every packet of the stream, if the engine is columnar
+
+    def on_message(self, field, value, handler, categories=None):
+        """Registers a handler for packets in the given categories which have value in the field, or which have
+        the field at all if value is PRESENT. A field is matched either on its presence or on its values."""
+        if field not in self.fields:
+            self.fields.append(field)
+        if value is PRESENT:
+            self.elements.add(field)
+        mask = category_mask(categories) if categories else 0
+        self.message_handlers.setdefault((field, value), []).append((mask, handler, self.module))
+
+    def on_packet(self, handler, categories=None):
+        """Registers a handler for every packet in the given categories, or every packet at all."""
+        self.packet_handlers.append((category_mask(categories) if categories else 0, handler, self.module))
+
+    def on_columns(self, handler):
+        """Registers a handler which is called with the columns of every packet once the stream ends, before the
+        end handlers. Only a columnar engine accepts column handlers."""
+        assert self.columnar
+        position = len(self.packet_handlers) - 1  # the packet handler its findings are listed after
+        self.column_handlers.append((handler, self.module, position))
+        self.splits[position] = {}
+
+    def on_end(self, handler):
+        """Registers a handler which is called with the last packet once the stream ends."""
+        self.end_handlers.append((handler, self.module))
+
+    def defer(self, packet, handler):
+        """Holds a packet until the end of the stream, where the handler is called for it."""
+        self.hold(packet)
+        self.deferred.append((packet, handler, self.module, self.recorder and self.recorder.clock))
+
+    def has_seen(self, field, value):
+        """Checks if a message was handled so far, which is the whole stream for deferred handlers."""
+        return (field, value) in self.seen
+
+    def message_key(self, packet, field):
+        value = packet.data.get(field)
+        if value and field in self.elements:
+            value = PRESENT
+        return field, value
+
+    def hold(self, packet):
+        """Keeps a packet from being passed on, since a handler might still add analysis results to it."""
+        if packet.id in self.held:
+            self.held[packet.id][0] += 1
+        else:
+            self.held[packet.id] = [1, packet]
+
+    def release(self, packet):
+        """Releases a held packet, it is passed on once it is no longer held by any handler."""
+        held = self.held[packet.id]
+        held[0] -= 1
+        if held[0] == 0:
+            del self.held[packet.id]
+            self.released.append(packet)
+
+    def run(self, packets):
+        """Analyses a stream of packets, yielding every packet once no more analysis results can be added to it."""
+        for packet in packets:
+            self.last = packet
+            try:
+                self.dispatch(packet)
+            except Exception:
+                self.check_columns()  # packets before the one which stopped the analysis are still checked
+                raise
+            if self.columnar:
+                self.packets.append(packet)
+            if self.released:
+                released, self.released = self.released, []
+                yield from (held for held in released if held is not packet)
+            if packet.id not in self.held:
+                yield packet
+        if self.last is None:
+            return
+        self.check_columns()
+        for (step, (handler, module)) in enumerate(self.end_handlers):
+            self.call(self.last, handler, module, (END_OF_STREAM, END, step))
+        for (packet, handler, module, deferred) in self.deferred:
+            self.call(packet, handler, module, (END_OF_STREAM, DEFERRED) + (deferred or ()))
+        remaining = self.released + [packet for (_, packet) in self.held.values()]
+        self.released = []
+        self.held = {}
+        yield from sorted(remaining, key=lambda packet: packet.id)
+
+    def check_columns(self):
+        if not self.column_handlers:
+            return
+        columns = Columns(self.packets)
+        self.packets = []
+        for (step, (handler, module, position)) in enumerate(self.column_handlers):
+            if self.recorder is not None:
+                # the order key of every finding is that of the packet handler the findings are listed after
+                first = len(self.recorder)
+                self.call(columns, handler, module, (END_OF_STREAM, COLUMNS, step))
+                for finding in range(first, len(self.recorder)):
+                    self.recorder.order[finding] = (self.recorder.packets[finding], PACKET, position, COLUMNS)
+                continue
+            counts = [finding_count(packet) for packet in columns.packets]
+            self.call(columns, handler, module, (END_OF_STREAM, COLUMNS, step))
+            splits = self.splits[position]
+            for (packet, count) in zip(columns.packets, counts):
+                added = finding_count(packet) - count
+                if added:
+                    packet.findings.move_last(packet.id, added, splits.get(packet.id, 0))
+
+    def dispatch(self, packet):
+        if self.recorder is not None or self.skipped:
+            self.dispatch_recorded(packet)
+            return
+        for field in self.fields:
+            key = self.message_key(packet, field)
+            for (mask, handler, _) in self.message_handlers.get(key, ()):
+                if not mask or packet.category & mask:
+                    self.seen.add(key)
+                    handler(packet, self, self.ue_info)
+        if not self.splits:
+            for (mask, handler, _) in self.packet_handlers:
+                if not mask or packet.category & mask:
+                    handler(packet, self, self.ue_info)
+            return
+        self.split(packet, -1)
+        for (step, (mask, handler, _)) in enumerate(self.packet_handlers):
+            if not mask or packet.category & mask:
+                handler(packet, self, self.ue_info)
+            self.split(packet, step)
+
+    def split(self, packet, position):
+        """Keeps the number of findings of a packet after the packet handler at a position of a column handler."""
+        splits = self.splits.get(position)
+        if splits is not None:
+            count = finding_count(packet)
+            if count:
+                splits[packet.id] = count
+
+    def dispatch_recorded(self, packet):
+        step = 0
+        for field in self.fields:
+            key = self.message_key(packet, field)
+            for (mask, handler, module) in self.message_handlers.get(key, ()):
+                if not mask or packet.category & mask:
+                    self.seen.add(key)
+                    self.call(packet, handler, module, (packet.id, MESSAGE, step))
+                    step += 1
+        for (step, (mask, handler, module)) in enumerate(self.packet_handlers):
+            if not mask or packet.category & mask:
+                self.call(packet, handler, module, (packet.id, PACKET, step))
+
+    def call(self, packet, handler, module, order):
+        """Calls a handler of a module which is not skipped. While recording, the handler is called without the
+        analysed category, to find if it marks the packet as analysed."""
+        if module in self.skipped:
+            return
+        if self.recorder is None:
+            handler(packet, self, self.ue_info)
+            return
+        self.recorder.clock = order
+        self.module = module
+        if isinstance(packet, Columns):
+            handler(packet, self, self.ue_info)
+            return
+        analysed = packet.category & ANALYSED
+        packet.category &= ~ANALYSED
+        handler(packet, self, self.ue_info)
+        if packet.category & ANALYSED:
+            self.recorder.mark(module, packet.id)
+        packet.category |= analysed
+
+    def mark(self, packet):
+        """Marks a packet as analysed, for handlers which mark other packets than the one they were called for."""
+        packet.category |= ANALYSED
+        if self.recorder is not None:
+            self.recorder.mark(self.module, packet.id)
+
+
+def finding_count(packet):
+    return len(packet.findings.findings(packet.id)) if packet.findings is not None else 0
+
+
+def mark_analysed(packet, engine, ue_info):
+    packet.category |= ANALYSED
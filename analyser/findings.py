@@ -0,0 +1,129 @@
+from array import array
+from collections import Counter
+from enum import IntEnum
+
+
+class Severity(IntEnum):
+    NOTE = 0
+    WARNING = 1
+    MAJOR_WARNING = 2
+    ERROR = 3
+    MAJOR_ERROR = 4
+
+
+# label in front of the message of a finding of every severity
+LABELS = {Severity.NOTE: 'Note', Severity.WARNING: 'Warning', Severity.MAJOR_WARNING: 'WARNING',
+          Severity.ERROR: 'Error', Severity.MAJOR_ERROR: 'ERROR'}
+
+RULES = {}  # rule id -> rule
+
+
+class Rule:
+    __slots__ = ('id', 'severity', 'message', 'preamble')
+
+    def __init__(self, rule_id, severity, message, preamble=None):
+        """A check of the analyser, all its findings have the same severity and message.
+
+        The message can have {} fields, which are only formatted with the arguments of a finding when it is shown.
+        If a preamble is given, it replaces the severity label (e.g. to indent a finding continuing the last one).
+        """
+        self.id = rule_id
+        self.severity = severity
+        self.message = message
+        self.preamble = preamble
+
+    def format(self, arguments=()):
+        message = self.message.format(*arguments) if arguments else self.message
+        if not self.preamble:
+            return f'{LABELS[self.severity]}: {message}\n'
+        if self.preamble.isspace():
+            return f'{self.preamble} {message}\n'
+        return f'{self.preamble}: {message}\n'
+
+
+def rule(rule_id, severity, message, preamble=None):
+    """Registers a rule. Rules are registered when their module is imported, so every process knows every rule."""
+    RULES[rule_id] = Rule(rule_id, Severity(severity), message, preamble)
+    return RULES[rule_id]
+
+
+class FindingStore:
+    def __init__(self, record=False):
+        """Findings of a whole capture, stored in columns instead of a formatted string per finding.
+
+        Every finding is a rule code, a severity and the frame number of its packet, the arguments of its message
+        are only stored if there are any. Rule codes refer to rule ids, so stores of different processes can be
+        compared and aggregated.
+
+        A recording store also keeps the order key of every finding, and the packets every analysis module marked
+        as analysed, so the results of every module can be cached and combined again (see analyser.cache).
+        """
+        self.rules = []  # rule id of every rule code
+        self.codes = {}  # rule id -> rule code
+        self.rule_codes = array('H')
+        self.severities = array('B')
+        self.packets = array('Q')
+        self.arguments = {}  # finding -> arguments of its message
+        self.by_packet = {}  # frame number -> findings of the packet
+        self.order = [] if record else None  # order key of every finding, see analyser.engine
+        self.marks = {} if record else None  # analysis module -> frame numbers of the packets it marked as analysed
+        self.clock = ()  # order key of the findings added next, set by the analysis engine
+
+    def __len__(self):
+        return len(self.rule_codes)
+
+    def add(self, packet_id, rule, arguments=()):
+        code = self.codes.get(rule.id)
+        if code is None:
+            code = self.codes[rule.id] = len(self.rules)
+            self.rules.append(rule.id)
+        finding = len(self.rule_codes)
+        self.rule_codes.append(code)
+        self.severities.append(rule.severity)
+        self.packets.append(packet_id)
+        if arguments:
+            self.arguments[finding] = arguments
+        self.by_packet.setdefault(packet_id, []).append(finding)
+        if self.order is not None:
+            self.order.append(self.clock)
+
+    def mark(self, module, packet_id):
+        self.marks.setdefault(module, []).append(packet_id)
+
+    def rule(self, finding):
+        return RULES[self.rules[self.rule_codes[finding]]]
+
+    def message(self, finding):
+        return self.rule(finding).format(self.arguments.get(finding, ()))
+
+    def findings(self, packet_id):
+        """Lists the findings of a packet by its frame number."""
+        return self.by_packet.get(packet_id, [])
+
+    def move_last(self, packet_id, count, position):
+        """Moves the last findings of a packet to a position among its findings, for findings which were added
+        after the findings they are listed before (see AnalysisEngine.check_columns)."""
+        findings = self.by_packet[packet_id]
+        findings[position:] = findings[-count:] + findings[position:-count]
+
+    def lines(self, packet_id):
+        """Formats the findings of a packet."""
+        return [self.message(finding) for finding in self.findings(packet_id)]
+
+    def select(self, severity=None, rule_id=None):
+        """Finds the findings with at least the given severity, of the given rule, or both."""
+        code = None if rule_id is None else self.codes.get(rule_id, -1)
+        for finding in range(len(self.rule_codes)):
+            if severity is not None and self.severities[finding] < severity:
+                continue
+            if code is not None and self.rule_codes[finding] != code:
+                continue
+            yield finding
+
+    def counts(self):
+        """Counts the findings of every rule."""
+        return {self.rules[code]: count for (code, count) in Counter(self.rule_codes).items()}
+
+    def severity_counts(self):
+        """Counts the findings of every severity."""
+        return {Severity(severity): count for (severity, count) in Counter(self.severities).items()}
@@ -1,39 +1,63 @@
 from analyser import safe_dict_get
+from analyser.engine import EMM_TYPE, mark_analysed
+from analyser.findings import Severity, rule
+from analyser.subscribers import select_subscriber
 
+# fields read by this analyser, only these are extracted from the packet capture
+FIELDS = ['nas_eps.nas_msg_emm_type', 'nas_eps.emm.id_type2', 'gsm_a.ie.mobileid_type', 'e212.imsi']
 
-def analyse(packets, ue_info):
-    for packet in packets:
-        if packet.data.get('nas_eps.nas_msg_emm_type') == '85':
-            nas_identity_85(packet, ue_info)  # Identity request
-        elif packet.data.get('nas_eps.nas_msg_emm_type') == '86':
-            nas_identity_86(packet, ue_info)  # Identity response
-        packet.category.append('Analysed')
 
+CATEGORIES = ['Identity Request/Response']
+# analysis modules whose UE info is read by this analyser, they are run along with it
+DEPENDENCIES = []
 
-def nas_identity_85(packet, ue_info):
+NOT_IMSI_REQUEST = rule('identity.not-imsi-request', Severity.NOTE,
+                        'ELVis only follows srsRAN implementation, which only requests IMSI.')
+NOT_IMSI_REQUEST_ACCURACY = rule('identity.not-imsi-request-accuracy', Severity.NOTE,
+                                 'Analysis results might not be completely accurate.', '\t')
+RESPONSE_TYPE_MISMATCH = rule('identity.response-type-mismatch', Severity.ERROR,
+                              'Identity response does not contain queried value by MME.')
+IMSI_NOT_LOADED = rule('identity.imsi-not-loaded', Severity.NOTE,
+                       'IMSI not loaded into program.\nTo load IMSI in program, use -sim option.')
+IMSI_MISMATCH = rule('identity.imsi-mismatch', Severity.WARNING,
+                     'IMSI in response does not match value from SIM configuration.')
+IMSI_CHANGED = rule('identity.imsi-changed', Severity.NOTE,
+                    'Changing stored value to value read from identity response.')
+
+
+def register(engine):
+    engine.on_message(EMM_TYPE, '85', nas_identity_85, CATEGORIES)  # Identity request
+    engine.on_message(EMM_TYPE, '86', nas_identity_86, CATEGORIES)  # Identity response
+    engine.on_packet(mark_analysed, CATEGORIES)
+
+
+def nas_identity_85(packet, engine, ue_info):
     # check if asked value is IMSI
     request_type = packet.data.get('nas_eps.emm.id_type2')
     if not request_type == '1':
-        packet.add_analysis('ELVis only follows srsRAN implementation, which only requests IMSI.', 0)
-        packet.add_analysis('Analysis results might not be completely accurate.', 0, custom_preamble='\t')
+        packet.add_analysis(NOT_IMSI_REQUEST)
+        packet.add_analysis(NOT_IMSI_REQUEST_ACCURACY)
     ue_info['identity_request_type'] = request_type
 
 
-def nas_identity_86(packet, ue_info):
+def nas_identity_86(packet, engine, ue_info):
     # check if requested type is response type
     response_type = packet.data.get('gsm_a.ie.mobileid_type')
     if not ue_info['identity_request_type'] == response_type:
-        packet.add_analysis('Identity response does not contain queried value by MME.', 3)
+        packet.add_analysis(RESPONSE_TYPE_MISMATCH)
 
     if ue_info['identity_request_type'] == '1':
+        # the IMSI is checked against the SIM info of its own subscriber, if a user database is loaded
+        select_subscriber(packet, engine, ue_info)
+
         # check if imsi is known
         sim_info = safe_dict_get(ue_info, 'sim_info')
         if not sim_info:
-            packet.add_analysis('IMSI not loaded into program.\nTo load IMSI in program, use -sim option.', 0)
+            packet.add_analysis(IMSI_NOT_LOADED)
         else:
             # check if response matches known value
             imsi = safe_dict_get(ue_info['sim_info'], 'imsi')
             if imsi and not imsi == packet.data.get('e212.imsi'):
-                packet.add_analysis('IMSI in response does not match value from SIM configuration.', 1)
-                packet.add_analysis('Changing stored value to value read from identity response.', 0)
+                packet.add_analysis(IMSI_MISMATCH)
+                packet.add_analysis(IMSI_CHANGED)
         ue_info['imsi'] = packet.data.get('e212.imsi')
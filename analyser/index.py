@@ -0,0 +1,104 @@
+from analyser import analysis
+from analyser.categoriser import ANALYSED, CATEGORY_BITS, category_names
+from analyser.engine import EMM_TYPE
+
+RRC_ELEMENT_PREFIX = 'lte-rrc.'
+RRC_ELEMENT_SUFFIX = '_element'
+
+# NAS EMM message type -> message name, see 3GPP TS 24.301 table 9.8.1
+EMM_MESSAGES = {
+    '65': 'Attach request', '66': 'Attach accept', '67': 'Attach complete', '68': 'Attach reject',
+    '69': 'Detach request', '70': 'Detach accept', '72': 'Tracking area update request',
+    '73': 'Tracking area update accept', '74': 'Tracking area update complete', '75': 'Tracking area update reject',
+    '76': 'Extended service request', '78': 'Service reject', '80': 'GUTI reallocation command',
+    '81': 'GUTI reallocation complete', '82': 'Authentication request', '83': 'Authentication response',
+    '84': 'Authentication reject', '85': 'Identity request', '86': 'Identity response',
+    '92': 'Authentication failure', '93': 'Security mode command', '94': 'Security mode complete',
+    '95': 'Security mode reject', '96': 'EMM status', '97': 'EMM information', '98': 'Downlink NAS transport',
+    '99': 'Uplink NAS transport', '100': 'CS service notification',
+}
+
+
+def rrc_elements():
+    """Lists the RRC message elements extracted for analysis."""
+    return [field for field in analysis.required_fields()
+            if field.startswith(RRC_ELEMENT_PREFIX) and field.endswith(RRC_ELEMENT_SUFFIX)]
+
+
+class CaptureIndex:
+    def __init__(self, packets, elements=None):
+        """Index of the packets of a capture by category, NAS EMM message type, RRC element and frame number, so
+        the visualiser can filter the capture and find a packet without scanning the capture.
+
+        The index is built in a single pass, which only reads the category mask, the EMM message type and the
+        given RRC elements (by default those extracted for analysis) of every packet. The 'Analysed' category is
+        set during analysis, so it is not part of the index.
+        """
+        self.packets = packets
+        self.mask = 0
+        self.categories = {}  # category bit -> positions of its packets
+        self.emm_types = {}  # message type -> positions of its packets
+        self.rrc_elements = {}  # element field name -> positions of the packets which contain it
+        self.positions = {}  # frame number -> position
+        elements = rrc_elements() if elements is None else elements
+        for (position, packet) in enumerate(packets):
+            self.positions[packet.id] = position
+            mask = packet.category
+            self.mask |= mask
+            while mask:
+                bit = mask & -mask
+                self.categories.setdefault(bit, []).append(position)
+                mask ^= bit
+            emm_type = packet.data.get(EMM_TYPE)
+            if emm_type:
+                self.emm_types.setdefault(emm_type, []).append(position)
+            for element in elements:
+                if packet.data.get(element):
+                    self.rrc_elements.setdefault(element, []).append(position)
+
+    def category_names(self):
+        return category_names(self.mask)
+
+    def category(self, name):
+        """Lists the packets in a category."""
+        bit = CATEGORY_BITS[name]
+        if bit == ANALYSED:
+            return [packet for packet in self.packets if packet.category & bit]
+        return [self.packets[position] for position in self.categories.get(bit, [])]
+
+    def emm_messages(self, msg_type):
+        """Lists the packets with a NAS EMM message of a type."""
+        return [self.packets[position] for position in self.emm_types.get(msg_type, [])]
+
+    def rrc_messages(self, element):
+        """Lists the packets which contain an RRC element."""
+        return [self.packets[position] for position in self.rrc_elements.get(element, [])]
+
+    def position(self, frame_number):
+        """Finds the position of a packet in the capture by its frame number."""
+        return self.positions.get(frame_number)
+
+    def filters(self):
+        """Lists the filters of the packets in the capture: its categories, NAS EMM messages and RRC messages."""
+        names = sorted(self.category_names())
+        names += sorted(f'NAS: {emm_message_name(msg_type)}' for msg_type in self.emm_types)
+        names += sorted(f'RRC: {rrc_message_name(element)}' for element in self.rrc_elements)
+        return names
+
+    def filter(self, name):
+        """Lists the packets matching a filter listed by filters()."""
+        for msg_type in self.emm_types:
+            if name == f'NAS: {emm_message_name(msg_type)}':
+                return self.emm_messages(msg_type)
+        for element in self.rrc_elements:
+            if name == f'RRC: {rrc_message_name(element)}':
+                return self.rrc_messages(element)
+        return self.category(name)
+
+
+def emm_message_name(msg_type):
+    return EMM_MESSAGES.get(msg_type, f'EMM message type {msg_type}')
+
+
+def rrc_message_name(element):
+    return element[len(RRC_ELEMENT_PREFIX):-len(RRC_ELEMENT_SUFFIX)]
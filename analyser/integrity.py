@@ -0,0 +1,207 @@
+from analyser.decryption import (AUTN_FIELD, CIPHERING_FIELD, DIRECTION_FIELD, INTEGRITY_FIELD, MAC_LENGTH,
+                                 MCC_FIELD, MNC_FIELD, NAS_BEARER, NAS_PDU_FIELD, RAND_FIELD, SECURITY_HEADER_FIELD,
+                                 STREAM_CIPHERS, eea2, hex_bytes, imsi_networks, mac, security_context,
+                                 serving_networks, xor)
+from analyser.engine import EMM_TYPE, PRESENT, mark_analysed
+from analyser.findings import Severity, rule
+from analyser.smc import RRC_SMC_COMMAND
+from CryptoMobile.conv import conv_401_A3, conv_401_A7
+
+PDCP_SEQUENCE_FIELD = 'pdcp-lte.seq_num'
+PDCP_DATA_FIELD = 'pdcp-lte.signalling-data'
+PDCP_CIPHERED_FIELD = 'pdcp-lte.ciphered-data'
+PDCP_MAC_FIELD = 'pdcp-lte.mac'
+CHANNEL_TYPE_FIELD = 'rlc-lte.channel-type'
+CHANNEL_ID_FIELD = 'rlc-lte.channel-id'
+RRC_CIPHERING_FIELD = 'lte-rrc.cipheringAlgorithm'
+RRC_INTEGRITY_FIELD = 'lte-rrc.integrityProtAlgorithm'
+
+# fields read by this analyser, only these are extracted from the packet capture
+FIELDS = [EMM_TYPE, SECURITY_HEADER_FIELD, NAS_PDU_FIELD, DIRECTION_FIELD, CIPHERING_FIELD, INTEGRITY_FIELD,
+          RAND_FIELD, AUTN_FIELD, MCC_FIELD, MNC_FIELD, RRC_SMC_COMMAND, RRC_CIPHERING_FIELD, RRC_INTEGRITY_FIELD,
+          PDCP_SEQUENCE_FIELD, PDCP_DATA_FIELD, PDCP_CIPHERED_FIELD, PDCP_MAC_FIELD, CHANNEL_TYPE_FIELD,
+          CHANNEL_ID_FIELD]
+
+# the security contexts are started by security mode commands, after which every protected message is verified
+CATEGORIES = ['Security Mode Command']
+# analysis modules whose UE info is read by this analyser, they are run along with it
+DEPENDENCIES = []
+
+PROTECTED_HEADERS = ('1', '2', '3', '4')  # integrity protected, possibly ciphered, see TS 24.301 section 9.3.1
+SRB = '4'  # RLC channel type of signalling radio bearers
+RRC_ENCRYPTION = 3  # algorithm type distinguishers of the RRC keys, see TS 33.401 annex A.7
+RRC_INTEGRITY = 4
+PDCP_SEQUENCE_BITS = 5  # sequence numbers of PDCP PDUs on signalling radio bearers
+
+NAS_MAC_MISMATCH = rule('integrity.nas-mac-mismatch', Severity.ERROR,
+                        'NAS MAC ({}) does not match the MAC calculated with the keys of the subscriber ({}).\nThe message could have been tampered with.')
+PDCP_MAC_MISMATCH = rule('integrity.pdcp-mac-mismatch', Severity.ERROR,
+                         'PDCP MAC-I ({}) does not match the MAC-I calculated with the keys of the subscriber ({}).\nThe message could have been tampered with.')
+
+
+class RadioContext:
+    def __init__(self, kenb, ciphering, integrity):
+        """AS security context established by an RRC security mode command, see TS 33.401.
+
+        The RRC keys are derived from KeNB for the algorithms chosen by the eNodeB.
+        """
+        self.kenb = kenb
+        self.ciphering = ciphering
+        self.integrity = integrity
+        self.encryption_key = conv_401_A7(kenb, RRC_ENCRYPTION, ciphering)[16:]
+        self.integrity_key = conv_401_A7(kenb, RRC_INTEGRITY, integrity)[16:]
+
+
+def register(engine):
+    engine.ue_info['integrity'] = {'request': None, 'sn_ids': None, 'nas': None, 'uplink': None, 'rrc': None,
+                                   'pdcp': {}}
+    engine.on_message(EMM_TYPE, '82', authentication_request)  # NAS-EPS AuthenticationRequest
+    engine.on_message(EMM_TYPE, '93', nas_security_mode_command)  # NAS-EPS SecurityModeCommand
+    engine.on_message(RRC_SMC_COMMAND, PRESENT, rrc_security_mode_command)
+    engine.on_packet(rrc_connection_request, ['RRC Connection Establishment'])
+
+    # verify the MAC of every integrity protected NAS message and of every PDCP PDU on a signalling radio bearer
+    engine.on_packet(verify_nas)
+    engine.on_packet(verify_pdcp)
+
+
+def authentication_request(packet, engine, ue_info):
+    """Keeps the RAND and AUTN the NAS keys of the next security mode command are derived from."""
+    rand = packet.data.get(RAND_FIELD)
+    autn = packet.data.get(AUTN_FIELD)
+    if rand and autn:
+        ue_info['integrity']['request'] = (hex_bytes(rand), hex_bytes(autn))
+
+
+def nas_security_mode_command(packet, engine, ue_info):
+    """Starts a NAS security context, its NAS COUNTs start at zero. The command itself is protected by it."""
+    state = ue_info['integrity']
+    if state['request'] is None or not ue_info.get('sim_info'):
+        return
+    state['nas'] = security_context(ue_info['sim_info'], state['request'],
+                                    state['sn_ids'] or imsi_networks(ue_info['sim_info']), packet.data)
+    state['uplink'] = None
+
+
+def rrc_connection_request(packet, engine, ue_info):
+    """A new RRC connection ends the AS security context, and restarts the PDCP COUNTs of every bearer."""
+    if 'RRCConnectionRequest' in packet.full_summary:
+        ue_info['integrity']['rrc'] = None
+        ue_info['integrity']['pdcp'] = {}
+
+
+def rrc_security_mode_command(packet, engine, ue_info):
+    """Starts an AS security context, with KeNB derived from KASME and the uplink NAS COUNT.
+
+    Which uplink NAS COUNT is used differs between core networks: that of the last uplink NAS message, or the one
+    after it. The command is integrity protected, so the KeNB whose MAC-I matches that of the command is kept.
+    """
+    state = ue_info['integrity']
+    nas = state['nas']
+    ciphering = packet.data.get(RRC_CIPHERING_FIELD)
+    integrity = packet.data.get(RRC_INTEGRITY_FIELD)
+    if nas is None or ciphering is None or integrity is None:
+        return
+    uplink = 0 if state['uplink'] is None else state['uplink']
+    contexts = [RadioContext(conv_401_A3(nas.kasme, count), int(ciphering), int(integrity))
+                for count in (uplink, uplink + 1)]
+    state['rrc'] = contexts[0]
+    pdu = pdcp_pdu(packet.data, dict(state['pdcp']))  # the COUNT is tracked once the PDU is verified
+    if pdu is None or pdu[4] is None:
+        return
+    (bearer, direction, count, message, received) = pdu
+    for context in contexts:
+        if mac(context.integrity, context.integrity_key, count, bearer, direction, message) == received:
+            state['rrc'] = context
+            break
+
+
+def verify_nas(packet, engine, ue_info):
+    """Checks the MAC of an integrity protected NAS message. The MAC is calculated over the sequence number and
+    the (ciphered) message, with the NAS COUNT of the message, see TS 24.301 section 4.4.3."""
+    data = packet.data
+    state = ue_info['integrity']
+    if state['sn_ids'] is None:
+        state['sn_ids'] = serving_networks(data)
+    context = state['nas']
+    if context is None or data.get(SECURITY_HEADER_FIELD) not in PROTECTED_HEADERS or not data.get(NAS_PDU_FIELD):
+        return
+    pdu = hex_bytes(data.get(NAS_PDU_FIELD))
+    if len(pdu) <= 1 + MAC_LENGTH:
+        return
+    direction = 1 if data.get(DIRECTION_FIELD) == '1' else 0
+    count = context.count(direction, pdu[1 + MAC_LENGTH])
+    if direction == 0:
+        state['uplink'] = count
+    expected = mac(context.integrity, context.integrity_key, count, NAS_BEARER, direction, pdu[1 + MAC_LENGTH:])
+    if expected is None:
+        return
+    received = pdu[1:1 + MAC_LENGTH]
+    if expected != received:
+        packet.add_analysis(NAS_MAC_MISMATCH, received.hex(), expected.hex())
+    mark_analysed(packet, engine, ue_info)
+
+
+def verify_pdcp(packet, engine, ue_info):
+    """Checks the MAC-I of a PDCP PDU on a signalling radio bearer once AS security is active. The MAC-I is
+    calculated over the PDCP header and the RRC message, with the COUNT of the bearer, see TS 36.323."""
+    state = ue_info['integrity']
+    pdu = pdcp_pdu(packet.data, state['pdcp'])
+    context = state['rrc']
+    if pdu is None or context is None:
+        return
+    (bearer, direction, count, message, received) = pdu
+    if received is None:
+        # the MAC-I is ciphered along with the message, the header is not
+        deciphered = decipher(context, count, bearer, direction, message[1:])
+        if deciphered is None or len(deciphered) <= MAC_LENGTH:
+            return
+        (message, received) = (message[:1] + deciphered[:-MAC_LENGTH], deciphered[-MAC_LENGTH:])
+    expected = mac(context.integrity, context.integrity_key, count, bearer, direction, message)
+    if expected is None:
+        return
+    if expected != received:
+        packet.add_analysis(PDCP_MAC_MISMATCH, received.hex(), expected.hex())
+    mark_analysed(packet, engine, ue_info)
+
+
+def pdcp_pdu(data, counts=None):
+    """Returns the bearer, direction, COUNT, header and message, and MAC-I of a PDCP PDU on a signalling radio
+    bearer, or None if there is none. The MAC-I is None if it is ciphered, the message then is ciphered as well.
+
+    The COUNT of every bearer and direction is its sequence number, extended by the number of times the sequence
+    number wrapped. It is tracked in counts, if given.
+    """
+    sequence = data.get(PDCP_SEQUENCE_FIELD)
+    if data.get(CHANNEL_TYPE_FIELD) != SRB or sequence is None:
+        return None
+    sequence = int(sequence)
+    bearer = int(data.get(CHANNEL_ID_FIELD) or 1) - 1  # SRB1 and SRB2 are bearers 0 and 1
+    direction = 1 if data.get(DIRECTION_FIELD) == '1' else 0
+    (overflow, last) = (counts or {}).get((bearer, direction), (0, -1))
+    if sequence < last:
+        overflow += 1
+    if counts is not None:
+        counts[(bearer, direction)] = (overflow, sequence)
+    count = ((overflow << PDCP_SEQUENCE_BITS) | sequence) & 0xffffffff
+    header = bytes([sequence])
+    if data.get(PDCP_CIPHERED_FIELD):
+        return bearer, direction, count, header + hex_bytes(data.get(PDCP_CIPHERED_FIELD)), None
+    message = data.get(PDCP_DATA_FIELD)
+    received = data.get(PDCP_MAC_FIELD)
+    if message is None or received is None:
+        return None
+    return bearer, direction, count, header + hex_bytes(message), int(received, 16).to_bytes(MAC_LENGTH, 'big')
+
+
+def decipher(context, count, bearer, direction, message):
+    """Deciphers a PDCP PDU, returning None if its algorithm is not available."""
+    if context.ciphering == 0:
+        return message
+    if context.ciphering == 2:
+        return eea2(context.encryption_key, count, bearer, direction, message)
+    if STREAM_CIPHERS.get(context.ciphering) is not None:
+        request = (count, bearer, direction, len(message))
+        return xor(message, STREAM_CIPHERS[context.ciphering](context.encryption_key, [request])[0])
+    return None
+
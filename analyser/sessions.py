@@ -0,0 +1,111 @@
+RNTI_FIELD = 'mac-lte.rnti'
+NAS_M_TMSI_FIELD = 'nas_eps.emm.m_tmsi'
+RRC_M_TMSI_FIELD = 'lte-rrc.m_TMSI'  # S-TMSI in the RRCConnectionRequest of a UE which is already registered
+IMSI_FIELD = 'e212.imsi'
+
+# fields read to partition a capture, only these are extracted from the packet capture
+FIELDS = [RNTI_FIELD, NAS_M_TMSI_FIELD, RRC_M_TMSI_FIELD, IMSI_FIELD]
+
+
+class Session:
+    def __init__(self, rnti):
+        """Packets of a single UE, from one or more RRC connections which are linked by the identity of the UE."""
+        self.rntis = [rnti]
+        self.identities = set()  # (kind, value) of the M-TMSIs and IMSIs the UE was seen with
+        self.imsi = None  # first IMSI the UE was seen with
+        self.subscriber = None  # IMSI of the subscriber whose SIM info the session is analysed with
+        self.packets = []
+        self.merged = None  # session this session was merged into, once it turned out to be the same UE
+        self.ue_info = None
+        self.error = None  # message of the exception which stopped the analysis of the session, if any
+
+
+def partition(packets):
+    """Partitions a capture into the sessions of every UE.
+
+    Packets belong to the RRC connection of their RNTI, until the connection is released and the RNTI can be
+    handed to another UE. Connections in which the same M-TMSI or IMSI is seen are linked into one session.
+    Packets without an RNTI are added to the session of the packet before them.
+    """
+    sessions = []
+    active = {}  # RNTI -> session of its current RRC connection
+    owners = {}  # identity -> session of the UE
+    current = None
+    pending = []  # packets before the first packet with an RNTI
+    for packet in packets:
+        rnti = packet.data.get(RNTI_FIELD)
+        if rnti is None:
+            if current is None:
+                pending.append(packet)
+                continue
+            session = current
+        else:
+            session = active.get(rnti)
+            if session is None:
+                session = active[rnti] = Session(rnti)
+                sessions.append(session)
+        session.packets.append(packet)
+        for identity in identities(packet):
+            owner = owners.get(identity)
+            if owner is None:
+                owners[identity] = session
+                session.identities.add(identity)
+                if identity[0] == 'imsi' and session.imsi is None:
+                    session.imsi = identity[1]
+            elif owner is not session:
+                merge(session, owner, active, owners)
+                session = owner
+        if rnti is not None and 'RRCConnectionRelease' in packet.full_summary:
+            active.pop(rnti, None)
+        current = session
+
+    sessions = [session for session in sessions if session.merged is None]
+    if pending:
+        if not sessions:
+            sessions.append(Session(None))
+        sessions[0].packets[:0] = pending
+    for session in sessions:
+        session.packets.sort(key=lambda packet: packet.id)
+    return sessions
+
+
+def merge(session, owner, active, owners):
+    """Merges a session into the earlier session of the same UE."""
+    owner.packets.extend(session.packets)
+    owner.rntis.extend(session.rntis)
+    for identity in session.identities:
+        owners[identity] = owner
+    owner.identities |= session.identities
+    if owner.imsi is None:
+        owner.imsi = session.imsi
+    for rnti in session.rntis:
+        if active.get(rnti) is session:
+            active[rnti] = owner
+    session.merged = owner
+
+
+def identities(packet):
+    """Lists the identities of the UE in a packet, M-TMSIs are converted to numbers since RRC and NAS show them
+    differently."""
+    found = []
+    for (field, parse) in ((NAS_M_TMSI_FIELD, nas_tmsi_value), (RRC_M_TMSI_FIELD, rrc_tmsi_value)):
+        value = packet.data.get(field)
+        if value:
+            try:
+                found.append(('m-tmsi', parse(value)))
+            except ValueError:
+                pass  # not an M-TMSI, the packet is kept in the session of its RNTI
+    imsi = packet.data.get(IMSI_FIELD)
+    if imsi:
+        found.append(('imsi', imsi))
+    return found
+
+
+def nas_tmsi_value(value):
+    """NAS shows the M-TMSI as a number, in hexadecimal (0x...) or decimal depending on the tshark version."""
+    return int(value, 16) if value.lower().startswith('0x') else int(value)
+
+
+def rrc_tmsi_value(value):
+    """RRC shows the M-TMSI as a 32 bit BIT STRING, always in hexadecimal, with or without separators."""
+    return int(value.replace(':', ''), 16)
@@ -1,71 +1,111 @@
-def analyse(packets, ue_info):
-    for packet in packets:
-        if packet.data.get('nas_eps.nas_msg_emm_type') == '93':
-            nas_smc93(packet, packets, ue_info)  # NAS-EPS SecurityModeCommand
-        elif packet.data.get('nas_eps.nas_msg_emm_type') == '94':
-            pass  # NAS-EPS SecurityModeComplete
-        elif packet.data.get('nas_eps.nas_msg_emm_type') == '95':
-            nas_smc95(packet, packets, ue_info)  # NAS-EPS SecurityModeReject
-        elif packet.data.get('lte-rrc.securityModeCommand_element') == 'securityModeCommand':
-            rrc_smc_command(packet, packets, ue_info)  # RRC SecurityModeCommand
-        elif packet.data.get('lte-rrc.securityModeComplete_element') == 'securityModeComplete':
-            rrc_smc_complete(packet, packets, ue_info)  # RRC SecurityModeComplete
-        elif packet.data.get('lte-rrc.securityModeFailure_element') == 'securityModeFailure':
-            pass  # RRC SecurityModeFailure
-        packet.category.append('Analysed')
-
-
-def nas_smc93(packet, packets, ue_info):
+from analyser import SECURITY_CAPABILITY_FIELDS, MissingUserEquipmentInfoException
+from analyser.engine import EMM_TYPE, PRESENT, mark_analysed
+from analyser.findings import Severity, rule
+
+# fields read by this analyser, only these are extracted from the packet capture
+FIELDS = ['nas_eps.nas_msg_emm_type', 'nas_eps.emm.toc', 'nas_eps.emm.toi',
+          'lte-rrc.securityModeCommand_element', 'lte-rrc.securityModeComplete_element',
+          'lte-rrc.securityModeFailure_element', 'lte-rrc.cipheringAlgorithm', 'lte-rrc.integrityProtAlgorithm',
+          'pdcp-lte.security-config.ciphering', 'pdcp-lte.security-config.integrity'] + SECURITY_CAPABILITY_FIELDS
+
+
+CATEGORIES = ['Security Mode Command']
+# analysis modules whose UE info is read by this analyser, they are run along with it
+DEPENDENCIES = []
+RRC_SMC_COMMAND = 'lte-rrc.securityModeCommand_element'
+RRC_SMC_COMPLETE = 'lte-rrc.securityModeComplete_element'
+RRC_SMC_FAILURE = 'lte-rrc.securityModeFailure_element'
+
+NAS_CAPABILITY_MISMATCH = rule('smc.nas-capability-mismatch', Severity.WARNING,
+                               'Security capabilities in NAS security mode command do not match capabilities in attach request.')
+NAS_CIPHERING_INCAPABLE = rule('smc.nas-ciphering-incapable', Severity.ERROR,
+                               'UE not capable of using NAS chosen ciphering algorithm.')
+NAS_INTEGRITY_INCAPABLE = rule('smc.nas-integrity-incapable', Severity.ERROR,
+                               'UE not capable of using NAS chosen integrity algorithm.')
+RRC_CIPHERING_INCAPABLE = rule('smc.rrc-ciphering-incapable', Severity.ERROR,
+                               'UE not capable of RRC chosen ciphering algorithm.')
+RRC_INTEGRITY_INCAPABLE = rule('smc.rrc-integrity-incapable', Severity.ERROR,
+                               'UE not capable of RRC chosen integrity protection algorithm.')
+PDCP_CIPHERING_MISMATCH = rule('smc.pdcp-ciphering-mismatch', Severity.WARNING,
+                               'PDCP does not use configured RRC ciphering algorithm.')
+PDCP_INTEGRITY_MISMATCH = rule('smc.pdcp-integrity-mismatch', Severity.WARNING,
+                               'PDCP does not use configured RRC integrity protection algorithm.')
+NULL_CIPHERING = rule('smc.null-ciphering', Severity.WARNING,
+                      'Null ciphering algorithm in use. Data is not encrypted over air interface.\n\t Data could be read by third parties.')
+CIPHERED = rule('smc.ciphered', Severity.NOTE, 'Because of ciphered data, analysis past this point is limited.')
+DECIPHERED = rule('smc.deciphered', Severity.NOTE,
+                  'Ciphered NAS messages past this point were deciphered with the keys of the subscriber.')
+NULL_INTEGRITY = rule('smc.null-integrity', Severity.MAJOR_WARNING,
+                      'No integrity protection algorithm in use. \n\t Data could be tampered with by third parties.')
+NAS_FAILURE_MISSING = rule('smc.nas-failure-missing', Severity.MAJOR_WARNING,
+                           'UE has not sent a failure message for incapability.', '\t')
+RRC_FAILURE_MISSING = rule('smc.rrc-failure-missing', Severity.MAJOR_WARNING,
+                           'UE has not sent a failure message for incapability.', '\t')
+
+
+def register(engine):
+    engine.on_message(EMM_TYPE, '93', nas_smc93, CATEGORIES)  # NAS-EPS SecurityModeCommand
+    engine.on_message(EMM_TYPE, '95', nas_smc95, CATEGORIES)  # NAS-EPS SecurityModeReject
+    engine.on_message(RRC_SMC_COMMAND, PRESENT, rrc_smc_command, CATEGORIES)
+    engine.on_message(RRC_SMC_COMPLETE, PRESENT, rrc_smc_complete, CATEGORIES)
+    engine.on_message(RRC_SMC_FAILURE, PRESENT, rrc_smc_failure, CATEGORIES)
+    engine.on_packet(mark_analysed, CATEGORIES)
+
+
+def nas_smc93(packet, engine, ue_info):
     """Analyses the NAS-EPS SecurityModeCommand message."""
     from analyser.analysis import filter_dictionary
+    if 'security_capabilities' not in ue_info:
+        raise MissingUserEquipmentInfoException
     filter_list = [k for (k, v) in ue_info['security_capabilities'].items()]
-    packet_info = {k.split('.')[-1]: v for (k, v) in
-                   filter_dictionary(vars(packet.data)['_all_fields'], filter_list).items()}
+    packet_info = {k.split('_')[-1]: v for (k, v) in
+                   filter_dictionary(packet.data, filter_list).items()}
 
     # gather chosen values
     ca, ia = smc_algorithms(packet, 'nas_eps.emm.toc', 'nas_eps.emm.toi')
 
     # check for accurate security capabilities (matching from attach request)
     if not packet_info == ue_info['security_capabilities']:
-        packet.add_analysis(
-            'Security capabilities in NAS security mode command do not match capabilities in attach request.', 1)
+        packet.add_analysis(NAS_CAPABILITY_MISMATCH)
 
     # check if UE capable of ciphering algorithm
     if ue_info['security_capabilities'][ca] == '0':
-        packet.add_analysis('UE not capable of using NAS chosen ciphering algorithm.', 3)
-        nas_smc_fail_sent(packet, packets)
+        packet.add_analysis(NAS_CIPHERING_INCAPABLE)
+        engine.defer(packet, nas_smc_fail_sent)
 
     # check if UE capable of integrity algorithm
     if ue_info['security_capabilities'][ia] == '0':
-        packet.add_analysis('UE not capable of using NAS chosen integrity algorithm.', 3)
-        nas_smc_fail_sent(packet, packets)
+        packet.add_analysis(NAS_INTEGRITY_INCAPABLE)
+        engine.defer(packet, nas_smc_fail_sent)
 
     # check if ciphering and integrity protection are used
-    smc_algo_used(packet, ca, ia)
+    smc_algo_used(packet, ca, ia, 'nas_deciphered' in ue_info)
 
     # save ciphering and integrity algorithm
     ue_info['nas_ca'] = ca
     ue_info['nas_ia'] = ia
     ue_info['locations']['nas_smc'] = int(packet.id)
 
-def nas_smc95(packet, packets, ue_info):
+def nas_smc95(packet, engine, ue_info):
     pass
 
-def rrc_smc_command(packet, packets, ue_info):
+def rrc_smc_command(packet, engine, ue_info):
     """Analyses the RRC SecurityModeCommand message."""
+    if 'security_capabilities' not in ue_info:
+        raise MissingUserEquipmentInfoException
 
     # gather chosen values
     ca, ia = smc_algorithms(packet, 'lte-rrc.cipheringAlgorithm', 'lte-rrc.integrityProtAlgorithm')
 
     # check if UE capable of ciphering algorithm
     if ue_info['security_capabilities'][ca] == '0':
-        packet.add_analysis('UE not capable of RRC chosen ciphering algorithm.', 3)
-        rrc_smc_fail_sent(packet, packets)
+        packet.add_analysis(RRC_CIPHERING_INCAPABLE)
+        engine.defer(packet, rrc_smc_fail_sent)
 
     # check if UE capable of integrity protection algorithm
     if ue_info['security_capabilities'][ia] == '0':
-        packet.add_analysis('UE not capable of RRC chosen integrity protection algorithm.', 3)
-        rrc_smc_fail_sent(packet, packets)
+        packet.add_analysis(RRC_INTEGRITY_INCAPABLE)
+        engine.defer(packet, rrc_smc_fail_sent)
 
     # check if ciphering and integrity protection are used
     smc_algo_used(packet, ca, ia)
@@ -75,7 +115,7 @@ def rrc_smc_command(packet, packets, ue_info):
     ue_info['rrc_ia'] = ia
     ue_info['locations']['rrc_smc'] = int(packet.id)
 
-def rrc_smc_complete(packet, packets, ue_info):
+def rrc_smc_complete(packet, engine, ue_info):
     """Analyses the RRC SecurityModeComplete message."""
 
     # gather configured values
@@ -92,9 +132,12 @@ def rrc_smc_complete(packet, packets, ue_info):
     # check if PDCP uses configured values
     pdcp_ca, pdcp_ia = smc_algorithms(packet, 'pdcp-lte.security-config.ciphering', 'pdcp-lte.security-config.integrity')
     if ca and not pdcp_ca == ca:
-        packet.add_analysis('PDCP does not use configured RRC ciphering algorithm.')
+        packet.add_analysis(PDCP_CIPHERING_MISMATCH)
     if ia and not pdcp_ia == ia:
-        packet.add_analysis('PDCP does not use configured RRC integrity protection algorithm.')
+        packet.add_analysis(PDCP_INTEGRITY_MISMATCH)
+
+def rrc_smc_failure(packet, engine, ue_info):
+    pass
 
 def smc_algorithms(packet, ca_loc, ia_loc):
     ca = 'eea' + packet.data.get(ca_loc)
@@ -106,40 +149,29 @@ def smc_algorithms(packet, ca_loc, ia_loc):
     return ca, ia
 
 
-def smc_algo_used(packet, ca, ia):
+def smc_algo_used(packet, ca, ia, deciphered=False):
     """Checks if the ciphering and integrity algorithms are used. Warns the user if any of them are not used."""
 
     # check if ciphering is used
     if ca == 'eea0':
-        packet.add_analysis(
-            'Null ciphering algorithm in use. Data is not encrypted over air interface.\n\t Data could be read by third parties.',
-            1)
+        packet.add_analysis(NULL_CIPHERING)
+    elif deciphered:
+        packet.add_analysis(DECIPHERED)
     else:
-        packet.add_analysis('Because of ciphered data, analysis past this point is limited.', 0)
+        packet.add_analysis(CIPHERED)
 
     # check if integrity algorithm is used
     if ia == 'eia0':
-        packet.add_analysis(
-            'No integrity protection algorithm in use. \n\t Data could be tampered with by third parties.', 2)
+        packet.add_analysis(NULL_INTEGRITY)
 
 
-def nas_smc_fail_sent(packet, packets):
+def nas_smc_fail_sent(packet, engine, ue_info):
     """Checks if the packet capture contains a NAS-EPS SecurityModeFailure message."""
-    failure_known = False
-    # check if SecurityModeFailure message sent
-    for packet in packets:
-        if packet.data.get('nas_eps.nas_msg_emm_type') == '95':
-            failure_known = True
-    if not failure_known:
-        packet.add_analysis('UE has not sent a failure message for incapability.', 2, custom_preamble='\t')
+    if not engine.has_seen(EMM_TYPE, '95'):
+        packet.add_analysis(NAS_FAILURE_MISSING)
 
 
-def rrc_smc_fail_sent(smc_packet, packets):
+def rrc_smc_fail_sent(smc_packet, engine, ue_info):
     """Checks if the packet capture contains a RRC SecurityModeFailure message."""
-    failure_known = False
-    # check if SecurityModeFailure message sent
-    for packet in packets:
-        if packet.data.get('lte-rrc.securityModeFailure_element') == 'securityModeFailure':
-            failure_known = True
-    if not failure_known:
-        smc_packet.add_analysis('UE has not sent a failure message for incapability.', 2, custom_preamble='\t')
+    if not engine.has_seen(RRC_SMC_FAILURE, PRESENT):
+        smc_packet.add_analysis(RRC_FAILURE_MISSING)
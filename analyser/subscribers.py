@@ -0,0 +1,161 @@
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from analyser.authentication import authentication_vector
+from analyser.columns import np
+from analyser.engine import EMM_TYPE
+from CryptoMobile.Milenage import MilenageBatch
+
+IMSI_FIELD = 'e212.imsi'
+RAND_FIELD = 'gsm_a.dtap.rand'
+AUTN_FIELD = 'gsm_a.dtap.autn'
+
+# fields read to find the subscriber of a UE, only these are extracted from the packet capture
+FIELDS = [IMSI_FIELD, EMM_TYPE, RAND_FIELD, AUTN_FIELD]
+
+SEARCH_CHUNK_SIZE = 512  # subscribers tested at a time by a process searching for a subscriber
+
+
+class UserDatabase:
+    def __init__(self, subscribers, digest=''):
+        """Subscribers of a user_db.csv file as used by srsRAN, indexed by IMSI.
+
+        The first subscriber is the default, it is used for UEs whose IMSI is not seen or not in the database.
+        The digest identifies the contents of the file, e.g. to cache analysis results.
+        """
+        self.subscribers = subscribers  # IMSI -> SIM info
+        self.default = next(iter(subscribers.values()), None)
+        self.digest = digest
+
+    def __len__(self):
+        return len(self.subscribers)
+
+    def sim_info(self, imsi=None):
+        """Returns the SIM info of a subscriber by IMSI, or the SIM info of the default subscriber."""
+        return self.subscribers.get(imsi, self.default)
+
+
+def load(filename):
+    """Loads every subscriber of a user_db.csv file. Keys, OP/OPc values and AMFs are converted to bytes once."""
+    subscribers = {}
+    with open(filename, 'rb') as f:
+        content = f.read()
+    for (number, line) in enumerate(content.decode().splitlines(), 1):
+        if '#' in line or not line.strip():
+            continue
+        try:
+            subscriber = parse(line)
+        except Exception:
+            raise IndexError(f'Something went wrong reading line {number} of the file. '
+                             'Make sure you entered the correct filename.')
+        subscribers.setdefault(subscriber['imsi'], subscriber)
+    return UserDatabase(subscribers, hashlib.sha256(content).hexdigest())
+
+
+def parse(line):
+    """Parses a subscriber in the format "Name,Auth,IMSI,Key,OP_Type,OP/OPc,AMF,SQN,QCI,IP_alloc"."""
+    data = line.strip().split(',')[1:]
+    return {
+        'auth'      : data[0],
+        'imsi'      : data[1],
+        'key'       : bytes.fromhex(data[2]),
+        data[3]     : bytes.fromhex(data[4]),
+        'amf'       : bytes.fromhex(data[5]),
+        'sqn'       : data[6],
+        'qci'       : data[7],
+        'ip_alloc'  : data[8]
+    }
+
+
+def resolve(ue_info, imsi=None):
+    """Sets the SIM info of a UE from the user database in its UE info, if there is one."""
+    user_db = ue_info.get('user_db')
+    if user_db is None:
+        return
+    ue_info['sim_info'] = user_db.sim_info(imsi)
+    ue_info['subscriber'] = imsi
+
+
+def authentication_request(packets):
+    """Returns the RAND and AUTN of the first authentication request in the packets, or None if there is none."""
+    for packet in packets:
+        if packet.data.get(EMM_TYPE) == '82':
+            rand = packet.data.get(RAND_FIELD)
+            autn = packet.data.get(AUTN_FIELD)
+            if rand and autn:
+                return bytes.fromhex(rand.replace(':', '')), bytes.fromhex(autn.replace(':', ''))
+    return None
+
+
+def search(user_db, rand, autn, jobs=1):
+    """Finds the subscriber of an authentication request by testing its AUTN against every subscriber.
+
+    The MAC in the AUTN is only produced by the key of the subscriber it was generated for. Subscribers are tested
+    in chunks, by a pool of processes if there are multiple jobs, until one of them matches. Returns the IMSI of
+    the subscriber, or None if no subscriber matches.
+    """
+    candidates = list(user_db.subscribers.values())
+    chunks = [candidates[i:i + SEARCH_CHUNK_SIZE] for i in range(0, len(candidates), SEARCH_CHUNK_SIZE)]
+    if jobs <= 1 or len(chunks) <= 1:
+        for chunk in chunks:
+            imsi = match(chunk, rand, autn)
+            if imsi is not None:
+                return imsi
+        return None
+    with ProcessPoolExecutor(max_workers=min(jobs, len(chunks))) as executor:
+        futures = [executor.submit(match, chunk, rand, autn) for chunk in chunks]
+        for future in as_completed(futures):
+            imsi = future.result()
+            if imsi is not None:
+                for pending in futures:
+                    pending.cancel()
+                return imsi
+    return None
+
+
+def match(candidates, rand, autn):
+    """Returns the IMSI of the first subscriber whose MAC matches the AUTN, using the AMF in the AUTN.
+
+    Milenage subscribers are tested together by a MilenageBatch if NumPy is available.
+    """
+    if len(rand) != 16 or len(autn) != 16:
+        return None
+    mac = autn[8:]
+    amf = autn[6:8]
+    candidates = [sim_info for sim_info in candidates if len(sim_info['key']) == 16]
+    first = len(candidates)
+    tested = set()
+    if np is not None:
+        for (name, rows) in milenage_rows(candidates).items():
+            keys = [candidates[i]['key'] for i in rows]
+            values = [candidates[i][name] for i in rows]
+            batch = MilenageBatch(keys, OP=values) if name == 'op' else MilenageBatch(keys, OPc=values)
+            macs = batch.f12345(rand, autn[:6], amf, concealed=True)[4]
+            found = np.flatnonzero((macs == np.frombuffer(mac, np.uint8)).all(axis=1))
+            if len(found):
+                first = min(first, rows[found[0]])
+            tested.update(rows)
+    for (i, sim_info) in enumerate(candidates[:first]):
+        if i not in tested:
+            vector = authentication_vector(sim_info, rand, autn, amf)
+            if vector is not None and vector[4] == mac:
+                return sim_info['imsi']
+    return candidates[first]['imsi'] if first < len(candidates) else None
+
+
+def milenage_rows(candidates):
+    """Groups the Milenage subscribers by whether they have an OP or an OPc, like authentication.milenage_context."""
+    rows = {'op': [], 'opc': []}
+    for (i, sim_info) in enumerate(candidates):
+        if sim_info.get('auth') == 'mil':
+            name = 'op' if sim_info.get('op') else 'opc'
+            if len(sim_info.get(name) or b'') == 16:
+                rows[name].append(i)
+    return {name: found for (name, found) in rows.items() if found}
+
+
+def select_subscriber(packet, engine, ue_info):
+    """Switches to the SIM info of the subscriber once the IMSI of the UE is seen in a streamed capture."""
+    imsi = packet.data.get(IMSI_FIELD)
+    if imsi and ue_info.get('subscriber') is None:
+        resolve(ue_info, imsi)
@@ -0,0 +1,159 @@
+import hashlib
+import marshal
+import os
+import struct
+import zlib
+from functools import lru_cache
+
+from packet import FieldTable
+
+CACHE_DIRECTORY = os.path.join(os.getenv('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'elvis')
+CACHE_VERSION = 2  # increase whenever the dissection output or the file layout changes
+MAX_CACHE_SIZE = 2 * 1024 ** 3  # bytes, least recently used captures are evicted above this size
+BLOCK_SIZE = 4096  # packets per compressed block
+CACHE_SUFFIXES = ('.elvc', '.elva')  # dissected captures and analysis results (see analyser.cache)
+
+MAGIC = b'ELVC'
+HEADER = struct.Struct('>4sH')
+BLOCK_HEADER = struct.Struct('>I')
+
+
+def cache_key(path, options, fields=None):
+    """Creates a key from the contents of the .pcap file, the tshark options and the fields it is dissected with."""
+    stat = os.stat(path)
+    digest = hashlib.sha256(file_digest(path, stat.st_size, stat.st_mtime_ns))
+    for option in ('-C', '-f', '-c'):
+        digest.update(f'\0{option}={options.get(option, "")}'.encode())
+    if fields:
+        digest.update(('\0-e=' + ','.join(fields)).encode())
+    return digest.hexdigest()
+
+
+@lru_cache(maxsize=64)
+def file_digest(path, size, modified):
+    """Hashes the contents of a file once, as long as its size and modification time stay the same."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def cache_path(key):
+    return os.path.join(CACHE_DIRECTORY, key + '.elvc')
+
+
+def load(key):
+    """Yields the cached (fields, summary) tuples of a capture, or returns None if the capture is not cached."""
+    path = cache_path(key)
+    try:
+        f = open(path, 'rb')
+    except OSError:
+        return None
+    header = f.read(HEADER.size)
+    if len(header) != HEADER.size or HEADER.unpack(header) != (MAGIC, CACHE_VERSION):
+        f.close()
+        invalidate(key)
+        return None
+    try:
+        os.utime(path)  # the modification time doubles as the last access time for eviction
+    except FileNotFoundError:
+        pass  # evicted by another process, the open file can still be read
+    return read_blocks(f)
+
+
+def read_blocks(f):
+    """Yields the cached (fields, summary) tuples of an open cache file whose header was read, then closes it."""
+    with f:
+        while header := f.read(BLOCK_HEADER.size):
+            (length,) = BLOCK_HEADER.unpack(header)
+            names, rows, summaries = marshal.loads(zlib.decompress(f.read(length)))
+            for (row, summary) in zip(rows, summaries):
+                fields = {names[i]: value for (i, value) in zip(row[0::2], row[1::2])}
+                yield FieldTable(fields), summary
+
+
+def store(key, records):
+    """Passes on every (fields, summary) tuple of a capture while writing them to the cache.
+
+    The cache file only becomes visible once the records were read to the end and their producer finished
+    without an error (e.g. a failed tshark run, see ingest.tshark.TsharkException). Otherwise the temporary
+    file is removed, so a capture is never cached partially, nor cached as empty because its dissection failed.
+    """
+    os.makedirs(CACHE_DIRECTORY, exist_ok=True)
+    path = cache_path(key)
+    temporary = f'{path}.{os.getpid()}.tmp'
+    try:
+        with open(temporary, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, CACHE_VERSION))
+            block = []
+            for record in records:
+                block.append(record)
+                yield record
+                if len(block) == BLOCK_SIZE:
+                    write_block(f, block)
+                    block = []
+            if block:
+                write_block(f, block)
+    except BaseException:  # the producer failed, or the records were not read to the end
+        os.remove(temporary)
+        raise
+    os.replace(temporary, path)
+    evict()
+
+
+def write_block(f, block):
+    """Writes a block of packets column by column, with every field name stored only once per block."""
+    names = {}
+    rows = []
+    for (fields, _) in block:
+        row = []
+        for (name, value) in fields.items():
+            row.append(names.setdefault(name, len(names)))
+            row.append(value)
+        rows.append(row)
+    summaries = [summary for (_, summary) in block]
+    data = zlib.compress(marshal.dumps((list(names), rows, summaries)))
+    f.write(BLOCK_HEADER.pack(len(data)))
+    f.write(data)
+
+
+def invalidate(key):
+    try:
+        os.remove(cache_path(key))
+    except OSError:
+        pass
+
+
+def evict(max_size=MAX_CACHE_SIZE):
+    """Removes the least recently used captures until the cache fits in the maximum size.
+
+    Other processes (e.g. batch workers) can evict the same files at the same time, files which are already gone
+    are skipped.
+    """
+    entries = []
+    for name in os.listdir(CACHE_DIRECTORY):
+        if name.endswith(CACHE_SUFFIXES):
+            try:
+                stat = os.stat(os.path.join(CACHE_DIRECTORY, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+    total = sum(size for (_, size, _) in entries)
+    for (_, size, name) in sorted(entries):
+        if total <= max_size:
+            break
+        try:
+            os.remove(os.path.join(CACHE_DIRECTORY, name))
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def cached(path, options, dissect, fields=None):
+    """Reads a capture from the cache, dissecting it with dissect(path, options, fields) and caching it on a miss."""
+    key = cache_key(path, options, fields)
+    records = load(key)
+    if records is None:
+        records = store(key, dissect(path, options, fields))
+    return records
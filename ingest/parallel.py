@@ -0,0 +1,70 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from ingest import tshark
+from ingest.pcap import record_boundaries, temporary_capture, UnsupportedCaptureFormatException
+
+MIN_CHUNK_SIZE = 2000  # frames, smaller chunks cost more in tshark start-up time than they save
+
+
+def split_chunks(offsets, jobs):
+    """Splits the records of a capture into frame ranges, a few per worker to balance uneven chunks."""
+    frames = len(offsets) - 1
+    chunk_size = max(MIN_CHUNK_SIZE, -(-frames // (jobs * 4)))
+    return [(start, min(start + chunk_size, frames)) for start in range(0, frames, chunk_size)]
+
+
+def dissect_chunk(path, header, start, stop, first_frame, options, fields=None, context=()):
+    """Dissects the records between two byte offsets of a capture in a separate tshark process.
+
+    The records at the byte ranges of context are dissected before the chunk, but are not returned. Given the
+    first record of the capture and the record before the chunk, the Time column is relative to the first frame
+    of the capture and time deltas span the start of the chunk, like in a dissection of the full capture.
+    Frame numbers in the summary lines are shifted so they match the frame numbers of the full capture.
+    """
+    data = []
+    with open(path, 'rb') as f:
+        for (record_start, record_stop) in list(context) + [(start, stop)]:
+            f.seek(record_start)
+            data.append(f.read(record_stop - record_start))
+    records = []
+    with temporary_capture(header, b''.join(data)) as chunk_path:
+        for (table, summary) in tshark.dissect(chunk_path, options, fields):
+            number, rest = summary.split(' ', 1)
+            number = int(number) - len(context)
+            if number > 0:
+                records.append((table, f'{number + first_frame} {rest}'))
+    return records
+
+
+def chunk_context(offsets, first):
+    """Returns the byte ranges of the first record of a capture and the record before a chunk."""
+    return [(offsets[record], offsets[record + 1]) for record in sorted({0, first - 1}) if 0 <= record < first]
+
+
+def dissect(path, options, fields=None, jobs=os.cpu_count()):
+    """Dissects a capture in frame range chunks over a pool of tshark processes, yielding frames in order.
+
+    Note that state which tshark keeps between frames (e.g. RLC reassembly) does not carry over chunk
+    boundaries. Captures whose records can not be split are dissected by a single tshark process.
+    """
+    chunk_options = dict(options)
+    limit = chunk_options.pop('-c', None)
+    try:
+        header, offsets = record_boundaries(path, int(limit) if limit else None)
+        chunks = split_chunks(offsets, jobs)
+    except UnsupportedCaptureFormatException:
+        chunks = []
+    if len(chunks) <= 1:
+        yield from tshark.dissect(path, options, fields)
+        return
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(dissect_chunk, path, header, offsets[first], offsets[last], first, chunk_options,
+                                   fields, chunk_context(offsets, first))
+                   for (first, last) in chunks]
+        try:
+            for future in futures:
+                yield from future.result()
+        finally:
+            for future in futures:
+                future.cancel()
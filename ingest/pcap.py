@@ -0,0 +1,176 @@
+import mmap
+import os
+import struct
+import tempfile
+from array import array
+from contextlib import contextmanager
+
+# magic number of the libpcap global header -> byte order (microsecond and nanosecond resolution)
+PCAP_MAGIC = {
+    b'\xd4\xc3\xb2\xa1': '<',
+    b'\xa1\xb2\xc3\xd4': '>',
+    b'\x4d\x3c\xb2\xa1': '<',
+    b'\xa1\xb2\x3c\x4d': '>',
+}
+GLOBAL_HEADER_SIZE = 24
+RECORD_HEADER_SIZE = 16
+SNAPSHOT_LENGTH = 65535
+
+# pcapng files start with a section header block, its byte order magic gives the byte order of the section
+PCAPNG_MAGIC = b'\x0a\x0d\x0d\x0a'
+PCAPNG_BYTE_ORDER = {
+    b'\x4d\x3c\x2b\x1a': '<',
+    b'\x1a\x2b\x3c\x4d': '>',
+}
+INTERFACE_DESCRIPTION_BLOCK = 1
+PACKET_BLOCK = 2  # obsolete, but still written by some tools
+SIMPLE_PACKET_BLOCK = 3
+ENHANCED_PACKET_BLOCK = 6
+
+
+class UnsupportedCaptureFormatException(Exception):
+    def __init__(self, path):
+        self.message = f'{path} is not a libpcap or pcapng file, its records can not be read directly.'
+        super().__init__(self.message)
+
+
+class CaptureFile:
+    def __init__(self, path, limit=None):
+        """Indexes the records of a libpcap or pcapng file, whose frames are then read without copying them.
+
+        The file is memory mapped, and the bytes of a frame are returned as a memoryview of the mapping.
+        If limit is given, only the first limit records are indexed.
+        """
+        self.path = path
+        with open(path, 'rb') as f:
+            try:
+                self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:  # empty files can not be mapped
+                raise UnsupportedCaptureFormatException(path)
+        self.view = memoryview(self.map)
+        self.header = None  # the part of the file before the first record, if records can be copied to another file
+        self.starts = array('Q')  # offset of every record
+        self.ends = array('Q')  # offset after every record
+        self.frames = array('Q')  # start and stop offset of the bytes of every frame
+        if self.map[:4] in PCAP_MAGIC:
+            self.index_pcap(limit)
+        elif self.map[:4] == PCAPNG_MAGIC:
+            self.index_pcapng(limit)
+        else:
+            raise UnsupportedCaptureFormatException(path)
+
+    def index_pcap(self, limit):
+        record_header = struct.Struct(PCAP_MAGIC[self.map[:4]] + 'IIII')
+        offset = GLOBAL_HEADER_SIZE
+        while offset + RECORD_HEADER_SIZE <= len(self.map) and (limit is None or len(self.starts) < limit):
+            captured_length = record_header.unpack_from(self.map, offset)[2]
+            end = offset + RECORD_HEADER_SIZE + captured_length
+            self.add_record(offset, end, offset + RECORD_HEADER_SIZE, end)
+            offset = end
+        self.header = self.map[:GLOBAL_HEADER_SIZE]
+
+    def index_pcapng(self, limit):
+        """Indexes the packet blocks of a pcapng file.
+
+        Records can only be copied to another file if the file has a single section, and all interfaces are
+        described before the first packet, so the part of the file before the first packet describes them all.
+        """
+        order = None
+        first_record = None
+        copyable = True
+        offset = 0
+        while offset + 12 <= len(self.map) and (limit is None or len(self.starts) < limit):
+            if self.map[offset:offset + 4] == PCAPNG_MAGIC:
+                if order is not None:
+                    copyable = False
+                order = PCAPNG_BYTE_ORDER.get(self.map[offset + 8:offset + 12])
+                if order is None:
+                    break
+            (block_type, length) = struct.unpack_from(order + 'II', self.map, offset)
+            if length < 12 or offset + length > len(self.map):
+                break  # truncated capture
+            if block_type in (ENHANCED_PACKET_BLOCK, PACKET_BLOCK):
+                (captured_length,) = struct.unpack_from(order + 'I', self.map, offset + 20)
+                self.add_record(offset, offset + length, offset + 28, offset + 28 + captured_length)
+            elif block_type == SIMPLE_PACKET_BLOCK:
+                (original_length,) = struct.unpack_from(order + 'I', self.map, offset + 8)
+                self.add_record(offset, offset + length, offset + 12, offset + 12 + min(original_length, length - 16))
+            elif block_type == INTERFACE_DESCRIPTION_BLOCK and first_record is not None:
+                copyable = False
+            if first_record is None and self.starts:
+                first_record = offset
+            offset += length
+        if copyable:
+            self.header = self.map[:offset if first_record is None else first_record]
+
+    def add_record(self, start, end, frame_start, frame_stop):
+        self.starts.append(start)
+        self.ends.append(end)
+        self.frames.append(frame_start)
+        self.frames.append(frame_stop)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def frame(self, number):
+        """Returns the bytes of a frame by its frame number, or no bytes if the file has no such frame."""
+        if not 0 < number <= len(self.starts):
+            return b''
+        return self.view[self.frames[2 * number - 2]:self.frames[2 * number - 1]]
+
+    def record(self, number):
+        """Returns a record including its header, so it can be written to another capture file."""
+        return self.map[self.starts[number - 1]:self.ends[number - 1]]
+
+
+def open_capture(path):
+    """Opens a capture file for reading frames, or returns None if its format is not supported."""
+    try:
+        return CaptureFile(path)
+    except UnsupportedCaptureFormatException:
+        return None
+
+
+def with_frames(path, records):
+    """Joins (fields, summary) tuples with the bytes of their frames, by the frame number in the summary."""
+    capture = open_capture(path)
+    for (fields, summary) in records:
+        raw = capture.frame(int(summary.split(' ', 1)[0])) if capture else b''
+        yield fields, summary, raw
+
+
+def record_boundaries(path, limit=None):
+    """Reads the record boundaries of a capture file without dissecting it.
+
+    Returns the part of the file before the first record and the offsets at which every record starts,
+    followed by the offset at which the last record ends. If limit is given, only the first limit records
+    are read. Every range of records can be written after the header to make a capture file of its own.
+    """
+    capture = CaptureFile(path, limit)
+    if capture.header is None:
+        raise UnsupportedCaptureFormatException(path)
+    end = capture.ends[-1] if len(capture) else len(capture.header)
+    return capture.header, capture.starts.tolist() + [end]
+
+
+def capture_header(linktype):
+    """Returns the global header of a libpcap file whose frames have the given link type."""
+    return struct.pack('<IHHiIII', 0xa1b2c3d4, 2, 4, 0, 0, SNAPSHOT_LENGTH, linktype)
+
+
+def capture_records(frames):
+    """Returns libpcap records of the given frames, to be written after a global header."""
+    return b''.join(struct.pack('<IIII', 0, 0, len(frame), len(frame)) + frame for frame in frames)
+
+
+@contextmanager
+def temporary_capture(header, records):
+    """Writes records to a temporary capture file, since tshark can only read complete files."""
+    descriptor, path = tempfile.mkstemp(suffix='.pcap')
+    try:
+        with os.fdopen(descriptor, 'wb') as f:
+            f.write(header)
+            f.write(records)
+        yield path
+    finally:
+        os.remove(path)
@@ -0,0 +1,112 @@
+import atexit
+import subprocess
+import tempfile
+import threading
+
+from ingest.tshark import check_status
+
+FEED_SIZE = 1024 * 1024  # bytes written to the stdin of tshark at a time
+
+
+class TsharkPool:
+    def __init__(self, size=2):
+        """Keeps tshark processes started ahead of time, so they have loaded their profile before a capture arrives.
+
+        tshark can only read a single capture, so every process is used once. The processes read the capture
+        from stdin (-r -) and are kept per command line, which binds them to a configuration profile and to the
+        options they were started with. Processes which died while waiting are replaced when they are taken.
+        """
+        self.size = size
+        self.idle = {}
+        self.lock = threading.Lock()
+        atexit.register(self.close)
+
+    def start(self, command):
+        errors = tempfile.TemporaryFile()  # not a pipe, which tshark could fill while nobody reads it
+        process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=errors)
+        process.errors = errors
+        return process
+
+    def acquire(self, command):
+        """Takes a healthy warm process for the command, starting new ones to take its place."""
+        key = tuple(command)
+        with self.lock:
+            processes = self.idle.setdefault(key, [])
+            process = None
+            while processes and process is None:
+                process = processes.pop(0)
+                if process.poll() is not None:
+                    discard(process)
+                    process = None
+            if process is None:
+                process = self.start(command)
+            while len(processes) < self.size:
+                processes.append(self.start(command))
+        return process
+
+    def run(self, command, source):
+        """Yields the output of a warm tshark process line by line, feeding it a capture file path or bytes.
+
+        Raises TsharkException with the error output of tshark if it fails, like ingest.tshark.run.
+        """
+        process = self.acquire(command)
+        feeder = threading.Thread(target=feed, args=(process, source), daemon=True)
+        feeder.start()
+        complete = False
+        try:
+            yield from process.stdout
+            complete = True
+        finally:
+            if not complete and process.poll() is None:
+                process.kill()
+            feeder.join()
+            try:
+                if complete:
+                    process.wait()
+                    check_status(process, process.errors)
+            finally:
+                discard(process)
+
+    def close(self):
+        """Stops all waiting processes."""
+        with self.lock:
+            for processes in self.idle.values():
+                for process in processes:
+                    discard(process)
+            self.idle = {}
+
+
+def feed(process, source):
+    """Writes a capture to the stdin of tshark, which stops reading early when it is given a frame count (-c)."""
+    try:
+        if isinstance(source, bytes):
+            process.stdin.write(source)
+        else:
+            with open(source, 'rb') as f:
+                for chunk in iter(lambda: f.read(FEED_SIZE), b''):
+                    process.stdin.write(chunk)
+        process.stdin.close()
+    except (BrokenPipeError, ValueError):
+        pass  # the process has exited or was killed
+
+
+def discard(process):
+    if process.poll() is None:
+        process.kill()
+    for stream in (process.stdin, process.stdout, process.errors):
+        try:
+            stream.close()
+        except (BrokenPipeError, ValueError):
+            pass
+    process.wait()
+
+
+_shared = None
+
+
+def shared_pool():
+    """Returns the pool shared by all ingest calls of this process."""
+    global _shared
+    if _shared is None:
+        _shared = TsharkPool()
+    return _shared
@@ -0,0 +1,250 @@
+import json
+import subprocess
+import tempfile
+from collections import OrderedDict
+
+from pyshark.tshark.tshark import get_process_path
+
+from ingest.pcap import capture_header, capture_records, open_capture, temporary_capture
+from packet import FieldTable, sanitize_field_name
+
+# fields holding the columns of the summary line, in the order of the profile
+SUMMARY_COLUMNS = ['_ws.col.No.', '_ws.col.Time', '_ws.col.Source', '_ws.col.Destination', '_ws.col.Protocol',
+                   '_ws.col.Length', '_ws.col.Info']
+
+# names of the summary columns in the ek output, older tshark versions name them by their lowercase title
+EK_SUMMARY_PREFIXES = ('_ws.col.', '_ws_col_')
+EK_SUMMARY_TITLES = ('no.', 'time', 'source', 'destination', 'protocol', 'length', 'info')
+
+DETAIL_CACHE_SIZE = 256  # fully dissected frames kept by a FrameDissector
+
+# frames of the first user link type are dissected as plain NAS-EPS messages when re-dissecting deciphered messages
+NAS_LINKTYPE = 147
+NAS_DISSECTOR_OPTION = 'uat:user_dlts:"User 0 (DLT=147)","nas-eps_plain","0","","0",""'
+
+# newer tshark versions print booleans as words in the fields output, PDML shows them as numbers
+FIELDS_OUTPUT_VALUES = {'True': '1', 'False': '0'}
+
+
+class TsharkException(Exception):
+    def __init__(self, status, errors):
+        self.message = f'tshark exited with status {status}: {errors or "no error output"}'
+        super().__init__(self.message)
+
+
+def tshark_command(path, options):
+    """Builds a tshark command which outputs the fields and summary line of every frame in one run.
+
+    The Elasticsearch (ek) output format is the only tshark output format which can combine the packet
+    summary (-P) with the packet details (-V).
+    """
+    command = [get_process_path(), '-l', '-n', '-r', path, '-T', 'ek', '-P', '-V']
+    for (option, value) in options.items():
+        command += [option, value]
+    return command
+
+
+def projection_command(path, options, fields):
+    """Builds a tshark command which only extracts the given fields and the summary columns of every frame.
+
+    The summary columns come last, so tabs in the Info column can not shift the other fields.
+    """
+    command = [get_process_path(), '-l', '-n', '-r', path, '-T', 'fields',
+               '-E', 'separator=/t', '-E', 'occurrence=f', '-E', 'quote=n']
+    for field in fields + SUMMARY_COLUMNS:
+        command += ['-e', field]
+    for (option, value) in options.items():
+        command += [option, value]
+    return command
+
+
+def run(command):
+    """Yields the output of a tshark command line by line, stopping tshark if the output is not read to the end.
+
+    Raises TsharkException with the error output of tshark if it fails, e.g. because of a bad profile or a
+    truncated capture, so a failed run can not be mistaken for a capture without packets.
+    """
+    with tempfile.TemporaryFile() as errors:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=errors)
+        complete = False
+        try:
+            yield from process.stdout
+            complete = True
+        finally:
+            if not complete and process.poll() is None:
+                process.kill()
+            process.stdout.close()
+            process.wait()
+        check_status(process, errors)
+
+
+def check_status(process, errors):
+    """Raises TsharkException if a tshark process which was read to the end failed."""
+    if process.returncode:
+        errors.seek(0)
+        raise TsharkException(process.returncode, errors.read().decode(errors='replace').strip())
+
+
+def output(command, path, pool=None, source=None):
+    """Runs a tshark command built for path, in a warm process of the pool if one is given.
+
+    A pooled process reads the capture from stdin, which is fed from the file at path or the given bytes.
+    """
+    if pool is None:
+        return run(command)
+    command = list(command)
+    command[command.index('-r') + 1] = '-'
+    return pool.run(command, path if source is None else source)
+
+
+def dissect(path, options, fields=None, pool=None):
+    """Runs tshark once over a .pcap file and yields a (fields, summary) tuple for every frame.
+
+    If a list of fields is given, only those fields are extracted instead of the full dissection.
+    The raw frame bytes are not dissected, they are read from the file itself (see ingest.pcap.with_frames).
+    """
+    if fields:
+        yield from project(path, options, fields, pool)
+        return
+    yield from parse_output(output(tshark_command(path, options), path, pool))
+
+
+def parse_output(lines):
+    for line in lines:
+        document = json.loads(line)
+        if 'layers' not in document:
+            continue  # skip the index lines tshark adds for Elasticsearch
+        yield parse_document(document)
+
+
+def dissect_frame(path, options, number, pool=None, source=None):
+    """Fully dissects a single frame of a .pcap file, returning its field table."""
+    options = dict(options)
+    options.pop('-c', None)
+    options['-Y'] = f'frame.number == {number}'
+    for (fields, _) in parse_output(output(tshark_command(path, options), path, pool, source)):
+        return fields
+    return FieldTable({})
+
+
+class FrameDissector:
+    def __init__(self, path, options, cache_size=DETAIL_CACHE_SIZE, pool=None):
+        """Fully dissects single frames of a .pcap file on demand, keeping the most recently used ones.
+
+        A frame is copied to a file of its own by seeking to its record in the capture file, so tshark only has
+        to dissect that frame. State which tshark keeps between frames (e.g. RLC reassembly) is not available
+        this way. Captures whose records can not be copied are dissected up to the requested frame instead.
+        With a pool, the frame is passed to a warm tshark process instead of being written to a file.
+        """
+        self.path = path
+        self.pool = pool
+        self.options = dict(options)
+        self.options.pop('-c', None)
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.frames = open_capture(path)
+        if self.frames is not None and self.frames.header is None:
+            self.frames = None
+
+    def __call__(self, number):
+        if number in self.cache:
+            self.cache.move_to_end(number)
+            return self.cache[number]
+        if self.frames and self.pool:
+            record = self.frames.header + self.frames.record(number)
+            fields = dissect_frame(self.path, self.options, 1, self.pool, record)
+        elif self.frames:
+            with temporary_capture(self.frames.header, self.frames.record(number)) as frame_path:
+                fields = dissect_frame(frame_path, self.options, 1)
+        else:
+            fields = dissect_frame(self.path, self.options, number, self.pool)
+        self.cache[number] = fields
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return fields
+
+
+def project(path, options, fields, pool=None):
+    """Extracts only the given fields of every frame."""
+    for (table, values) in project_values(path, options, fields, pool):
+        yield table, ' '.join(values[len(fields):])
+
+
+def project_values(path, options, fields, pool=None):
+    """Extracts the given fields of every frame, yielding a field table and the values of the summary columns."""
+    names = [sanitize_field_name(field) for field in fields]
+    for line in output(projection_command(path, options, fields), path, pool):
+        values = line.decode(errors='replace').rstrip('\n').split('\t', len(fields) + len(SUMMARY_COLUMNS) - 1)
+        table = {name: FIELDS_OUTPUT_VALUES.get(value, value)
+                 for (name, value) in zip(names, values) if value}
+        yield FieldTable(table), values
+
+
+def dissect_nas(messages, fields):
+    """Dissects plain NAS-EPS messages, e.g. deciphered ones, in a single tshark run.
+
+    The messages are written to a temporary capture as frames of a user link type, which tshark is told to
+    dissect as NAS-EPS. Returns the field table and the Info column of every message.
+    """
+    if not messages:
+        return []
+    options = {'-o': NAS_DISSECTOR_OPTION}
+    with temporary_capture(capture_header(NAS_LINKTYPE), capture_records(messages)) as path:
+        return [(table, values[-1] if len(values) > len(fields) else '')
+                for (table, values) in project_values(path, options, fields)]
+
+
+def parse_document(document):
+    """Flattens a single tshark ek document into a field table and a summary line."""
+    fields = {}
+    columns = []
+    for (name, value) in document['layers'].items():
+        if isinstance(value, dict):
+            if name != 'frame':
+                flatten_layer(name, value, fields)
+        elif isinstance(value, list):
+            # a layer which occurs more than once in a frame, e.g. two RLC PDUs, is a list of layers
+            for layer in value:
+                if isinstance(layer, dict):
+                    flatten_layer(name, layer, fields)
+        elif isinstance(value, str) and summary_column(name):
+            columns.append(value)  # summary columns, in the order of the profile (No., Time, ..., Info)
+    return FieldTable(fields), ' '.join(columns)
+
+
+def summary_column(name):
+    return name.startswith(EK_SUMMARY_PREFIXES) or name in EK_SUMMARY_TITLES
+
+
+def flatten_layer(layer_name, layer, fields):
+    """Adds the fields of an ek layer to the field table, stripping the layer prefix tshark adds to every name."""
+    prefix = layer_name + '_'
+    for (key, value) in layer.items():
+        if key.endswith('_raw'):
+            continue
+        if key.startswith(prefix):
+            key = key[len(prefix):]
+        name = sanitize_field_name(key)
+        if name not in fields:  # like pyshark, the first occurrence of a field is its value
+            fields[name] = field_value(value)
+
+
+def first_value(value):
+    """Returns the first occurrence of a field which tshark reports more than once."""
+    if isinstance(value, list):
+        return value[0] if value else ''
+    return value
+
+
+def field_value(value):
+    """Converts an ek value to the string representation used in the fields output (e.g. '1' instead of true).
+
+    Fields without a value of their own (FT_NONE), such as the elements of RRC messages, are empty in the ek
+    output, the fields output shows them as 1.
+    """
+    value = first_value(value)
+    if value == '':
+        return '1'
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    return str(value)
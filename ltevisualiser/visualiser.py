@@ -1,20 +1,23 @@
 import tkinter as tk
 from functools import partial
-from ELVis import list_categories
+from analyser.categoriser import category_names
+from analyser.index import CaptureIndex
+
+# fields read by the visualiser, only these are extracted from the packet capture
+FIELDS = ['mac-lte.direction']
+
 
 class Visualiser:
-    def __init__(self, data):
+    def __init__(self, data, full_dissection=None, index=None):
         self.all_data = data
+        self.full_dissection = full_dissection  # dissects all fields of a packet by its id, if not done while loading
+        self.index = index if index is not None else CaptureIndex(data)
         self.data = data
         self.window = tk.Tk()
         self.data_start = 0
         self.selected = tk.StringVar(self.window)
         self.selected.set('All')
-        self.categories = ['All']
-        self.categories += list_categories(data)
-        self.categories.sort()
-        self.categories.remove('All')
-        self.categories.insert(0, 'All')
+        self.categories = ['All'] + self.index.filters()
 
     def visualise(self):
         """Creates the visualisation UI for the packet capture."""
@@ -65,11 +68,7 @@ class Visualiser:
         if self.selected.get() == 'All':
             self.data = self.all_data
         else:
-            self.data = []
-            protocol = self.selected.get()
-            for packet in self.all_data:
-                if protocol in packet.category:
-                    self.data.append(packet)
+            self.data = self.index.filter(self.selected.get())
         self.data_start = 0
         self.update_image()
 
@@ -96,15 +95,18 @@ class Visualiser:
 
         # create text to be shown
         text = tk.Text(window, wrap=tk.NONE, xscrollcommand=horizontal_scroll.set, yscrollcommand=vertical_scroll.set)
-        analysis = ''.join(packet.analysis) if not packet.analysis == [] else 'Packet has no warnings or errors.'
+        analysis = ''.join(packet.analysis) if packet.analysis else 'Packet has no warnings or errors.'
+        data = self.full_dissection(packet.id) if self.full_dissection else packet.data
+        position = self.index.position(packet.id)
         lines = f"""-------------SHORT DESCRIPTION--------------
 Summary: {packet.full_summary}
-Categories: {packet.category}
+Position: {position + 1} of {len(self.all_data)}
+Categories: {category_names(packet.category)}
 Error score: {packet.eval}
 ------------------ANALYSIS------------------
 {analysis.rstrip()}
 --------------FULL PACKET DATA--------------
-{packet.data}""".split('\n')
+{data}""".split('\n')
         for line in lines:
             text.insert(tk.END, line + '\n')
         text.pack(fill=tk.BOTH)
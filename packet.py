@@ -1,20 +1,99 @@
-from analyser.categoriser import categorise
+import sys
+from functools import lru_cache
+
+from analyser.categoriser import categorise, ANALYSED, UNASSIGNED
+from analyser.findings import FindingStore
+
+
+@lru_cache(maxsize=None)
+def sanitize_field_name(name):
+    """Normalises a field name the way pyshark does, so 'mac-lte.rnti' and 'mac_lte_rnti' refer to the same field."""
+    return sys.intern(name.replace('.', '_').replace('-', '_').lower())
+
+
+class FieldSchema:
+    __slots__ = ('names', 'index')
+
+    def __init__(self, names):
+        """Field names of a packet, shared between all packets which contain exactly the same fields."""
+        self.names = names
+        self.index = {name: i for (i, name) in enumerate(names)}
+
+
+_schemas = {}
+
+
+def get_schema(names):
+    schema = _schemas.get(names)
+    if schema is None:
+        schema = _schemas[names] = FieldSchema(tuple(sys.intern(name) for name in names))
+    return schema
+
+
+class FieldTable:
+    __slots__ = ('_schema', '_values')
+
+    def __init__(self, fields):
+        """Flattened dissection of the RRC/MAC/NAS/RLC layers of a packet, queried like a pyshark layer.
+
+        Only the field values are stored per packet, the field names live in a schema shared by every
+        packet with the same fields. Short values (flags, message types, channel ids) are interned as well.
+        """
+        self._schema = get_schema(tuple(fields))
+        self._values = tuple(sys.intern(value) if len(value) <= 16 else value for value in fields.values())
+
+    def __reduce__(self):
+        # rebuilt from a plain dictionary, so unpickled tables (e.g. from a worker process) share schemas again
+        return FieldTable, (dict(self.items()),)
+
+    def __str__(self):
+        return '\n'.join(f'\t{name}: {value}' for (name, value) in self.items())
+
+    def get(self, name, default=None):
+        i = self._schema.index.get(sanitize_field_name(name))
+        return default if i is None else self._values[i]
+
+    def items(self):
+        return zip(self._schema.names, self._values)
+
+    @staticmethod
+    def column(tables, name):
+        """Reads a field of many tables at once, its position is looked up once for every schema."""
+        name = sanitize_field_name(name)
+        positions = {}
+        values = []
+        for table in tables:
+            schema = table._schema
+            i = positions.get(schema, -1)
+            if i == -1:
+                i = positions[schema] = schema.index.get(name)
+            values.append(None if i is None else table._values[i])
+        return values
 
 
 class Packet:
-    def __init__(self, *args):  # data = 0, summary = 1, raw = 2, analysis = 3
-        if len(args) == 4:
-            self.data = args[0].layers[2]  # for the purpose of this thesis, only care about RRC/MAC/NAS/RLC packets
+    __slots__ = ('data', 'full_summary', 'id', 'eval', 'raw', 'category', 'findings', '_summary')
+
+    def __init__(self, *args):  # data = 0, summary = 1, raw = 2, analysis = 3, findings = 4
+        if len(args) in (4, 5):
+            self.data = args[0]  # for the purpose of this thesis, only care about RRC/MAC/NAS/RLC packets
             self.full_summary = args[1]
-            self.summary, self.id = self.process_summary(args[1])
+            self.id = int(args[1].split(' ', 1)[0])
+            self._summary = None  # shortened summary is only made when it is shown or analysed
             self.eval = args[3]
-            self.raw = bytes(args[2].get_raw_packet())
-            self.category = categorise(self)
-            self.analysis = []
+            self.raw = args[2]  # a memoryview of the capture file, see ingest.pcap.CaptureFile
+            self.category = categorise(self)  # category mask, see analyser.categoriser
+            self.findings = args[4] if len(args) == 5 else None  # store shared by the capture, see analyser.findings
 
     def __str__(self):
         return self.full_summary
 
+    @property
+    def summary(self):
+        if self._summary is None:
+            self._summary = self.process_summary(self.full_summary)[0]
+        return self._summary
+
     def process_summary(self, summary):
         """Processes summary to not be longer than 63 characters to fit in the graph."""
         split = summary.split(' ')
@@ -32,34 +111,30 @@ class Packet:
         sentence = ' '.join(sentence)
         return sentence, id
 
-    def add_analysis(self, sentence, severity=1, custom_preamble=None):
-        self.eval += severity
-        if custom_preamble:
-            if custom_preamble.isspace():
-                self.analysis.append(f'{custom_preamble} {sentence}\n')
-            else:
-                self.analysis.append(f'{custom_preamble}: {sentence}\n')
-        elif severity == 0:
-            self.analysis.append(f'Note: {sentence}\n')
-        elif severity == 1:
-            self.analysis.append(f'Warning: {sentence}\n')
-        elif severity == 2:
-            self.analysis.append(f'WARNING: {sentence}\n')
-        elif severity == 3:
-            self.analysis.append(f'Error: {sentence}\n')
-        elif severity == 4:
-            self.analysis.append(f'ERROR: {sentence}\n')
+    @property
+    def analysis(self):
+        """Analysis results of the packet, formatted as lines of text."""
+        return self.findings.lines(self.id) if self.findings is not None else []
+
+    def add_analysis(self, rule, *arguments):
+        """Adds a finding of a rule (see analyser.findings), its message is formatted with arguments when shown."""
+        self.eval += rule.severity
+        if self.findings is None:
+            self.findings = FindingStore()
+        self.findings.add(self.id, rule, arguments)
 
+    def has_findings(self):
+        return self.findings is not None and bool(self.findings.findings(self.id))
 
     def get_colour(self, max=0):
         """Assigns a color to the packet whenever it is required."""
         colour = (0, 0, 0)  # rgb
-        if 'Unassigned' not in self.category:
+        if not self.category & UNASSIGNED:
             colour = (0, 0, 128)
-        if 'Analysed' in self.category:
-            if self.eval == 0 and len(self.analysis) == 0:  # packet has no warnings or errors
+        if self.category & ANALYSED:
+            if self.eval == 0 and not self.has_findings():  # packet has no warnings or errors
                 colour = (0, 200, 0)
-            elif self.eval == 0 and not len(self.analysis) == 0:  # packet only has notes but no warnings or errors
+            elif self.eval == 0 and self.has_findings():  # packet only has notes but no warnings or errors
                 colour = (0, 100, 0)
             elif max == 0:  # packet has errors, but no colour gradient will be applied
                 colour = (255, 175, 0)
@@ -0,0 +1,124 @@
+import atexit
+import inspect
+import json
+import platform
+import sys
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+try:
+    import resource
+except ImportError:  # not available on Windows, peak memory is then not measured
+    resource = None
+
+PROFILE_VERSION = 1  # version of the layout of the profile, so profiles of different releases can be compared
+
+
+def peak_memory():
+    """Returns the peak resident memory of the process in bytes, or None if it can not be measured."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024  # bytes on macOS, kilobytes elsewhere
+
+
+def measurement():
+    return {'calls': 0, 'packets': 0, 'wall': 0.0, 'cpu': 0.0}
+
+
+class Profiler:
+    def __init__(self, path=None):
+        """Records the time spent in every stage of the program and in every analysis rule.
+
+        Stages record wall time, CPU time, the number of packets and the peak memory of the process at the end of
+        the stage. Rules are the functions of the analysis modules, their times include the rules they call. The
+        profile is written to path as .json when the program exits. Without a path, nothing is recorded.
+        """
+        self.path = path
+        self.enabled = path is not None
+        self.started = time.time()
+        self.stages = {}
+        self.rules = {}
+        if self.enabled:
+            atexit.register(self.write)
+
+    @contextmanager
+    def stage(self, name, packets=0):
+        """Measures a stage of the program, the number of packets can be set in the yielded measurement."""
+        stage = self.stages.setdefault(name, measurement())
+        stage['packets'] += packets
+        if not self.enabled:
+            yield stage
+            return
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield stage
+        finally:
+            stage['calls'] += 1
+            stage['wall'] += time.perf_counter() - wall
+            stage['cpu'] += time.process_time() - cpu
+            stage['peak_memory'] = peak_memory()
+
+    def count(self, packets, stage):
+        """Passes packets on, counting them in the measurement of a stage."""
+        for packet in packets:
+            stage['packets'] += 1
+            yield packet
+
+    def wrap(self, function):
+        """Wraps a rule, so every call is measured."""
+        name = f'{function.__module__.split(".")[-1]}.{function.__qualname__}'
+        rule = self.rules.setdefault(name, measurement())
+        perf_counter = time.perf_counter
+        process_time = time.process_time
+
+        @wraps(function)
+        def measured(*args, **kwargs):
+            wall = perf_counter()
+            cpu = process_time()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                rule['calls'] += 1
+                rule['wall'] += perf_counter() - wall
+                rule['cpu'] += process_time() - cpu
+
+        return measured
+
+    def instrument(self, owner, names=None, exclude=()):
+        """Replaces the functions of a module or class by measured ones.
+
+        Only functions defined in the module itself are replaced, or the given names. Callers look functions up
+        in the module when they are called, so calls between rules of a module are measured as well.
+        """
+        if not self.enabled:
+            return
+        if names is None:
+            names = [name for (name, function) in vars(owner).items()
+                     if inspect.isfunction(function) and function.__module__ == owner.__name__]
+        for name in names:
+            if name not in exclude:
+                setattr(owner, name, self.wrap(getattr(owner, name)))
+
+    def report(self):
+        return {'version': PROFILE_VERSION,
+                'started': self.started,
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'peak_memory': peak_memory(),
+                'stages': {name: with_throughput(stage) for (name, stage) in self.stages.items()},
+                'rules': {name: with_throughput(rule) for (name, rule) in
+                          sorted(self.rules.items(), key=lambda item: -item[1]['wall']) if rule['calls']}}
+
+    def write(self):
+        with open(self.path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+        print(f'Profile written to {self.path}.')
+
+
+def with_throughput(stage):
+    """Adds the number of packets (or calls, if no packets were counted) per second of wall time."""
+    count = stage['packets'] or stage['calls']
+    return dict(stage, throughput=count / stage['wall'] if stage['wall'] else None)
@@ -0,0 +1,85 @@
+"""Synthetic captures of UEs attaching, with the fields the analysis modules read."""
+from analyser.categoriser import categorise
+from packet import FieldTable, Packet, sanitize_field_name
+
+CAPABILITIES = {'nas_eps.emm.eea0': '1', 'nas_eps.emm.128eea1': '1', 'nas_eps.emm.128eea2': '1',
+                'nas_eps.emm.eea3': '0', 'nas_eps.emm.eia0': '1', 'nas_eps.emm.128eia1': '1',
+                'nas_eps.emm.128eia2': '1', 'nas_eps.emm.eia3': '0'}
+PDCP_SECURITY = {'pdcp-lte.security-config.ciphering': '0', 'pdcp-lte.security-config.integrity': '2'}
+SIM_INFO = {'auth': 'mil', 'imsi': '001010000000001', 'key': bytes.fromhex('bdfdfd2be954a1aa29765db6daeef5e7'),
+            'opc': bytes.fromhex('358422278845a5632bbfb7b354db103a'), 'amf': bytes.fromhex('8000'),
+            'sqn': '000000001ab8', 'qci': '7', 'ip_alloc': 'dynamic'}
+
+# summary, direction and fields of every message of an attach
+ATTACH = [
+    ('RRCConnectionRequest', '0', {'rlc-lte.channel-id': '0'}),
+    ('RRCConnectionSetup', '1', {}),
+    ('RRCConnectionSetupComplete, Attach request, PDN connectivity request', '0',
+     dict(CAPABILITIES, **{'nas_eps.nas_msg_emm_type': '65', 'nas_eps.emm.m_tmsi': '1234'})),
+    ('DLInformationTransfer, Identity request', '1', {'nas_eps.nas_msg_emm_type': '85', 'nas_eps.emm.id_type2': '1'}),
+    ('ULInformationTransfer, Identity response', '0',
+     {'nas_eps.nas_msg_emm_type': '86', 'gsm_a.ie.mobileid_type': '1', 'e212.imsi': '001010000000001'}),
+    ('DLInformationTransfer, Authentication request', '1',
+     {'nas_eps.nas_msg_emm_type': '82', 'gsm_a.dtap.rand': '11:22:33:44:55:66:77:88:99:00:11:22:33:44:55:66',
+      'gsm_a.dtap.autn': '11:22:33:44:55:66:77:88:99:00:11:22:33:44:55:66'}),
+    ('ULInformationTransfer, Authentication response', '0',
+     {'nas_eps.nas_msg_emm_type': '83', 'nas_eps.emm.res': '01:02:03:04:05:06:07:08'}),
+    ('DLInformationTransfer, Security mode command', '1',
+     dict(CAPABILITIES, **{'nas_eps.nas_msg_emm_type': '93', 'nas_eps.emm.toc': '0', 'nas_eps.emm.toi': '2'})),
+    ('ULInformationTransfer, Security mode complete', '0', {'nas_eps.nas_msg_emm_type': '94'}),
+    ('SecurityModeCommand', '1', {'lte-rrc.securityModeCommand_element': '1',
+                                  'lte-rrc.cipheringAlgorithm': '0', 'lte-rrc.integrityProtAlgorithm': '2'}),
+    ('SecurityModeComplete', '0', dict(PDCP_SECURITY, **{'lte-rrc.securityModeComplete_element': '1'})),
+    ('UECapabilityEnquiry', '1', PDCP_SECURITY),
+    ('UECapabilityInformation', '0', dict(PDCP_SECURITY, **{'pdcp-lte.security-config.integrity': '1'})),
+    ('RRCConnectionReconfiguration, Attach accept, Activate default EPS bearer context request', '1',
+     dict(PDCP_SECURITY, **{'nas_eps.nas_msg_emm_type': '66', 'lte-rrc.SRB_ToAddMod_element': 'x'})),
+    ('RRCConnectionReconfigurationComplete', '0', dict(PDCP_SECURITY, **{'rlc-lte.channel-id': '2'})),
+    ('ULInformationTransfer, Attach complete', '0',
+     dict(PDCP_SECURITY, **{'nas_eps.nas_msg_emm_type': '67', 'rlc-lte.channel-id': '2'})),
+]
+
+
+def packet(number, summary, direction, fields):
+    data = {'mac-lte.direction': direction, 'rlc-lte.mode': '4', 'rlc-lte.channel-type': '4',
+            'rlc-lte.channel-id': '1'}
+    data.update(fields)
+    protocol = 'MAC-LTE' if summary.startswith('MAC-LTE') else 'LTE RRC'
+    result = Packet(FieldTable({sanitize_field_name(name): value for (name, value) in data.items()}),
+                    f'{number} 0.{number:06d}   {protocol} 60 {summary}', b'', 0)
+    result.category = categorise(result)
+    return result
+
+
+def attach(ues=1, padding=2):
+    """Returns a capture of UEs attaching at the same time, every UE with its own RNTI and identities."""
+    messages = list(ATTACH[:7])
+    messages += [('MAC-LTE Padding', '0', {'rlc-lte.mode': '1'})] * padding
+    messages += ATTACH[7:] + [('MAC-LTE Padding', '1', {'rlc-lte.mode': '1'})] * padding
+    packets = []
+    for (i, (summary, direction, fields)) in enumerate(messages):
+        for ue in range(ues):
+            fields = dict(fields, **{'mac-lte.rnti': str(70 + ue)})
+            if 'e212.imsi' in fields:
+                fields['e212.imsi'] = f'00101000000000{ue + 1}'
+            if 'nas_eps.emm.m_tmsi' in fields:
+                fields['nas_eps.emm.m_tmsi'] = f'99{ue}'
+            packets.append(packet(len(packets) + 1, summary, direction, fields))
+    return packets
+
+
+def results(packets):
+    """Lists the evaluation, categories and findings of every packet."""
+    return [(packet.id, packet.eval, packet.category, [str(line) for line in packet.analysis]) for packet in packets]
+
+
+def rule_ids(packet):
+    """Lists the rule ids of the findings of a packet."""
+    if packet.findings is None:
+        return []
+    return [packet.findings.rule(finding).id for finding in packet.findings.findings(packet.id)]
+
+
+def find(packets, summary):
+    """Returns the first packet whose summary contains the text."""
+    return next(p for p in packets if summary in p.full_summary)
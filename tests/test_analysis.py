@@ -0,0 +1,11 @@
+from analyser.analysis import Analyser
+
+
+def test_integrity_registered_for_security_mode_command():
+    analyser = Analyser([], ['Security Mode Command', 'Attach Procedure'], {})
+    assert 'integrity' in analyser.ue_info
+
+
+def test_integrity_not_registered_without_security_context():
+    analyser = Analyser([], ['RRC Connection Establishment', 'Information Transfer'], {})
+    assert 'integrity' not in analyser.ue_info
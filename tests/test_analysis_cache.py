@@ -0,0 +1,111 @@
+import os
+
+import pytest
+
+from analyser import MissingUserEquipmentInfoException, analysis, cache
+from captures import SIM_INFO, attach, results
+from ingest import cache as ingest_cache
+
+
+@pytest.fixture(autouse=True)
+def cache_directory(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, 'CACHE_DIRECTORY', str(tmp_path))
+    monkeypatch.setattr(ingest_cache, 'CACHE_DIRECTORY', str(tmp_path))
+    return tmp_path
+
+
+@pytest.fixture
+def recorded(monkeypatch):
+    """Lists the modules every run of the analysis modules runs."""
+    runs = []
+    record = cache.record
+
+    def recording(packets, ue_info, modules, jobs):
+        runs.append(modules)
+        return record(packets, ue_info, modules, jobs)
+
+    monkeypatch.setattr(cache, 'record', recording)
+    return runs
+
+
+def expected(ue_info):
+    packets = attach(3)
+    sessions = analysis.analyse_sessions(packets, dict(ue_info))
+    return results(packets), [session.error for session in sessions]
+
+
+def cached(ue_info, jobs=1):
+    packets = attach(3)
+    sessions = cache.analyse(packets, dict(ue_info), 'capture', jobs)
+    return results(packets), [session.error for session in sessions]
+
+
+@pytest.mark.parametrize('ue_info', [{'sim_info': SIM_INFO}, {}])
+def test_round_trip(ue_info, recorded):
+    assert cached(ue_info) == expected(ue_info)
+    assert cached(ue_info) == expected(ue_info)
+    assert recorded == [cache.module_names()]
+
+
+def test_round_trip_jobs(recorded):
+    assert cached({'sim_info': SIM_INFO}, jobs=2) == expected({'sim_info': SIM_INFO})
+    assert cached({'sim_info': SIM_INFO}, jobs=2) == expected({'sim_info': SIM_INFO})
+    assert len(recorded) == 1
+
+
+def test_sim_info_is_part_of_key(recorded):
+    cached({'sim_info': SIM_INFO})
+    assert cached({'sim_info': dict(SIM_INFO, opc=bytes(16))}) == expected({'sim_info': dict(SIM_INFO, opc=bytes(16))})
+    assert len(recorded) == 2
+
+
+def test_missing_entry_runs_module_and_dependencies(recorded):
+    cached({'sim_info': SIM_INFO})
+    key = cache.entry_key('capture', cache.sim_digest({'sim_info': SIM_INFO}), 'attach')
+    os.remove(cache.cache_path(key))
+    assert cached({'sim_info': SIM_INFO}) == expected({'sim_info': SIM_INFO})
+    assert recorded[1] == ['smc', 'attach']
+
+
+def test_changed_source_runs_dependents(recorded, monkeypatch):
+    cached({'sim_info': SIM_INFO})
+    source_digest = cache.source_digest
+    monkeypatch.setattr(cache, 'source_digest',
+                        lambda module: b'changed' + source_digest(module) if module.__name__ == 'analyser.smc'
+                        else source_digest(module))
+    assert cached({'sim_info': SIM_INFO}) == expected({'sim_info': SIM_INFO})
+    assert recorded[1] == ['smc', 'attach']
+
+
+def test_changed_subscribers_source_runs_analysis(recorded, monkeypatch):
+    cached({'sim_info': SIM_INFO})
+    source_digest = cache.source_digest
+    monkeypatch.setattr(cache, 'source_digest',
+                        lambda module: b'changed' + source_digest(module) if module.__name__ == 'analyser.subscribers'
+                        else source_digest(module))
+    key = cache.entry_key('capture', cache.sim_digest({'sim_info': SIM_INFO}), 'analysis')
+    assert not os.path.exists(cache.cache_path(key))
+    assert cached({'sim_info': SIM_INFO}) == expected({'sim_info': SIM_INFO})
+    assert len(recorded) == 2
+
+
+def test_missing_ue_info_keeps_errors_of_every_session(recorded):
+    packets = [packet for packet in attach(3) if packet.data.get('nas_eps_nas_msg_emm_type') != '65']
+    for _ in range(2):
+        with pytest.raises(MissingUserEquipmentInfoException) as e:
+            cache.analyse(list(packets), {}, 'capture')
+        assert [session.error for session in e.value.sessions] == [e.value.message] * 3
+    assert len(recorded) == 1
+
+
+def test_evicted_while_loading(monkeypatch):
+    cache.store('key', {'findings': [], 'marks': []})
+    utime = os.utime
+
+    def evicted(path):
+        os.remove(path)
+        utime(path)
+
+    monkeypatch.setattr(os, 'utime', evicted)
+    assert cache.load('key') == {'findings': [], 'marks': []}
+    assert cache.load('key') is None
@@ -0,0 +1,32 @@
+import pytest
+
+import CryptoMobile.CM as CM
+
+# TS 33.401 annex C, test set 1 of 128-EEA2 and 128-EIA2
+EEA2_KEY = bytes.fromhex('d3c5d592327fb11c4035c6680af8c6d1')
+EEA2_PLAINTEXT = bytes.fromhex('981ba6824c1bfb1ab485472029b71d808ce33e2cc3c0b5fc1f3de8a6dc66b1f0')
+EEA2_CIPHERTEXT = bytes.fromhex('e9fed8a63d155304d71df20bf3e82214b20ed7dad2f233dc3c22d7bdeeed8e78')
+EIA2_KEY = bytes.fromhex('2bd6459f82c5b300952c49104881ff48')
+
+
+def test_aes_algorithms_without_extensions():
+    # the AES based algorithms do not need the KASUMI, SNOW 3G and ZUC extensions
+    assert {'EEA2', 'EIA2'} <= set(CM.__all__)
+
+
+def test_eea2_test_set_1():
+    assert CM.EEA2(EEA2_KEY, 0x398a59b4, 0x15, 1, EEA2_PLAINTEXT, 253) == EEA2_CIPHERTEXT
+
+
+def test_eia2_test_set_1():
+    assert CM.EIA2(EIA2_KEY, 0x38a6f056, 0x18, 0, bytes.fromhex('3332346263393840'), 58) == bytes.fromhex('118c6eb8')
+
+
+@pytest.mark.parametrize(('name', 'encrypt'), [('EEA1_keystreams', 'EEA1'), ('EEA3_keystreams', 'EEA3')])
+def test_keystreams_match_encryption(name, encrypt):
+    if not hasattr(CM, name):
+        pytest.skip(f'{encrypt} is not available')
+    params = [(count, count % 32, count % 2, count * 3 + 1) for count in range(20)]
+    keystreams = getattr(CM, name)(EEA2_KEY, params)
+    for ((count, bearer, direction, length), keystream) in zip(params, keystreams):
+        assert keystream == getattr(CM, encrypt)(EEA2_KEY, count, bearer, direction, length * b'\0')
@@ -0,0 +1,63 @@
+import random
+
+import pytest
+
+from analyser import columns
+from analyser.analysis import Analyser
+from analyser.categoriser import category_names
+from captures import SIM_INFO, attach, packet, results
+from packet import sanitize_field_name
+
+# values of the fields the columnar checks read, None leaves the field out
+VARIANTS = {'rlc-lte.mode': ['4', '1', '2', None], 'rlc-lte.channel-type': ['4', '1', None],
+            'rlc-lte.channel-id': ['0', '1', '2', '3', None],
+            'pdcp-lte.security-config.ciphering': ['0', '1', '2', None],
+            'pdcp-lte.security-config.integrity': ['0', '1', '2', None],
+            'pdcp-lte.seq_num': ['0', '1', '2', None], 'pdcp-lte.signalling-data': ['010203', '0a0b0c0d', None],
+            'pdcp-lte.mac': ['0x00000000', '0x12345678', None]}
+EXTRA = ['MAC-LTE Padding', 'ULInformationTransfer, Ciphered message', 'UECapabilityInformation',
+         'RRCConnectionReconfiguration']
+
+
+def variant(seed):
+    """Returns an attach capture with changed bearers, RLC modes and PDCP options, and extra or missing packets."""
+    generator = random.Random(seed)
+    packets = []
+    for original in attach():
+        for _ in range(generator.randint(0, 1)):
+            fields = {name: generator.choice(values) for (name, values) in VARIANTS.items()}
+            packets.append(packet(len(packets) + 1, generator.choice(EXTRA), generator.choice('01'),
+                                  {name: value for (name, value) in fields.items() if value is not None}))
+        if generator.random() < 0.05:
+            continue
+        fields = dict(original.data.items())
+        if generator.random() < 0.5:
+            name = generator.choice(list(VARIANTS))
+            fields[sanitize_field_name(name)] = generator.choice(VARIANTS[name])
+        summary = original.full_summary.split(None, 4)[-1]
+        packets.append(packet(len(packets) + 1, summary, fields.pop('mac_lte_direction'),
+                              {name: value for (name, value) in fields.items() if value is not None}))
+    return packets
+
+
+def analyse(packets, ue_info):
+    """Returns the results of every packet, and the type of the exception which stopped the analysis, if any."""
+    mask = 0
+    for p in packets:
+        mask |= p.category
+    try:
+        Analyser(packets, category_names(mask), dict(ue_info)).analyse()
+    except Exception as e:
+        return results(packets), type(e)
+    return results(packets), None
+
+
+@pytest.mark.skipif(not columns.available(), reason='NumPy is not available')
+@pytest.mark.parametrize('seed', range(40))
+def test_columns_match_packets(seed, monkeypatch):
+    ue_info = {'sim_info': SIM_INFO} if seed % 2 else {}
+    expected = analyse(variant(seed), ue_info)
+    with monkeypatch.context() as patch:
+        patch.setattr(columns, 'np', None)
+        assert not columns.available()
+        assert analyse(variant(seed), ue_info) == expected
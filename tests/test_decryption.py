@@ -0,0 +1,61 @@
+from analyser import decryption
+from analyser.decryption import (CIPHERING_FIELD, INTEGRITY_FIELD, MCC_FIELD, MNC_FIELD, NAS_BEARER, NAS_PDU_FIELD,
+                                 SecurityContext, plmn_identity, security_context, serving_networks)
+from CryptoMobile.conv import conv_401_A2
+
+SIM_INFO = {'auth': 'mil', 'imsi': '310010123456789', 'key': bytes.fromhex('465b5ce8b199b49faa5f0a2ee238a6bc'),
+            'opc': bytes.fromhex('cd63cb71954a9f4e48a5994e37a02baf'), 'amf': bytes.fromhex('b9b9')}
+RAND = bytes.fromhex('23553cbe9637a89d218ae64dae47bf35')
+AUTN = bytes.fromhex('55f328b43577b9b94a9ffac354dfafb3')  # SQN ff9bb4d0b607 concealed by AK, AMF b9b9, MAC-A
+CK = bytes.fromhex('b40ba9a3c58b2a05bbf0d987b21bf8cb')
+IK = bytes.fromhex('f769bcd751044604127672711c6d3441')
+
+
+def test_eea2_test_set_1():
+    # TS 33.401 annex C.1, 128-EEA2 test set 1, 253 bits
+    key = bytes.fromhex('d3c5d592327fb11c4035c6680af8c6d1')
+    plaintext = bytes.fromhex('981ba6824c1bfb1ab485472029b71d808ce33e2cc3c0b5fc1f3de8a6dc66b1f0')
+    ciphertext = bytes.fromhex('e9fed8a63d155304d71df20bf3e82214b20ed7dad2f233dc3c22d7bdeeed8e78')
+    result = decryption.eea2(key, 0x398a59b4, 0x15, 1, plaintext)
+    assert result[:31] == ciphertext[:31]
+    assert result[31] & 0xf8 == ciphertext[31] & 0xf8
+
+
+def test_eia2_test_set_1():
+    # TS 33.401 annex C.2, 128-EIA2 test set 1, 58 bits
+    key = bytes.fromhex('2bd6459f82c5b300952c49104881ff48')
+    message = bytes.fromhex('3332346263393840')
+    header = (0x38a6f056).to_bytes(4, 'big') + (0x18 << 27).to_bytes(4, 'big')
+    assert decryption.eia2_context(key).cmac(header + message, 64 + 58) == bytes.fromhex('118c6eb8')
+
+
+def test_eea2_bulk_matches_single_messages():
+    context = SecurityContext(bytes(range(32)), 2, 2)
+    messages = [(None, context, count, count % 2, bytes(range(count + 1))) for count in range(40)]
+    plaintexts = decryption.decipher(messages)
+    for ((_, _, count, direction, message), plaintext) in zip(messages, plaintexts):
+        assert plaintext == decryption.eea2(context.encryption_key, count, NAS_BEARER, direction, message)
+        assert decryption.eea2(context.encryption_key, count, NAS_BEARER, direction, plaintext) == message
+
+
+def test_serving_networks_keep_three_digit_mnc():
+    assert serving_networks({MCC_FIELD: '310', MNC_FIELD: '410'}) == [plmn_identity('310', '410')]
+    assert serving_networks({MCC_FIELD: '1', MNC_FIELD: '10'}) == [plmn_identity('001', '10'),
+                                                                              plmn_identity('001', '010')]
+
+
+def security_mode_command(sn_id):
+    """Fields of a NAS security mode command protected with the context of a serving network."""
+    context = SecurityContext(conv_401_A2(CK, IK, sn_id, AUTN[:6]), 2, 2)
+    message = bytes([0]) + bytes.fromhex('075d220005e0e000')  # sequence number 0, then the command
+    code = decryption.mac(2, context.integrity_key, 0, NAS_BEARER, 1, message)
+    pdu = bytes([0x37]) + code + message
+    return context, {CIPHERING_FIELD: '2', INTEGRITY_FIELD: '2', NAS_PDU_FIELD: pdu.hex(':')}
+
+
+def test_security_context_finds_mnc_length():
+    for mnc in ('10', '010'):
+        (expected, command) = security_mode_command(plmn_identity('310', mnc))
+        candidates = serving_networks({MCC_FIELD: '310', MNC_FIELD: '10'})
+        context = security_context(SIM_INFO, (RAND, AUTN), candidates, command)
+        assert context.kasme == expected.kasme
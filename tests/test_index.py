@@ -0,0 +1,32 @@
+from analyser.categoriser import category_names
+from analyser.index import CaptureIndex
+from captures import attach, packet
+
+
+def test_maps():
+    packets = attach(2)
+    index = CaptureIndex(packets)
+    assert index.emm_messages('65') == [packet for packet in packets if 'Attach request' in packet.full_summary]
+    assert index.rrc_messages('lte-rrc.securityModeCommand_element') == \
+        [packet for packet in packets if packet.full_summary.endswith('SecurityModeCommand')]
+    assert index.rrc_messages('lte-rrc.securityModeFailure_element') == []
+    assert [index.position(packet.id) for packet in packets] == list(range(len(packets)))
+    assert index.position(len(packets) + 1) is None
+
+
+def test_filters():
+    packets = attach(2)
+    index = CaptureIndex(packets)
+    filters = index.filters()
+    assert filters[:len(index.category_names())] == sorted(index.category_names())
+    assert 'NAS: Attach request' in filters
+    assert 'RRC: securityModeCommand' in filters
+    assert index.filter('NAS: Security mode command') == index.emm_messages('93')
+    assert index.filter('RRC: securityModeComplete') == index.rrc_messages('lte-rrc.securityModeComplete_element')
+    for name in index.category_names():
+        assert index.filter(name) == [packet for packet in packets if name in category_names(packet.category)]
+
+
+def test_unknown_message_type():
+    packets = [packet(1, 'ULInformationTransfer', '0', {'nas_eps.nas_msg_emm_type': '255'})]
+    assert CaptureIndex(packets).filters() == ['Attach Procedure', 'Information Transfer', 'NAS: EMM message type 255']
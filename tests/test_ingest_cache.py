@@ -0,0 +1,91 @@
+import os
+
+import pytest
+
+from ingest import cache
+from ingest.tshark import TsharkException
+from packet import FieldTable
+
+
+@pytest.fixture(autouse=True)
+def cache_directory(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, 'CACHE_DIRECTORY', str(tmp_path))
+    return tmp_path
+
+
+def records(count):
+    return [(FieldTable({'nas_eps_nas_msg_emm_type': str(i % 7), 'mac_lte_direction': str(i % 2)}),
+             f'{i} 0.{i:06d}   LTE RRC 60 Packet {i}') for i in range(count)]
+
+
+def rows(records):
+    return [(dict(fields.items()), summary) for (fields, summary) in records]
+
+
+def test_round_trip():
+    expected = records(cache.BLOCK_SIZE + 10)
+    assert cache.load('capture') is None
+    assert rows(cache.store('capture', iter(expected))) == rows(expected)
+    assert rows(cache.load('capture')) == rows(expected)
+
+
+def test_not_read_to_the_end(cache_directory):
+    stored = cache.store('capture', iter(records(10)))
+    next(stored)
+    stored.close()
+    assert cache.load('capture') is None
+    assert os.listdir(cache_directory) == []
+
+
+def test_failed_producer(cache_directory):
+    def failing():
+        yield from records(3)
+        raise TsharkException(2, 'bad profile')
+
+    with pytest.raises(TsharkException):
+        list(cache.store('capture', failing()))
+    assert cache.load('capture') is None
+    assert os.listdir(cache_directory) == []
+
+
+def test_cached_dissects_once(tmp_path):
+    capture = tmp_path / 'capture.pcap'
+    capture.write_bytes(b'\0' * 64)
+    calls = []
+
+    def dissect(path, options, fields):
+        calls.append(path)
+        return iter(records(5))
+
+    for _ in range(2):
+        assert rows(cache.cached(str(capture), {'-C': 'ELVis'}, dissect, ['mac-lte.direction'])) == rows(records(5))
+    assert len(calls) == 1
+
+
+def test_evicted_while_loading(cache_directory):
+    list(cache.store('capture', iter(records(10))))
+    loaded = cache.load('capture')
+    cache.evict(0)
+    assert os.listdir(cache_directory) == []
+    assert rows(loaded) == rows(records(10))
+
+
+@pytest.mark.parametrize('after_stat', [False, True])
+def test_concurrent_evict(cache_directory, monkeypatch, after_stat):
+    """Files removed by another process while evicting, before or after reading their size, are skipped."""
+    for key in ('first', 'second'):
+        list(cache.store(key, iter(records(10))))
+    stat = os.stat
+
+    def evicted(path, **options):
+        if not str(path).endswith(os.path.basename(cache.cache_path('first'))):
+            return stat(path, **options)
+        if not after_stat:
+            os.remove(path)
+        result = stat(path, **options)
+        os.remove(path)
+        return result
+
+    monkeypatch.setattr(os, 'stat', evicted)
+    cache.evict(0)
+    assert os.listdir(cache_directory) == []
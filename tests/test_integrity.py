@@ -0,0 +1,91 @@
+from struct import pack
+
+import pytest
+from Crypto.Cipher import AES
+from Crypto.Hash import CMAC
+
+from analyser import integrity
+from analyser.categoriser import ANALYSED
+from analyser.decryption import SecurityContext
+from captures import packet, rule_ids
+
+KASME = bytes(range(32))
+KENB = bytes(range(32, 64))
+
+
+def eia2(key, count, bearer, direction, message, tamper=False):
+    """128-EIA2 as in TS 33.401 annex B.2, with the CMAC of pycryptodome, optionally with a wrong first bit."""
+    code = CMAC.new(key, pack('>II', count, bearer << 27 | direction << 26) + message, ciphermod=AES).digest()[:4]
+    return bytes([code[0] ^ 0x80]) + code[1:] if tamper else code
+
+
+def eea2(key, count, bearer, direction, data):
+    counter = pack('>II', count, bearer << 27 | direction << 26) + bytes(8)
+    return AES.new(key, AES.MODE_CTR, nonce=b'', initial_value=counter).encrypt(data)
+
+
+def security_contexts():
+    return {'integrity': {'request': None, 'sn_ids': None, 'nas': SecurityContext(KASME, 2, 2), 'uplink': None,
+                          'rrc': integrity.RadioContext(KENB, 2, 2), 'pdcp': {}}}
+
+
+def nas_packet(ue_info, tamper=False):
+    key = ue_info['integrity']['nas'].integrity_key
+    message = bytes([3]) + bytes.fromhex('0743')  # sequence number 3, then the (plain) message
+    pdu = bytes([0x17]) + eia2(key, 3, 0, 0, message, tamper) + message
+    return packet(1, 'ULInformationTransfer, Attach complete', '0',
+                  {'nas_eps.security_header_type': '1', 'lte-rrc.dedicatedInfoNAS': pdu.hex(':')})
+
+
+def pdcp_packet(ue_info, tamper=False, ciphered=False):
+    context = ue_info['integrity']['rrc']
+    data = bytes.fromhex('3a1122')
+    code = eia2(context.integrity_key, 5, 1, 1, bytes([5]) + data, tamper)  # SRB2 is bearer 1
+    fields = {'pdcp-lte.seq_num': '5', 'rlc-lte.channel-id': '2'}
+    if ciphered:
+        fields['pdcp-lte.ciphered-data'] = eea2(context.encryption_key, 5, 1, 1, data + code).hex()
+    else:
+        fields.update({'pdcp-lte.signalling-data': data.hex(), 'pdcp-lte.mac': '0x' + code.hex()})
+    return packet(1, 'DLInformationTransfer', '1', fields)
+
+
+def test_nas_mac():
+    ue_info = security_contexts()
+    nas = nas_packet(ue_info)
+    integrity.verify_nas(nas, None, ue_info)
+    assert rule_ids(nas) == []
+    assert nas.category & ANALYSED
+    assert ue_info['integrity']['uplink'] == 3
+
+
+def test_nas_mac_mismatch():
+    ue_info = security_contexts()
+    nas = nas_packet(ue_info, tamper=True)
+    integrity.verify_nas(nas, None, ue_info)
+    assert rule_ids(nas) == [integrity.NAS_MAC_MISMATCH.id]
+
+
+@pytest.mark.parametrize('ciphered', [False, True])
+def test_pdcp_mac(ciphered):
+    ue_info = security_contexts()
+    pdcp = pdcp_packet(ue_info, ciphered=ciphered)
+    integrity.verify_pdcp(pdcp, None, ue_info)
+    assert rule_ids(pdcp) == []
+    assert pdcp.category & ANALYSED
+
+
+@pytest.mark.parametrize('ciphered', [False, True])
+def test_pdcp_mac_mismatch(ciphered):
+    ue_info = security_contexts()
+    pdcp = pdcp_packet(ue_info, tamper=True, ciphered=ciphered)
+    integrity.verify_pdcp(pdcp, None, ue_info)
+    assert rule_ids(pdcp) == [integrity.PDCP_MAC_MISMATCH.id]
+
+
+def test_nothing_verified_without_security_context():
+    ue_info = security_contexts()
+    (nas, pdcp) = (nas_packet(ue_info, tamper=True), pdcp_packet(ue_info, tamper=True))
+    ue_info['integrity']['nas'] = ue_info['integrity']['rrc'] = None
+    integrity.verify_nas(nas, None, ue_info)
+    integrity.verify_pdcp(pdcp, None, ue_info)
+    assert rule_ids(nas) == rule_ids(pdcp) == []
@@ -0,0 +1,72 @@
+import os
+
+import numpy as np
+
+from CryptoMobile.AES import AES_ECB, AES_ECB_rows
+from CryptoMobile.Milenage import MilenageBatch, MilenageContext
+
+# TS 35.208 section 4.3, test set 1
+K = bytes.fromhex('465b5ce8b199b49faa5f0a2ee238a6bc')
+RAND = bytes.fromhex('23553cbe9637a89d218ae64dae47bf35')
+SQN = bytes.fromhex('ff9bb4d0b607')
+AMF = bytes.fromhex('b9b9')
+OP = bytes.fromhex('cdc202d5123e20f62b6d676ac72cb318')
+OPC = bytes.fromhex('cd63cb71954a9f4e48a5994e37a02baf')
+EXPECTED = tuple(bytes.fromhex(value) for value in (
+    'a54211d5e3ba50bf', 'b40ba9a3c58b2a05bbf0d987b21bf8cb', 'f769bcd751044604127672711c6d3441', 'aa689c648370',
+    '4a9ffac354dfafb3', '01cfaf9ec4e871e9'))  # RES, CK, IK, AK, MAC-A, MAC-S
+
+
+def test_context_test_set_1():
+    assert MilenageContext(K, OPc=OPC).f12345(RAND, SQN, AMF) == EXPECTED
+
+
+def test_context_derives_opc():
+    context = MilenageContext(K, OP=OP)
+    assert context.OPc == OPC
+    assert context.f12345(RAND, SQN, AMF) == EXPECTED
+
+
+def test_context_concealed_sqn():
+    concealed = bytes(a ^ b for (a, b) in zip(SQN, EXPECTED[3]))
+    assert MilenageContext(K, OPc=OPC).f12345(RAND, concealed, AMF, concealed=True) == EXPECTED
+
+
+def rows(outputs, i):
+    return tuple(output[i].tobytes() for output in outputs)
+
+
+def test_batch_test_set_1():
+    assert rows(MilenageBatch(K, OPc=OPC).f12345(RAND, SQN, AMF), 0) == EXPECTED
+    assert rows(MilenageBatch(K, OP=OP).f12345(RAND, SQN, AMF), 0) == EXPECTED
+
+
+def test_batch_matches_contexts():
+    # distinct keys are encrypted by AES_ECB_rows, shared keys once per key
+    for keys in ([os.urandom(16) for _ in range(40)], [K, os.urandom(16)] * 20):
+        opcs = [os.urandom(16) for _ in keys]
+        rands = [os.urandom(16) for _ in keys]
+        sqns = [os.urandom(6) for _ in keys]
+        for concealed in (False, True):
+            outputs = MilenageBatch(keys, OPc=opcs).f12345(rands, sqns, AMF, concealed)
+            for (i, key) in enumerate(keys):
+                expected = MilenageContext(key, OPc=opcs[i]).f12345(rands[i], sqns[i], AMF, concealed)
+                assert rows(outputs, i) == expected
+
+
+def test_aes_rows_fips_197():
+    # FIPS-197 appendix C.1, AES-128
+    key = bytes(range(16))
+    plaintext = bytes.fromhex('00112233445566778899aabbccddeeff')
+    keys = np.frombuffer(key * 3, np.uint8).reshape(3, 16)
+    blocks = np.frombuffer(plaintext * 3, np.uint8).reshape(3, 16)
+    ciphertext = AES_ECB_rows(keys).encrypt(blocks)
+    assert all(row.tobytes() == bytes.fromhex('69c4e0d86a7b0430d8cdb78070b4c55a') for row in ciphertext)
+
+
+def test_aes_rows_matches_backend():
+    keys = [os.urandom(16) for _ in range(8)]
+    blocks = np.frombuffer(os.urandom(8 * 5 * 16), np.uint8).reshape(8, 5, 16)
+    ciphertext = AES_ECB_rows(np.frombuffer(b''.join(keys), np.uint8).reshape(8, 16)).encrypt(blocks)
+    for (i, key) in enumerate(keys):
+        assert ciphertext[i].tobytes() == AES_ECB(key).encrypt(blocks[i].tobytes())
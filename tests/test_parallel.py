@@ -0,0 +1,37 @@
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from ingest import parallel
+from ingest.pcap import CaptureFile, capture_header
+from packet import FieldTable
+
+FRAMES = 10
+
+
+def fake_dissect(path, options, fields=None):
+    """Prints the frame number, the time since the first frame and the time since the previous frame."""
+    capture = CaptureFile(path)
+    times = [struct.unpack_from('<II', capture.record(number)) for number in range(1, len(capture) + 1)]
+    times = [seconds + microseconds / 1e6 for (seconds, microseconds) in times]
+    for (i, time) in enumerate(times):
+        delta = time - times[i - 1] if i else 0.0
+        yield FieldTable({}), f'{i + 1} {time - times[0]:.6f} {delta:.6f} LTE RRC 60 Packet'
+
+
+@pytest.fixture
+def capture(tmp_path, monkeypatch):
+    monkeypatch.setattr(parallel, 'ProcessPoolExecutor', ThreadPoolExecutor)
+    monkeypatch.setattr(parallel.tshark, 'dissect', fake_dissect)
+    path = tmp_path / 'capture.pcap'
+    records = b''.join(struct.pack('<IIII', 1000 + i, 250000 * i % 1000000, 4, 4) + bytes(4) for i in range(FRAMES))
+    path.write_bytes(capture_header(1) + records)
+    return str(path)
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, FRAMES])
+def test_chunks_match_full_capture(capture, monkeypatch, chunk_size):
+    monkeypatch.setattr(parallel, 'MIN_CHUNK_SIZE', chunk_size)
+    expected = [summary for (_, summary) in fake_dissect(capture, {})]
+    assert [summary for (_, summary) in parallel.dissect(capture, {}, jobs=2)] == expected
@@ -0,0 +1,63 @@
+import pytest
+
+from analyser.sessions import partition
+from captures import packet
+
+
+def connection(first, rnti, imsi=None, nas_tmsi=None, rrc_tmsi=None, release=True):
+    """Returns the packets of an RRC connection, with the identities the UE shows in it."""
+    request = {'mac-lte.rnti': rnti}
+    if rrc_tmsi:
+        request['lte-rrc.m_TMSI'] = rrc_tmsi
+    complete = {'mac-lte.rnti': rnti}
+    if nas_tmsi:
+        complete['nas_eps.emm.m_tmsi'] = nas_tmsi
+    if imsi:
+        complete['e212.imsi'] = imsi
+    packets = [packet(first, 'RRCConnectionRequest', '0', request),
+               packet(first + 1, 'RRCConnectionSetupComplete, Attach request', '0', complete)]
+    if release:
+        packets.append(packet(first + 2, 'RRCConnectionRelease', '1', {'mac-lte.rnti': rnti}))
+    return packets
+
+
+def session_ids(sessions):
+    return [[p.id for p in session.packets] for session in sessions]
+
+
+def test_rnti_reused_after_release():
+    packets = connection(1, '70', imsi='001010000000001') + connection(4, '70', imsi='001010000000002')
+    assert session_ids(partition(packets)) == [[1, 2, 3], [4, 5, 6]]
+
+
+def test_rnti_kept_until_release():
+    packets = connection(1, '70', release=False) + connection(3, '70', imsi='001010000000002')
+    assert session_ids(partition(packets)) == [[1, 2, 3, 4, 5]]
+
+
+def test_imsi_links_connections():
+    packets = connection(1, '70', imsi='001010000000001') + connection(4, '71', imsi='001010000000001')
+    sessions = partition(packets)
+    assert session_ids(sessions) == [[1, 2, 3, 4, 5, 6]]
+    assert sessions[0].rntis == ['70', '71']
+
+
+@pytest.mark.parametrize(('nas_tmsi', 'rrc_tmsi'), [
+    ('0xc0a81234', 'c0a81234'),  # the fields output of tshark shows the bit string without separators
+    ('3232240180', 'c0:a8:12:34'),
+    ('0x12345678', '12345678'),  # all digits, but still hexadecimal
+    ('305419896', '12345678'),
+])
+def test_m_tmsi_links_connections(nas_tmsi, rrc_tmsi):
+    packets = connection(1, '70', nas_tmsi=nas_tmsi) + connection(4, '71', rrc_tmsi=rrc_tmsi)
+    assert session_ids(partition(packets)) == [[1, 2, 3, 4, 5, 6]]
+
+
+def test_different_m_tmsi_not_linked():
+    packets = connection(1, '70', nas_tmsi='0x12345678') + connection(4, '71', rrc_tmsi='12345679')
+    assert session_ids(partition(packets)) == [[1, 2, 3], [4, 5, 6]]
+
+
+def test_malformed_m_tmsi_ignored():
+    packets = connection(1, '70', nas_tmsi='unknown') + connection(4, '71', rrc_tmsi='zz:zz')
+    assert session_ids(partition(packets)) == [[1, 2, 3], [4, 5, 6]]
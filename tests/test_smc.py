@@ -0,0 +1,43 @@
+from analyser.analysis import Analyser
+from analyser.categoriser import category_names
+from captures import attach, find, rule_ids
+from packet import FieldTable, sanitize_field_name
+
+
+def analyse(packets):
+    mask = 0
+    for p in packets:
+        mask |= p.category
+    ue_info = {}
+    Analyser(packets, category_names(mask), ue_info).analyse()
+    return ue_info
+
+
+def test_rrc_security_mode_command_element_matched_on_presence():
+    # the fields output of tshark shows the (FT_NONE) element of the command as 1
+    packets = attach()
+    command = find(packets, 'SecurityModeCommand')
+    assert command.data.get('lte-rrc.securityModeCommand_element') == '1'
+    ue_info = analyse(packets)
+    assert ue_info['locations']['rrc_smc'] == command.id
+    assert (ue_info['rrc_ca'], ue_info['rrc_ia']) == ('eea0', '128eia2')
+    assert 'smc.null-ciphering' in rule_ids(command)
+
+
+def test_rrc_security_mode_command_incapable_algorithm():
+    packets = attach()
+    command = find(packets, 'SecurityModeCommand')
+    fields = dict(command.data.items())
+    fields[sanitize_field_name('lte-rrc.cipheringAlgorithm')] = '3'  # EEA3, which the UE does not support
+    command.data = FieldTable(fields)
+    analyse(packets)
+    assert 'smc.rrc-ciphering-incapable' in rule_ids(command)
+    assert 'smc.rrc-failure-missing' in rule_ids(command)
+
+
+def test_pdcp_security_options_checked_after_command():
+    packets = attach()
+    capability = find(packets, 'UECapabilityInformation')  # PDCP integrity 1, the command chose 2
+    analyse(packets)
+    assert 'attach.pdcp-integrity-mismatch' in rule_ids(capability)
+    assert not any('attach.capability-before-security' in rule_ids(p) for p in packets)
@@ -0,0 +1,53 @@
+import weakref
+
+import pytest
+
+import ELVis
+from analyser import analysis
+from captures import attach, results
+from ingest import cache
+
+OPTIONS = {'cache': True, 'jobs': 1, 'full': False, 'stream': True}
+
+
+@pytest.fixture
+def capture(tmp_path, monkeypatch):
+    """Dissects an empty capture as the attach of two UEs, listing the dissections."""
+    monkeypatch.setattr(cache, 'CACHE_DIRECTORY', str(tmp_path / 'cache'))
+    path = tmp_path / 'capture.pcap'
+    path.write_bytes(b'')
+    calls = []
+
+    def dissect(path, options, fields=None, pool=None):
+        calls.append(path)
+        for packet in attach(2):
+            yield packet.data, packet.full_summary
+
+    monkeypatch.setattr(ELVis.tshark, 'dissect', dissect)
+    return str(path), calls
+
+
+def test_stream_is_not_cached(capture, tmp_path):
+    (path, calls) = capture
+    for _ in range(2):
+        assert len(list(ELVis.read_pcap(path, {}, OPTIONS))) == len(attach(2))
+    assert len(calls) == 2
+    assert not (tmp_path / 'cache').exists()
+
+
+def test_stream_releases_findings(capture):
+    """The findings of a packet are released once the packet is printed, unless the analysis holds on to it."""
+    stores = []
+    live = []
+    for packet in analysis.analyse_stream(ELVis.read_pcap(capture[0], {}, OPTIONS)):
+        live.append(sum(1 for store in stores if store() is not None))
+        if packet.findings is not None:
+            stores.append(weakref.ref(packet.findings))
+    assert len(stores) > 1
+    assert max(live) <= 1  # a packet the analysis still holds on to
+
+
+def test_stream_results(capture):
+    streamed = results(analysis.analyse_stream(ELVis.read_pcap(capture[0], {}, OPTIONS)))
+    packets = list(ELVis.read_pcap(capture[0], {}, dict(OPTIONS, stream=False)))
+    assert streamed == results(analysis.analyse_stream(packets))
@@ -0,0 +1,59 @@
+import sys
+
+import pytest
+
+from ingest import tshark
+from ingest.pool import TsharkPool
+
+FAILING = [sys.executable, '-c', 'import sys; print("1"); sys.stderr.write("bad profile\\n"); sys.exit(2)']
+LINES = [sys.executable, '-c', 'for i in range(100000): print(i)']
+
+
+def test_run_raises_error_output():
+    with pytest.raises(tshark.TsharkException, match='status 2: bad profile'):
+        list(tshark.run(FAILING))
+
+
+def test_run_stopped_early():
+    lines = tshark.run(LINES)
+    assert next(lines) == b'0\n'
+    lines.close()
+
+
+def test_pool_raises_error_output():
+    pool = TsharkPool(size=1)
+    try:
+        with pytest.raises(tshark.TsharkException, match='bad profile'):
+            list(pool.run(FAILING, b''))
+        lines = pool.run(LINES, b'')
+        assert next(lines) == b'0\n'
+        lines.close()
+    finally:
+        pool.close()
+
+
+def test_parse_document_summary_columns():
+    document = {'layers': {'_ws.col.No.': '1', '_ws.col.Protocol': 'LTE RRC', '_ws.col.Info': 'Attach request',
+                           'frame': {'frame_frame_number': '1'}, 'frame_raw': '00ff'}}
+    (fields, summary) = tshark.parse_document(document)
+    assert summary == '1 LTE RRC Attach request'
+    assert fields.get('frame_number') is None
+
+
+def test_parse_document_repeated_layers():
+    document = {'layers': {'_ws.col.No.': '7',
+                           'rlc-lte': [{'rlc-lte_rlc-lte_channel-id': '1'},
+                                       {'rlc-lte_rlc-lte_channel-id': '2', 'rlc-lte_rlc-lte_mode': '4'}]}}
+    (fields, summary) = tshark.parse_document(document)
+    assert summary == '7'
+    assert fields.get('rlc-lte.channel-id') == '1'
+    assert fields.get('rlc-lte.mode') == '4'
+
+
+def test_parse_document_elements_present():
+    # fields without a value (FT_NONE) are empty in the ek output, the fields output shows them as 1
+    document = {'layers': {'_ws.col.No.': '9', 'lte-rrc': {'lte-rrc_lte-rrc_securityModeCommand_element': '',
+                                                           'lte-rrc_lte-rrc_cipheringAlgorithm': '0'}}}
+    (fields, _) = tshark.parse_document(document)
+    assert fields.get('lte-rrc.securityModeCommand_element') == '1'
+    assert fields.get('lte-rrc.cipheringAlgorithm') == '0'